@@ -0,0 +1,237 @@
+"""
+Load test: Flask API (api.py, thread per request) vs ASGI API (asgi_app.py, event loop).
+
+Starts both servers with a simulated pipeline - each stage waits, as the Whisper
+and Groq calls do, instead of working - so the comparison measures how the
+servers hold up under concurrent uploads, not extraction speed. Each client
+uploads a WAV to /api/process-audio and polls /api/jobs/<id> until the job is
+done, while a probe measures /api/health latency under that load. Reports
+upload and end-to-end latency, throughput, 503s (ASGI route limits) and the
+server's peak thread count. Every upload is distinct audio, unless --same-audio:
+then duplicates join the job already extracting it (request coalescing).
+
+    python benchmarks/api_load.py --clients 64 --requests 4 --pipeline-ms 2000
+    python benchmarks/api_load.py --clients 64 --same-audio      # double submits / retries
+    python benchmarks/api_load.py --servers asgi --clients 200 --workers 64
+    python benchmarks/api_load.py --flask-url http://host:5000 --asgi-url http://host:8000   # running servers
+
+Needs flask + flask-cors and fastapi + uvicorn + python-multipart (requirements.txt).
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("transcribe", "extract", "persist")
+
+
+class SimulatedSystem:
+    """Stands in for MedicalSystem: each stage waits instead of calling Whisper / Groq"""
+
+    def __init__(self, pipeline_ms):
+        self.stage_sec = pipeline_ms / 1000 / len(STAGES)
+        self.pipeline = SimpleNamespace(stages=STAGES)
+
+    def _result(self, audio_path):
+        return {"success": True, "audio_file": audio_path, "patient_name": "Load Test", "medicines": []}
+
+    def process(self, audio_path, on_stage=None, on_stage_start=None, **kwargs):
+        for name in STAGES:
+            on_stage_start and on_stage_start(name)
+            time.sleep(self.stage_sec)
+            on_stage and on_stage(SimpleNamespace(name=name, status="ok", duration_sec=self.stage_sec))
+        return self._result(audio_path)
+
+    async def process_async(self, audio_path, on_stage=None, on_stage_start=None, **kwargs):
+        for name in STAGES:
+            on_stage_start and on_stage_start(name)
+            await asyncio.sleep(self.stage_sec)
+            on_stage and on_stage(SimpleNamespace(name=name, status="ok", duration_sec=self.stage_sec))
+        return self._result(audio_path)
+
+
+def serve(kind, port, pipeline_ms):
+    """Server process: the real app with the simulated pipeline"""
+    sys.path.insert(0, os.path.join(ROOT, "consultation_pages"))
+    if kind == "flask":
+        import api
+        api.medical_system = SimulatedSystem(pipeline_ms)
+        api.job_queue.start()
+        api.app.run(host="127.0.0.1", port=port, threaded=True)
+    else:
+        import uvicorn
+        import asgi_app
+        asgi_app.medical_system = SimulatedSystem(pipeline_ms)  # Before startup: lifespan starts the queue
+        uvicorn.run(asgi_app.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def spawn(kind, port, args, workdir):
+    env = dict(os.environ, JOBS_DB=os.path.join(workdir, f"{kind}_jobs.db"),
+               AUDIO_DIR=os.path.join(workdir, f"{kind}_audio"),
+               RESULTS_FILE=os.path.join(workdir, f"{kind}_result.json"),
+               JOB_WORKERS=str(args.workers), PROCESSING_CONCURRENCY=str(args.workers))
+    log = open(os.path.join(workdir, f"{kind}.log"), "w")
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", kind, "--port", str(port),
+                                "--pipeline-ms", str(args.pipeline_ms)], env=env, stdout=log, stderr=log)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if request(url, "GET", "/api/health")[0] == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start (see {log.name})")
+
+
+def request(url, method, path, body=None, headers=None, timeout=120):
+    """(status, parsed JSON body) of one HTTP request"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data) if data else {}
+        except ValueError:
+            return response.status, {}
+    finally:
+        conn.close()
+
+
+def wav_upload(seconds, field="audio", unique=False):
+    """(multipart body, headers) with a silent 16 kHz mono WAV (unique: first samples random)"""
+    pcm = (os.urandom(16) if unique else b"\x00" * 16) + b"\x00\x00" * (16000 * seconds - 8)
+    wav = (b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVEfmt " +
+           struct.pack("<IHHIIHH", 16, 1, 1, 16000, 32000, 2, 16) + b"data" + struct.pack("<I", len(pcm)) + pcm)
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"load.wav\"\r\n"
+            f"Content-Type: audio/wav\r\n\r\n").encode() + wav + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}", "Content-Length": str(len(body))}
+
+
+def run_client(url, requests, audio_sec, same_audio, poll_interval, stats, lock):
+    for _ in range(requests):
+        body, headers = wav_upload(audio_sec, unique=not same_audio)
+        t = time.perf_counter()
+        status, data = request(url, "POST", "/api/process-audio", body, headers)
+        accepted = time.perf_counter() - t
+        if status != 202:
+            with lock:
+                stats["rejected" if status == 503 else "errors"] += 1
+            continue
+        while True:
+            time.sleep(poll_interval)
+            _, job = request(url, "GET", data["status_url"])
+            if job.get("status") in ("done", "failed"):
+                break
+        with lock:
+            stats["coalesced"] += bool(data.get("coalesced"))
+            stats["upload"].append(accepted)
+            stats["end_to_end"].append(time.perf_counter() - t)
+            stats["done" if job["status"] == "done" else "errors"] += 1
+
+
+def thread_count(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("Threads:"))
+    except (OSError, StopIteration):
+        return 0  # Not Linux, or a remote server
+
+
+def load(name, url, pid, args):
+    stats = {"upload": [], "end_to_end": [], "health": [], "done": 0, "coalesced": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+    finished = threading.Event()
+    peak_threads = [0]
+
+    def probe():
+        while not finished.is_set():
+            t = time.perf_counter()
+            request(url, "GET", "/api/health")
+            stats["health"].append(time.perf_counter() - t)
+            if pid:
+                peak_threads[0] = max(peak_threads[0], thread_count(pid))
+            time.sleep(0.05)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        futures = [pool.submit(run_client, url, args.requests, args.audio_sec, args.same_audio, args.poll_interval,
+                               stats, lock)
+                   for _ in range(args.clients)]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - wall
+    finished.set()
+    prober.join()
+
+    print(f"\n{name} ({url}): {stats['done']} jobs in {wall:.2f}s = {stats['done'] / wall:.1f} jobs/s, "
+          f"{stats['coalesced']} coalesced, {stats['rejected']} rejected (503), {stats['errors']} errors"
+          + (f", peak {peak_threads[0]} threads" if peak_threads[0] else ""))
+    for metric in ("upload", "end_to_end", "health"):
+        values = sorted(stats[metric])
+        if values:
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            print(f"  {metric:<10} n={len(values):<5} median={statistics.median(values) * 1000:.1f}ms "
+                  f"p99={p99 * 1000:.1f}ms max={values[-1] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask vs ASGI API load test")
+    parser.add_argument("--servers", default="flask,asgi", help="Which to start (comma separated)")
+    parser.add_argument("--flask-url", help="Load an already running Flask server instead")
+    parser.add_argument("--asgi-url", help="Load an already running ASGI server instead")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=4, help="Uploads per client")
+    parser.add_argument("--audio-sec", type=int, default=5, help="Length of the uploaded WAV")
+    parser.add_argument("--same-audio", action="store_true", help="Every client uploads the same bytes")
+    parser.add_argument("--pipeline-ms", type=int, default=1000, help="Simulated pipeline time per job")
+    parser.add_argument("--workers", type=int, default=32, help="JOB_WORKERS / PROCESSING_CONCURRENCY")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="Seconds between job status polls")
+    parser.add_argument("--port", type=int, default=5100, help="First port for started servers")
+    parser.add_argument("--serve", choices=["flask", "asgi"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.pipeline_ms)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="voice_rx_api_load_")
+    given = {"flask": args.flask_url, "asgi": args.asgi_url}
+    kinds = [k for k in ("flask", "asgi") if given[k] or (k in args.servers.split(",") and not any(given.values()))]
+    print(f"{args.clients} clients x {args.requests} uploads of {args.audio_sec}s WAV, "
+          f"simulated pipeline {args.pipeline_ms}ms, {args.workers} workers")
+    for offset, kind in enumerate(kinds):
+        process = None
+        url = given[kind]
+        if url is None:
+            process, url = spawn(kind, args.port + offset, args, workdir)
+        try:
+            load(kind, url, process.pid if process else None, args)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    main()
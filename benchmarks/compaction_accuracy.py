@@ -0,0 +1,113 @@
+"""
+Accuracy-versus-savings benchmark for transcript compaction (src/compaction.py).
+
+Each recording is transcribed and normalized as in MedicalSystem.process, then
+extracted twice: from the full transcript (reference) and from the compacted one.
+Reported per context window: tokens kept, and how much of the reference
+prescription the compacted extraction still recovers (per-field recall).
+
+Record once (needs OPENAI_API_KEY / GROQ_API_KEY and network):
+    python benchmarks/compaction_accuracy.py --mode record --context 0 1 2
+
+Replay offline (same --context values as recorded):
+    python benchmarks/compaction_accuracy.py --context 0 1 2
+
+Plain-text transcripts (.txt) can be passed instead of audio.
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_EXTENSIONS = (".mp3", ".mp4", ".wav", ".webm", ".m4a")
+LIST_FIELDS = ("complaints", "diagnosis", "tests", "advice")
+
+
+def _items(data, field):
+    if field == "medicines":
+        return {str(m.get("name", "")).strip().lower() for m in data.get("medicines", []) if m.get("name")}
+    return {str(item).strip().lower() for item in data.get(field, []) if item}
+
+
+def _recall(reference, candidate):
+    return len(reference & candidate) / len(reference) if reference else 1.0
+
+
+def load_transcripts(paths, transcriber, cleaner, normalizer, collapser):
+    """(name, transcript, language) for each input, prepared as in MedicalSystem.process."""
+    for path in paths:
+        if path.lower().endswith(".txt"):
+            with open(path, encoding="utf-8") as f:
+                raw, language = f.read(), "en"
+        else:
+            result = transcriber.transcribe(path)
+            if not result.success:
+                print(f"[SKIP] {os.path.basename(path)}: {result.error}")
+                continue
+            raw, language = result.text, result.detected_language or "en"
+        text, _ = cleaner.clean(raw)
+        text, _ = normalizer.normalize(text)
+        text, _ = collapser.collapse(text)
+        yield os.path.basename(path), text, language
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript compaction: accuracy vs token savings")
+    parser.add_argument("inputs", nargs="*", help="Audio or .txt files (default: every audio file in data/)")
+    parser.add_argument("--mode", choices=["off", "record", "replay"], default="replay")
+    parser.add_argument("--fixtures", default=os.path.join(ROOT, "data", "fixtures"))
+    parser.add_argument("--context", type=int, nargs="+", default=[1], help="Context windows to compare")
+    parser.add_argument("--min-tokens", type=int, default=150, help="Compaction threshold")
+    args = parser.parse_args()
+
+    # Must be set before the pipeline modules create their clients
+    os.environ["VOICE_RX_REPLAY_MODE"] = args.mode
+    os.environ["VOICE_RX_FIXTURES_DIR"] = args.fixtures
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    from transcription import WhisperTranscriber, TranscriptCleaner
+    from normalization import TranscriptNormalizer, RepetitionCollapser
+    from extraction import GroqLLMExtractor
+    from compaction import TranscriptCompactor
+
+    inputs = args.inputs or sorted(
+        path for path in glob.glob(os.path.join(ROOT, "data", "*")) if path.lower().endswith(AUDIO_EXTENSIONS)
+    )
+    if not inputs:
+        sys.exit("No inputs found")
+
+    needs_audio = any(not path.lower().endswith(".txt") for path in inputs)
+    transcriber = WhisperTranscriber() if needs_audio else None
+    extractor = GroqLLMExtractor()
+    if not extractor.use_groq:
+        print("[WARN] Groq unavailable - comparing rules extraction only")
+
+    transcripts = list(load_transcripts(inputs, transcriber, TranscriptCleaner(),
+                                        TranscriptNormalizer(), RepetitionCollapser()))
+    references = {name: extractor.extract(text, use_groq=True, language=lang).get("data", {})
+                  for name, text, lang in transcripts}
+
+    fields = ("medicines",) + LIST_FIELDS
+    print(f"\n{'context':>7} {'file':<36} {'tokens':>13} {'kept':>6} " + " ".join(f"{f[:9]:>9}" for f in fields))
+    for context in args.context:
+        compactor = TranscriptCompactor(context_sentences=context, min_tokens=args.min_tokens)
+        kept_ratios, recalls = [], {f: [] for f in fields}
+        for name, text, lang in transcripts:
+            compaction = compactor.compact(text)
+            data = extractor.extract(compaction.text, use_groq=True, language=lang).get("data", {}) \
+                if compaction.applied else references[name]
+            row = {f: _recall(_items(references[name], f), _items(data, f)) for f in fields}
+            kept_ratios.append(compaction.kept_ratio)
+            for f in fields:
+                recalls[f].append(row[f])
+            print(f"{context:>7} {name[:36]:<36} {compaction.original_tokens:>6}→{compaction.compacted_tokens:<6} "
+                  f"{compaction.kept_ratio:>6.0%} " + " ".join(f"{row[f]:>9.0%}" for f in fields))
+        if transcripts:
+            print(f"{context:>7} {'MEAN':<36} {'':>13} {statistics.mean(kept_ratios):>6.0%} "
+                  + " ".join(f"{statistics.mean(recalls[f]):>9.0%}" for f in fields))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark/profile MedicalSystem.process end to end against recorded API fixtures.
+
+Record once (needs OPENAI_API_KEY / GROQ_API_KEY and network):
+    python benchmarks/replay_pipeline.py --mode record
+
+Replay offline and deterministically (no keys, no network):
+    python benchmarks/replay_pipeline.py --repeat 5
+    python benchmarks/replay_pipeline.py --replay-latency       # include recorded API latency
+    python benchmarks/replay_pipeline.py --profile profile.out  # cProfile the whole run
+"""
+
+import argparse
+import cProfile
+import glob
+import os
+import pstats
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_EXTENSIONS = (".mp3", ".mp4", ".wav", ".webm", ".m4a")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on recorded fixtures")
+    parser.add_argument("audio", nargs="*", help="Audio files (default: every audio file in data/)")
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--fixtures", default=os.path.join(ROOT, "data", "fixtures"))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per file (replay mode)")
+    parser.add_argument("--replay-latency", action="store_true", help="Sleep for recorded API latency")
+    parser.add_argument("--profile", metavar="FILE", help="Write cProfile stats to FILE and print the top 25")
+    parser.add_argument("--reporter", choices=["console", "null", "events"], default="null",
+                        help="Progress sink (default null: time the pipeline, not the console)")
+    args = parser.parse_args()
+
+    # Must be set before the pipeline modules create their clients
+    os.environ["VOICE_RX_REPLAY_MODE"] = args.mode
+    os.environ["VOICE_RX_FIXTURES_DIR"] = args.fixtures
+    os.environ["VOICE_RX_REPLAY_LATENCY"] = "true" if args.replay_latency else "false"
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    from medical_system_v2 import MedicalSystem
+    from reporting import make_reporter
+
+    audio_files = args.audio or sorted(
+        path for path in glob.glob(os.path.join(ROOT, "data", "*")) if path.lower().endswith(AUDIO_EXTENSIONS)
+    )
+    if not audio_files:
+        sys.exit("No audio files found")
+
+    system = MedicalSystem(reporter=make_reporter(args.reporter))
+    repeat = 1 if args.mode == "record" else max(1, args.repeat)
+    profiler = cProfile.Profile() if args.profile else None
+    timings = {path: [] for path in audio_files}
+
+    for _ in range(repeat):
+        for path in audio_files:
+            if profiler:
+                profiler.enable()
+            start = time.perf_counter()
+            result = system.process(path, deadline_sec=None)
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+            timings[path].append(elapsed)
+            status = "ok" if result.get("success") else f"failed: {result.get('error')}"
+            print(f"[BENCH] {os.path.basename(path)}: {elapsed:.3f}s ({status})")
+
+    print("\n" + "=" * 80)
+    print(f"{'file':<50} {'runs':>5} {'median':>10} {'min':>10}")
+    for path, values in timings.items():
+        print(f"{os.path.basename(path)[:50]:<50} {len(values):>5} "
+              f"{statistics.median(values):>9.3f}s {min(values):>9.3f}s")
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Load test for concurrent live consultations (SessionRegistry).
+
+Many doctors record at once: every simulated session starts, uploads audio
+chunks at recording pace and stops, all in parallel. Checks that no session
+sees another's audio (each writes a distinct byte pattern) and reports
+per-operation latency and the peak number of live sessions.
+
+    python benchmarks/session_load.py --sessions 200 --chunks 30
+    python benchmarks/session_load.py --sessions 50 --api    # through the Flask endpoints
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RegistryClient:
+    """Drives a SessionRegistry directly"""
+
+    def __init__(self, audio_dir, max_sessions, spool_bytes):
+        sys.path.insert(0, os.path.join(ROOT, "src"))
+        from session_registry import SessionRegistry
+        self.registry = SessionRegistry(audio_dir, max_sessions=max_sessions, spool_bytes=spool_bytes)
+
+    def start(self):
+        return self.registry.start().id
+
+    def append(self, session_id, chunk):
+        self.registry.append(session_id, chunk)
+
+    def stop(self, session_id):
+        return self.registry.stop(session_id)
+
+    def active(self):
+        return self.registry.stats()["active"]
+
+
+class ApiClient:
+    """Drives the Flask endpoints in-process (needs flask installed)"""
+
+    def __init__(self, audio_dir, max_sessions, spool_bytes):
+        sys.path.insert(0, os.path.join(ROOT, "consultation_pages"))
+        import api
+        from session_registry import SessionRegistry
+        api.sessions = SessionRegistry(audio_dir, max_sessions=max_sessions, spool_bytes=spool_bytes)
+        api.medical_system = None  # Measure session handling, not extraction
+        self.api = api
+        self.local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self.local, "client"):
+            self.local.client = self.api.app.test_client()
+        return self.local.client
+
+    def start(self):
+        response = self.client.post("/api/start-consultation", json={})
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()["session_id"]
+
+    def append(self, session_id, chunk):
+        response = self.client.post(f"/api/consultations/{session_id}/audio", data=chunk)
+        assert response.status_code == 200, response.get_json()
+
+    def stop(self, session_id):
+        audio_file = self.api.sessions.get(session_id, touch=False).audio_file
+        self.client.post("/api/stop-consultation", json={"session_id": session_id})
+        return audio_file
+
+    def active(self):
+        return self.api.sessions.stats()["active"]
+
+
+def run_session(client, index, chunks, chunk_bytes, interval, latencies, lock):
+    """One consultation: start, upload chunks, stop; returns (audio file, expected bytes)"""
+    pattern = bytes([index % 251]) * chunk_bytes
+    timings = {"start": [], "append": [], "stop": []}
+
+    t = time.perf_counter()
+    session_id = client.start()
+    timings["start"].append(time.perf_counter() - t)
+    for _ in range(chunks):
+        time.sleep(interval)
+        t = time.perf_counter()
+        client.append(session_id, pattern)
+        timings["append"].append(time.perf_counter() - t)
+    t = time.perf_counter()
+    audio_file = client.stop(session_id)
+    timings["stop"].append(time.perf_counter() - t)
+
+    with lock:
+        for op, values in timings.items():
+            latencies[op].extend(values)
+    return audio_file, pattern * chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent consultation sessions load test")
+    parser.add_argument("--sessions", type=int, default=100, help="Simultaneous consultations")
+    parser.add_argument("--chunks", type=int, default=20, help="Audio chunks per consultation")
+    parser.add_argument("--chunk-kb", type=int, default=16, help="Chunk size (~1 s of compressed audio)")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between a session's chunks")
+    parser.add_argument("--spool-kb", type=int, default=256, help="Audio kept in memory per session")
+    parser.add_argument("--api", action="store_true", help="Go through the Flask endpoints")
+    args = parser.parse_args()
+
+    audio_dir = tempfile.mkdtemp(prefix="voice_rx_sessions_")
+    client_cls = ApiClient if args.api else RegistryClient
+    client = client_cls(audio_dir, max_sessions=args.sessions, spool_bytes=args.spool_kb * 1024)
+    latencies = {"start": [], "append": [], "stop": []}
+    lock = threading.Lock()
+    peak = [0]
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            peak[0] = max(peak[0], client.active())
+            time.sleep(0.01)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(run_session, client, i, args.chunks, args.chunk_kb * 1024, args.interval,
+                               latencies, lock) for i in range(args.sessions)]
+        outcomes = [future.result() for future in futures]
+    wall = time.perf_counter() - wall
+    done.set()
+    watcher.join()
+
+    corrupted = 0
+    for audio_file, expected in outcomes:
+        with open(audio_file, "rb") as f:
+            corrupted += f.read() != expected
+
+    print(f"{args.sessions} sessions x {args.chunks} chunks of {args.chunk_kb} KB "
+          f"({'api' if args.api else 'registry'}) in {wall:.2f}s, peak {peak[0]} live")
+    for op, values in latencies.items():
+        values = sorted(values)
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        print(f"  {op:<7} n={len(values):<6} median={statistics.median(values) * 1000:.2f}ms "
+              f"p99={p99 * 1000:.2f}ms max={values[-1] * 1000:.2f}ms")
+    print(f"  audio files intact: {len(outcomes) - corrupted}/{len(outcomes)}")
+    if corrupted:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
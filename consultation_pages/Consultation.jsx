@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import "bootstrap/dist/css/bootstrap.min.css";
 
 import ConsultationDetails from "./ConsultationDetails/ConsultationDetails";
@@ -14,6 +14,10 @@ const Consultation = () => {
   const [isRecording, setIsRecording] = useState(false);
   const [loading, setLoading] = useState(false);
   const [extractedData, setExtractedData] = useState(null);
+  const [progress, setProgress] = useState(null);
+  const sessionIdRef = useRef(null);
+  const recorderRef = useRef(null);
+  const uploadsRef = useRef(Promise.resolve());
 
   // Load extracted data on mount
   useEffect(() => {
@@ -32,6 +36,74 @@ const Consultation = () => {
     }
   };
 
+  // Follow a background job over Server-Sent Events: stage progress, the transcript and
+  // streamed (provisional) medicines arrive before the final result
+  const waitForJob = (jobId) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(`/api/jobs/${jobId}/events`);
+      const on = (event, handler) =>
+        source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+
+      setProgress({ stage: null, completed: 0, total: 0 });
+      on("stage_start", (data) => setProgress((p) => ({ ...p, stage: data.stage })));
+      on("stage_finish", (data) =>
+        setProgress((p) => ({ ...p, completed: data.stages_completed, total: data.stages_total }))
+      );
+      on("transcript", (data) => setExtractedData((d) => ({ ...d, transcript: data.text, provisional: true })));
+      on("field", (data) => setExtractedData((d) => ({ ...d, ...data, provisional: true })));
+      on("medicine", (medicine) =>
+        setExtractedData((d) => ({ ...d, medicines: [...(d?.medicines || []), medicine], provisional: true }))
+      );
+      let done = false;
+      on("done", (data) => {
+        done = true;
+        setProgress(null);
+        if (!data.result?.provisional) source.close();
+        resolve(data.result);
+      });
+      // Provisional result: stop waiting for its upgrade when it fails or the stream drops (no reconnect loop)
+      on("upgrade_failed", () => source.close());
+      source.addEventListener("error", () => {
+        if (done) source.close();
+      });
+      on("upgraded", (data) => {
+        source.close();
+        setProgress(null);
+        setExtractedData(data.result);
+        resolve(data.result); // No-op after done; ends the wait if done was missed
+      });
+      on("failed", (data) => {
+        source.close();
+        setProgress(null);
+        reject(new Error(data.error || "Extraction failed"));
+      });
+    });
+
+  // Record in the browser and upload chunks to this consultation's session as they arrive
+  const startRecorder = async (sessionId) => {
+    const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    const recorder = new MediaRecorder(stream, { mimeType: "audio/webm" });
+    recorder.ondataavailable = (e) => {
+      if (!e.data.size) return;
+      uploadsRef.current = uploadsRef.current.then(() =>
+        fetch(`/api/consultations/${sessionId}/audio`, { method: "POST", body: e.data })
+      );
+    };
+    recorder.start(1000);
+    recorderRef.current = recorder;
+  };
+
+  const stopRecorder = () =>
+    new Promise((resolve) => {
+      const recorder = recorderRef.current;
+      if (!recorder || recorder.state === "inactive") return resolve();
+      recorder.onstop = () => {
+        recorder.stream.getTracks().forEach((track) => track.stop());
+        resolve();
+      };
+      recorder.stop();
+    });
+
   const handleStartRecording = async () => {
     try {
       setIsRecording(true);
@@ -39,8 +111,12 @@ const Consultation = () => {
       const response = await fetch("/api/start-consultation", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ format: "webm" }),
       });
       if (!response.ok) throw new Error("Failed to start recording");
+      const session = await response.json();
+      sessionIdRef.current = session.session_id;
+      await startRecorder(session.session_id);
       setLoading(false);
     } catch (error) {
       console.error("Recording error:", error);
@@ -53,13 +129,18 @@ const Consultation = () => {
     try {
       setIsRecording(false);
       setLoading(true);
+      await stopRecorder();
+      await uploadsRef.current; // Last chunk uploaded before the session closes
       const response = await fetch("/api/stop-consultation", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ session_id: sessionIdRef.current }),
       });
       if (response.ok) {
         const result = await response.json();
-        setExtractedData(result);
+        // Extraction runs as a background job: follow its event stream until it finishes
+        if (result.job_id) setExtractedData(null);
+        setExtractedData(result.job_id ? await waitForJob(result.job_id) : result);
       }
       setLoading(false);
     } catch (error) {
@@ -145,7 +226,10 @@ const Consultation = () => {
 
       {loading && (
         <div className="alert alert-warning mb-3" style={{ backgroundColor: "#fff3cd", color: "#856404" }}>
-          ⏳ Processing audio... Please wait.
+          ⏳ Processing audio...{" "}
+          {progress?.total
+            ? `${progress.stage || "finishing"} (${progress.completed}/${progress.total} stages)`
+            : "Please wait."}
         </div>
       )}
 
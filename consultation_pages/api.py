@@ -6,22 +6,39 @@ Connects React frontend to medical_system_v2.py for extraction
 import os
 import json
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 from datetime import datetime
-from pathlib import Path
 
-# Import medical system
-import sys
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+# Import medical system (api_common puts src/ on the path)
+from api_common import (AUDIO_DIR, RESULTS_FILE, UPLOAD_MAX_MB, UPLOAD_MAX_BYTES, LIVE_EXTRACTION_DEADLINE_SEC,
+                        JOBS_DB, JOB_WORKERS, JOB_LEASE_SEC, SSE_HEADERS, COALESCE_WAIT_SEC, UNAVAILABLE_CONSULTATION,
+                        UNAVAILABLE_REACT_UPLOAD, UNAVAILABLE_WEB_UPLOAD, JobEventStream, make_session_registry,
+                        make_coalescer, make_upload, upload_path, discard_upload, save_result, pipeline_callbacks,
+                        job_payload, coalesce_key, job_accepted, build_prescription_pdf)
 
 try:
     from medical_system_v2 import MedicalSystem
+    from reporting import make_reporter
 except ImportError:
     MedicalSystem = None
+from job_queue import JobQueue, SQLiteJobBackend
+from session_registry import SessionLimitError
+from upload_stream import UploadRejected
+
+
+class UploadRequest(Request):
+    """Writes uploaded files into a StreamingUpload as the body is parsed (rejects early)"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return make_upload()
+
 
 # Configure Flask
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES + 64 * 1024  # Multipart overhead
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 # Setup logging
@@ -30,23 +47,95 @@ logger = logging.getLogger(__name__)
 
 # Initialize medical system
 try:
-    medical_system = MedicalSystem()
+    # Server path: structured events, no console banners or transcript text
+    medical_system = MedicalSystem(reporter=make_reporter(os.getenv("VOICE_RX_REPORTER", "events")))
 except Exception as e:
     logger.warning(f"Medical system not available: {e}")
     medical_system = None
 
-# Audio storage
-AUDIO_DIR = Path(__file__).parent / "data" / "audio"
-AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+# Live consultations: one recording session per doctor (session id from /api/start-consultation)
+sessions = make_session_registry()
+
+# Double-submitted / retried uploads share the job already extracting the same audio
+coalescer = make_coalescer(medical_system)
 
-RESULTS_FILE = Path(__file__).parent.parent / "data" / "live_consultation_result.json"
 
-# Global recording state
-recording_session = {
-    "is_recording": False,
-    "audio_file": None,
-    "start_time": None,
-}
+def _run_job(job, progress):
+    """Job handler: run the pipeline, reporting stages and partial results as progress and job events"""
+    callbacks = pipeline_callbacks(job_queue, job, progress, len(medical_system.pipeline.stages))
+    key = coalesce_key(job.payload)
+    try:
+        result = medical_system.process(job.payload["audio_path"], **callbacks)
+        save_result(result)
+    except BaseException:
+        coalescer.finish(key, job.id, succeeded=False)
+        raise
+    coalescer.finish(key, job.id, succeeded=bool(result.get("success")))  # Failures come back as success=False
+    return result
+
+
+def _queue_job(audio_path, deadline_sec=LIVE_EXTRACTION_DEADLINE_SEC, audio_sha256=None):
+    """202 response with the id of a queued extraction job, or of the job already extracting this audio"""
+    payload = job_payload(audio_path, deadline_sec, audio_sha256)
+    flight, leader = coalescer.join(coalesce_key(payload))
+    if not leader:
+        discard_upload(audio_path)  # The joined job reads the first upload of these bytes
+        if not flight.wait_submitted(COALESCE_WAIT_SEC):
+            return jsonify({"error": "Could not queue extraction, retry"}), 503
+        return jsonify(job_accepted(flight.job_id, coalesced=True, finished=flight.finished)), 202
+    try:
+        job_queue.submit(payload, job_id=flight.job_id)
+    except Exception:
+        coalescer.abandon(flight)
+        raise
+    coalescer.submitted(flight)
+    return jsonify(job_accepted(flight.job_id)), 202
+
+
+job_queue = JobQueue(_run_job, SQLiteJobBackend(JOBS_DB), workers=JOB_WORKERS, lease_sec=JOB_LEASE_SEC)
+if medical_system:
+    job_queue.start()
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Status, progress and (once done) result of an extraction job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+
+def _job_event_stream(job_id, last_seq):
+    """SSE frames for a job's events after last_seq; ends once the final result is out"""
+    stream = JobEventStream(last_seq)
+    while True:
+        events = job_queue.events(job_id, after_seq=stream.last_seq)
+        for event in events:
+            yield stream.frame(event)
+            if stream.finished:
+                return
+        frame = stream.idle(None if events else job_queue.get(job_id))
+        if frame:
+            yield frame
+        if stream.finished:
+            return
+        job_queue.wait_for_events(timeout=1.0)  # Woken at once by this process's workers
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def get_job_events(job_id):
+    """
+    Server-Sent Events stream of a job: started, stage_start / stage_finish (with
+    duration_ms), transcript, field / medicine (streamed, provisional), then done
+    or failed (and upgraded or upgrade_failed, for a provisional result). Reconnects resume after
+    the Last-Event-ID header.
+    """
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    last_seq = JobEventStream.parse_last_seq(request.headers.get("Last-Event-ID") or request.args.get("after"))
+    return Response(stream_with_context(_job_event_stream(job_id, last_seq)), mimetype="text/event-stream",
+                    headers=SSE_HEADERS)
 
 
 @app.route("/api/health", methods=["GET"])
@@ -55,24 +144,31 @@ def health():
     return jsonify({"status": "ok", "service": "Medical Consultation API"})
 
 
+def _session_id():
+    """Session id of a request: JSON body, query string or X-Session-Id header"""
+    body = request.get_json(silent=True) or {}
+    return body.get("session_id") or request.args.get("session_id") or request.headers.get("X-Session-Id")
+
+
 @app.route("/api/start-consultation", methods=["POST"])
 def start_consultation():
-    """Start recording audio for consultation"""
+    """Start a recording session for a consultation; returns its session_id"""
     try:
-        # Generate unique filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        audio_file = AUDIO_DIR / f"consultation_{timestamp}.wav"
+        body = request.get_json(silent=True) or {}
+        try:
+            session = sessions.start(body.get("session_id"), suffix="." + body.get("format", "wav"))
+        except SessionLimitError as e:
+            return jsonify({"error": str(e)}), 503
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        recording_session["is_recording"] = True
-        recording_session["audio_file"] = str(audio_file)
-        recording_session["start_time"] = datetime.now().isoformat()
-
-        logger.info(f"📍 Consultation started: {audio_file}")
+        logger.info(f"📍 Consultation started: {session.audio_file}")
 
         return jsonify({
             "status": "recording_started",
-            "audio_file": str(audio_file),
-            "timestamp": recording_session["start_time"],
+            "session_id": session.id,
+            "audio_file": session.audio_file,
+            "timestamp": session.started_at,
         })
 
     except Exception as e:
@@ -80,44 +176,46 @@ def start_consultation():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/consultations/<session_id>/audio", methods=["POST"])
+def append_consultation_audio(session_id):
+    """Append a recorded audio chunk (raw request body) to a session"""
+    try:
+        total = sessions.append(session_id, request.get_data())
+    except KeyError:
+        return jsonify({"error": "No active recording"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify({"session_id": session_id, "bytes_received": total})
+
+
 @app.route("/api/stop-consultation", methods=["POST"])
 def stop_consultation():
-    """Stop recording and extract consultation data"""
+    """Stop a session's recording and extract consultation data"""
     try:
-        if not recording_session["is_recording"]:
+        session_id = _session_id()
+        if not session_id:
+            return jsonify({"error": "session_id required"}), 400
+        try:
+            audio_file = sessions.stop(session_id)
+        except KeyError:
             return jsonify({"error": "No active recording"}), 400
 
-        recording_session["is_recording"] = False
-        audio_file = recording_session["audio_file"]
-
-        if not os.path.exists(audio_file):
-            logger.error(f"❌ Audio file not found: {audio_file}")
+        if audio_file is None:
+            logger.error(f"❌ No audio recorded for session {session_id}")
             return jsonify({"error": "Audio file not saved"}), 400
 
         logger.info(f"⏹️  Processing audio: {audio_file}")
 
-        # Process audio with medical system if available
+        # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
         if medical_system:
-            result = medical_system.process(audio_file)
+            logger.info(f"✅ Consultation queued for extraction")
+            return _queue_job(audio_file)
         else:
             # Return mock data if medical system not available
-            result = {
-                "success": False,
-                "error": "Medical system not available",
-                "patient_name": None,
-                "complaints": [],
-                "diagnosis": [],
-                "medicines": [],
-                "tests": [],
-                "advice": []
-            }
+            result = UNAVAILABLE_CONSULTATION
 
         # Save result to JSON file
-        RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(RESULTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-
-        logger.info(f"✅ Consultation extracted and saved")
+        save_result(result)
 
         return jsonify(result)
 
@@ -166,56 +264,58 @@ def get_consultation_data():
 
 @app.route("/api/status", methods=["GET"])
 def get_status():
-    """Get current recording status"""
-    return jsonify({
-        "is_recording": recording_session["is_recording"],
-        "start_time": recording_session["start_time"],
-        "audio_file": recording_session["audio_file"],
-    })
+    """Recording status of a session (?session_id=...), or session counts without one"""
+    session_id = _session_id()
+    if not session_id:
+        return jsonify(sessions.stats())
+    session = sessions.get(session_id)  # Polling status keeps the session alive
+    if session is None:
+        return jsonify({"session_id": session_id, "is_recording": False}), 404
+    return jsonify(session.to_dict())
+
+
+def _receive_upload(field, prefix):
+    """
+    Save the streamed upload in form field `field` under AUDIO_DIR; returns (UploadInfo, None)
+    or (None, error response). Oversized, overlong or non-audio uploads were already cut off
+    while the body was being read.
+    """
+    try:
+        upload = request.files.get(field)
+    except UploadRejected as e:
+        return None, (jsonify({"error": str(e)}), e.status)
+    except RequestEntityTooLarge:
+        return None, (jsonify({"error": f"Upload exceeds {UPLOAD_MAX_MB:.0f} MB"}), 413)
+    if upload is None:
+        logger.error("❌ No audio file provided")
+        return None, (jsonify({"error": "No audio file provided"}), 400)
+    if upload.filename == "":
+        return None, (jsonify({"error": "No file selected"}), 400)
+
+    try:
+        info = upload.stream.save(str(upload_path(prefix, upload.stream)))
+    except UploadRejected as e:
+        return None, (jsonify({"error": str(e)}), e.status)
+    return info, None
 
 
 @app.route("/api/process-audio", methods=["POST"])
 def api_process_audio():
     """Process uploaded audio file from React frontend"""
     try:
-        if "audio" not in request.files:
-            logger.error("❌ No audio file provided")
-            return jsonify({"error": "No audio file provided"}), 400
+        # Streamed to disk and hashed as it arrives
+        upload, error = _receive_upload("audio", "react_upload")
+        if error:
+            return error
 
-        audio_file = request.files["audio"]
-        if audio_file.filename == "":
-            return jsonify({"error": "No file selected"}), 400
+        logger.info(f"📍 Processing uploaded audio from React: {upload.path}")
 
-        # Save uploaded audio
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        audio_path = AUDIO_DIR / f"react_upload_{timestamp}.webm"
-        audio_path.parent.mkdir(parents=True, exist_ok=True)
-        audio_file.save(str(audio_path))
-
-        logger.info(f"📍 Processing uploaded audio from React: {audio_path}")
-
-        # Process with medical system if available
+        # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
         if medical_system:
-            result = medical_system.process(str(audio_path))
-  # Save result to JSON file
-            RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
-            with open(RESULTS_FILE, "w", encoding="utf-8") as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
-            
-            return jsonify({"prescription": result})
+            return _queue_job(upload.path, audio_sha256=upload.sha256)
         else:
             # Return mock data if medical system not available
-            mock_result = {
-                "patient_name": "Patient",
-                "age": 35,
-                "gender": "Male",
-                "complaints": ["Not available"],
-                "diagnosis": ["Unable to process"],
-                "medicines": [],
-                "tests": [],
-                "advice": ["Please try again"]
-            }
-            return jsonify({"prescription": mock_result})
+            return jsonify(UNAVAILABLE_REACT_UPLOAD)
 
     except Exception as e:
         logger.error(f"❌ Error processing audio: {str(e)}")
@@ -228,36 +328,18 @@ def api_process_audio():
 def process_audio():
     """Process uploaded audio file - for HTML frontend"""
     try:
-        if "file" not in request.files:
-            return jsonify({"error": "No file provided"}), 400
-
-        file = request.files["file"]
-        if file.filename == "":
-            return jsonify({"error": "No file selected"}), 400
+        # Streamed to disk and hashed as it arrives
+        upload, error = _receive_upload("file", "web_upload")
+        if error:
+            return error
 
-        # Save uploaded audio
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        audio_file = AUDIO_DIR / f"web_upload_{timestamp}.webm"
-        file.save(str(audio_file))
+        logger.info(f"📍 Processing uploaded audio: {upload.path}")
 
-        logger.info(f"📍 Processing uploaded audio: {audio_file}")
-
-        # Process with medical system if available
+        # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
         if medical_system:
-            result = medical_system.process(str(audio_file))
-            result["prescription"] = result  # Frontend expects "prescription" key
+            return _queue_job(upload.path, deadline_sec=None, audio_sha256=upload.sha256)
         else:
-            result = {
-                "error": "Medical system not available",
-                "prescription": {
-                    "patient_name": "",
-                    "complaints": [],
-                    "diagnosis": [],
-                    "medicines": [],
-                    "tests": [],
-                    "advice": []
-                }
-            }
+            result = UNAVAILABLE_WEB_UPLOAD
 
         return jsonify(result)
 
@@ -270,83 +352,7 @@ def process_audio():
 def generate_pdf():
     """Generate PDF from prescription data - for HTML frontend"""
     try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.lib import colors
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet
-        from io import BytesIO
-
-        data = request.json
-        
-        # Create PDF in memory
-        pdf_buffer = BytesIO()
-        doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-
-        # Title
-        title = Paragraph("<b>Medical Prescription</b>", styles['Heading1'])
-        elements.append(title)
-        elements.append(Spacer(1, 0.3))
-
-        # Patient info
-        patient_text = f"<b>Patient:</b> {data.get('patient_name', 'N/A')}"
-        elements.append(Paragraph(patient_text, styles['Normal']))
-        elements.append(Spacer(1, 0.2))
-
-        # Complaints
-        if data.get('complaints'):
-            complaints_text = f"<b>Complaints:</b> {data.get('complaints', '')}"
-            elements.append(Paragraph(complaints_text, styles['Normal']))
-            elements.append(Spacer(1, 0.2))
-
-        # Diagnosis
-        if data.get('diagnosis'):
-            diagnosis_text = f"<b>Diagnosis:</b> {data.get('diagnosis', '')}"
-            elements.append(Paragraph(diagnosis_text, styles['Normal']))
-            elements.append(Spacer(1, 0.3))
-
-        # Medicines table
-        if data.get('medicines'):
-            elements.append(Paragraph("<b>Medicines:</b>", styles['Heading2']))
-            med_data = [["Name", "Dose", "Timing", "Duration", "Food Instruction"]]
-            for med in data.get('medicines', []):
-                med_data.append([
-                    med.get('name', ''),
-                    med.get('dose', ''),
-                    med.get('timing', ''),
-                    med.get('duration', ''),
-                    med.get('instruction', '')
-                ])
-            med_table = Table(med_data)
-            med_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(med_table)
-            elements.append(Spacer(1, 0.3))
-
-        # Tests
-        if data.get('tests'):
-            tests_text = f"<b>Tests:</b> {data.get('tests', '')}"
-            elements.append(Paragraph(tests_text, styles['Normal']))
-            elements.append(Spacer(1, 0.2))
-
-        # Advice
-        if data.get('advice'):
-            advice_text = f"<b>Advice:</b> {data.get('advice', '')}"
-            elements.append(Paragraph(advice_text, styles['Normal']))
-
-        # Build PDF
-        doc.build(elements)
-        pdf_buffer.seek(0)
-
-        return pdf_buffer.getvalue(), 200, {
+        return build_prescription_pdf(request.json), 200, {
             'Content-Type': 'application/pdf',
             'Content-Disposition': 'attachment; filename=prescription.pdf'
         }
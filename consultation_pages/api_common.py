@@ -0,0 +1,363 @@
+"""
+Shared pieces of the consultation API, used by both servers:
+api.py (Flask, threads) and asgi_app.py (FastAPI, event loop).
+
+Configuration (env), the latest-result file, the job → pipeline callback wiring,
+Server-Sent Events framing and PDF rendering live here, so the two apps expose
+the same routes with the same behaviour and differ only in how they serve them.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from coalescing import RequestCoalescer
+from session_registry import SessionRegistry
+from upload_stream import StreamingUpload
+
+logger = logging.getLogger(__name__)
+
+# Audio storage (recordings and uploads)
+AUDIO_DIR = Path(os.getenv("AUDIO_DIR", str(Path(__file__).parent / "data" / "audio")))
+AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+
+RESULTS_FILE = Path(os.getenv("RESULTS_FILE",
+                              str(Path(__file__).parent.parent / "data" / "live_consultation_result.json")))
+
+# Audio uploads: streamed to disk, checked and hashed chunk by chunk
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "50"))
+UPLOAD_MAX_DURATION_SEC = float(os.getenv("UPLOAD_MAX_DURATION_SEC", "3600"))
+UPLOAD_SPOOL_KB = int(os.getenv("UPLOAD_SPOOL_KB", "1024"))
+UPLOAD_MAX_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024)
+
+# Live consultations: answer within this SLA (rules result, marked provisional) and
+# let the Groq result upgrade RESULTS_FILE when it arrives
+LIVE_EXTRACTION_DEADLINE_SEC = float(os.getenv("LIVE_EXTRACTION_DEADLINE_SEC", "20"))
+
+# Background extraction: uploads return a job id at once, workers run the pipeline
+JOBS_DB = os.getenv("JOBS_DB", str(Path(__file__).parent / "data" / "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SEC = float(os.getenv("JOB_LEASE_SEC", "600"))
+
+# /api/jobs/<id>/events: keep-alive comment interval, and how long a stream stays open
+# after a provisional result waiting for its Groq upgrade
+SSE_KEEPALIVE_SEC = float(os.getenv("SSE_KEEPALIVE_SEC", "15"))
+SSE_UPGRADE_WAIT_SEC = float(os.getenv("SSE_UPGRADE_WAIT_SEC", "120"))
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Duplicate uploads (same bytes and deadline) join the job already extracting them; a finished
+# job stays joinable this long. A duplicate waits up to COALESCE_WAIT_SEC for that job to be queued
+COALESCE_WINDOW_SEC = float(os.getenv("COALESCE_WINDOW_SEC", "300"))
+COALESCE_WAIT_SEC = float(os.getenv("COALESCE_WAIT_SEC", "5"))
+
+# Live consultations: one recording session per doctor (session id from /api/start-consultation)
+SESSION_MAX = int(os.getenv("SESSION_MAX", "64"))
+SESSION_IDLE_TIMEOUT_SEC = float(os.getenv("SESSION_IDLE_TIMEOUT_SEC", "900"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "200"))
+
+
+def make_session_registry() -> SessionRegistry:
+    return SessionRegistry(AUDIO_DIR, max_sessions=SESSION_MAX, idle_timeout_sec=SESSION_IDLE_TIMEOUT_SEC,
+                           max_session_bytes=int(SESSION_MAX_MB * 1024 * 1024))
+
+
+def make_coalescer(medical_system) -> RequestCoalescer:
+    """Single-flight map for upload jobs, counting joined duplicates in the system's metrics"""
+    on_coalesced = medical_system.metrics_collector.record_coalesced if medical_system else None
+    return RequestCoalescer(window_sec=COALESCE_WINDOW_SEC, on_coalesced=on_coalesced)
+
+
+def make_upload() -> StreamingUpload:
+    """Receiver for one uploaded audio file (limits from the UPLOAD_* settings)"""
+    return StreamingUpload(max_bytes=UPLOAD_MAX_BYTES, max_duration_sec=UPLOAD_MAX_DURATION_SEC,
+                           spool_bytes=UPLOAD_SPOOL_KB * 1024, spool_dir=str(AUDIO_DIR))
+
+
+def upload_extension(audio_format: str) -> str:
+    """File extension for a sniffed upload format (Whisper reads the extension)"""
+    return {"mp4": "m4a"}.get(audio_format, audio_format)
+
+
+def upload_path(prefix: str, upload: StreamingUpload) -> Path:
+    """Where to save a received upload: content hash plus a random suffix, so concurrent uploads never collide"""
+    return AUDIO_DIR / f"{prefix}_{upload.sha256[:16]}_{uuid.uuid4().hex[:8]}.{upload_extension(upload.format)}"
+
+
+def discard_upload(path) -> None:
+    """Delete a saved upload no job will read (a duplicate that joined the job for the same audio)"""
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not delete duplicate upload {path}: {e}")
+
+
+# ── Latest result file ───────────────────────────────────────────────────────
+
+def save_result(result: Dict) -> None:
+    """Write the latest consultation result for /api/consultation-data"""
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+def apply_upgrade(result: Dict) -> None:
+    """Replace a provisional result with its late Groq upgrade (unless a newer consultation landed)"""
+    try:
+        if RESULTS_FILE.exists():
+            with open(RESULTS_FILE, "r", encoding="utf-8") as f:
+                current = json.load(f)
+            if current.get("prescription_id") != result.get("prescription_id"):
+                logger.info(f"Skipping upgrade for prescription {result.get('prescription_id')}: newer result saved")
+                return
+        save_result(result)
+        logger.info(f"⬆️  Provisional result upgraded ({result.get('extraction_method')})")
+    except Exception as e:
+        logger.error(f"❌ Error saving upgraded result: {str(e)}")
+
+
+# ── Jobs ─────────────────────────────────────────────────────────────────────
+
+def pipeline_callbacks(job_queue, job, progress: Callable[[Dict], None], stages_total: int) -> Dict[str, Any]:
+    """
+    process()/process_async() keyword arguments that report a job's stages and partial
+    results as progress and job events (job_queue: JobQueue or AsyncJobQueue)
+    """
+    completed = []
+
+    def on_stage_start(stage_name):
+        job_queue.emit(job.id, "stage_start", {"stage": stage_name})
+
+    def on_stage(stage_result):
+        completed.append(stage_result.name)
+        progress({"stage": stage_result.name, "stage_status": stage_result.status,
+                  "stages_completed": len(completed), "stages_total": stages_total})
+        job_queue.emit(job.id, "stage_finish", {
+            "stage": stage_result.name, "status": stage_result.status,
+            "duration_ms": round(stage_result.duration_sec * 1000, 1),
+            "stages_completed": len(completed), "stages_total": stages_total})
+
+    def on_partial(kind, data):
+        # transcript / field / medicine - shown to the doctor before extraction finishes
+        job_queue.emit(job.id, kind, data)
+
+    def on_upgrade(upgraded):
+        def record():
+            apply_upgrade(upgraded)
+            job_queue.backend.update(job.id, result=upgraded)
+            job_queue.emit(job.id, "upgraded", {"result": upgraded})
+
+        # The late result may arrive before the handler returns: write it after the job's own done
+        job_queue.after_done(job.id, record)
+
+    def on_upgrade_failed(reason):
+        # Ends streams (and clients) still waiting for the upgrade of a provisional result
+        job_queue.after_done(job.id, lambda: job_queue.emit(job.id, "upgrade_failed", {"error": reason}))
+
+    # job.id doubles as consultation_id: a retried or resumed job restarts after its last completed stage
+    return {"on_stage_start": on_stage_start, "on_stage": on_stage, "on_partial": on_partial,
+            "on_upgrade": on_upgrade, "on_upgrade_failed": on_upgrade_failed, "consultation_id": job.id,
+            "deadline_sec": job.payload.get("deadline_sec"), "audio_sha256": job.payload.get("audio_sha256")}
+
+
+def job_payload(audio_path, deadline_sec: Optional[float], audio_sha256: Optional[str]) -> Dict[str, Any]:
+    return {"audio_path": str(audio_path), "deadline_sec": deadline_sec, "audio_sha256": audio_sha256}
+
+
+def coalesce_key(payload: Dict[str, Any]) -> Optional[str]:
+    """Jobs for the same audio bytes and deadline give the same result (None: audio hash unknown)"""
+    if not payload.get("audio_sha256"):
+        return None
+    return f"{payload['audio_sha256']}:{payload.get('deadline_sec')}"
+
+
+def job_accepted(job_id: str, coalesced: bool = False, finished: bool = False) -> Dict[str, Any]:
+    """Body of the 202 response for a queued extraction job (or the existing job a duplicate joined)"""
+    body = {"job_id": job_id, "status": "done" if finished else "queued", "status_url": f"/api/jobs/{job_id}",
+            "events_url": f"/api/jobs/{job_id}/events"}
+    if coalesced:
+        body["coalesced"] = True
+    return body
+
+
+class JobEventStream:
+    """
+    SSE framing of one job's events, and when the stream ends: after failed or
+    upgraded, after done unless the result is provisional (then after its upgrade,
+    upgrade_failed or SSE_UPGRADE_WAIT_SEC), or once the job is done/failed but its final event
+    never came (e.g. its emit was lost). The servers only fetch events, look up
+    the job when a poll brought none, and wait between polls.
+    """
+
+    def __init__(self, last_seq: int = 0):
+        self.last_seq = last_seq
+        self.finished = False
+        self._upgrade_deadline: Optional[float] = None
+        self._ended_without_event = False
+        self._last_sent = time.monotonic()
+
+    @staticmethod
+    def parse_last_seq(value: Optional[str]) -> int:
+        """Last-Event-ID header (or ?after=) → seq to resume after"""
+        try:
+            return int(value or 0)
+        except ValueError:
+            return 0
+
+    def frame(self, event) -> str:
+        """SSE frame for a JobEvent (updates the resume position and end state)"""
+        self.last_seq = event.seq
+        self._last_sent = time.monotonic()
+        if event.event in ("failed", "upgraded", "upgrade_failed"):
+            self.finished = True
+        elif event.event == "done":
+            if (event.data.get("result") or {}).get("provisional"):
+                self._upgrade_deadline = time.monotonic() + SSE_UPGRADE_WAIT_SEC  # Stay for the Groq upgrade
+            else:
+                self.finished = True
+        return f"id: {event.seq}\nevent: {event.event}\ndata: {json.dumps(event.data, default=str)}\n\n"
+
+    def idle(self, job=None) -> Optional[str]:
+        """
+        Between polls (job: its current state, if looked up): a keep-alive comment when one is due.
+        Sets finished if the upgrade wait ran out, or if the job was already done/failed at the
+        previous poll and its final event still has not arrived - then returns that event, built
+        from the job, so the client gets the outcome.
+        """
+        if self._upgrade_deadline is not None and time.monotonic() > self._upgrade_deadline:
+            self.finished = True
+            return None
+        if job is not None and job.status in ("done", "failed") and self._upgrade_deadline is None:
+            if self._ended_without_event:
+                self.finished = True
+                data = {"result": job.result} if job.status == "done" else {"error": job.error}
+                return f"event: {job.status}\ndata: {json.dumps(data, default=str)}\n\n"
+            self._ended_without_event = True  # Give the event one more poll: it may be on its way
+        if time.monotonic() - self._last_sent >= SSE_KEEPALIVE_SEC:
+            self._last_sent = time.monotonic()
+            return ": keep-alive\n\n"
+        return None
+
+
+# ── Placeholder results (medical system not available) ──────────────────────
+
+UNAVAILABLE_CONSULTATION = {
+    "success": False,
+    "error": "Medical system not available",
+    "patient_name": None,
+    "complaints": [],
+    "diagnosis": [],
+    "medicines": [],
+    "tests": [],
+    "advice": []
+}
+
+UNAVAILABLE_REACT_UPLOAD = {
+    "prescription": {
+        "patient_name": "Patient",
+        "age": 35,
+        "gender": "Male",
+        "complaints": ["Not available"],
+        "diagnosis": ["Unable to process"],
+        "medicines": [],
+        "tests": [],
+        "advice": ["Please try again"]
+    }
+}
+
+UNAVAILABLE_WEB_UPLOAD = {
+    "error": "Medical system not available",
+    "prescription": {
+        "patient_name": "",
+        "complaints": [],
+        "diagnosis": [],
+        "medicines": [],
+        "tests": [],
+        "advice": []
+    }
+}
+
+
+# ── PDF ──────────────────────────────────────────────────────────────────────
+
+def build_prescription_pdf(data: Dict) -> bytes:
+    """Render prescription data as a PDF (needs reportlab)"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+    from io import BytesIO
+
+    # Create PDF in memory
+    pdf_buffer = BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # Title
+    title = Paragraph("<b>Medical Prescription</b>", styles['Heading1'])
+    elements.append(title)
+    elements.append(Spacer(1, 0.3))
+
+    # Patient info
+    patient_text = f"<b>Patient:</b> {data.get('patient_name', 'N/A')}"
+    elements.append(Paragraph(patient_text, styles['Normal']))
+    elements.append(Spacer(1, 0.2))
+
+    # Complaints
+    if data.get('complaints'):
+        complaints_text = f"<b>Complaints:</b> {data.get('complaints', '')}"
+        elements.append(Paragraph(complaints_text, styles['Normal']))
+        elements.append(Spacer(1, 0.2))
+
+    # Diagnosis
+    if data.get('diagnosis'):
+        diagnosis_text = f"<b>Diagnosis:</b> {data.get('diagnosis', '')}"
+        elements.append(Paragraph(diagnosis_text, styles['Normal']))
+        elements.append(Spacer(1, 0.3))
+
+    # Medicines table
+    if data.get('medicines'):
+        elements.append(Paragraph("<b>Medicines:</b>", styles['Heading2']))
+        med_data = [["Name", "Dose", "Timing", "Duration", "Food Instruction"]]
+        for med in data.get('medicines', []):
+            med_data.append([
+                med.get('name', ''),
+                med.get('dose', ''),
+                med.get('timing', ''),
+                med.get('duration', ''),
+                med.get('instruction', '')
+            ])
+        med_table = Table(med_data)
+        med_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        elements.append(med_table)
+        elements.append(Spacer(1, 0.3))
+
+    # Tests
+    if data.get('tests'):
+        tests_text = f"<b>Tests:</b> {data.get('tests', '')}"
+        elements.append(Paragraph(tests_text, styles['Normal']))
+        elements.append(Spacer(1, 0.2))
+
+    # Advice
+    if data.get('advice'):
+        advice_text = f"<b>Advice:</b> {data.get('advice', '')}"
+        elements.append(Paragraph(advice_text, styles['Normal']))
+
+    # Build PDF
+    doc.build(elements)
+    return pdf_buffer.getvalue()
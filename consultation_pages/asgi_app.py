@@ -0,0 +1,503 @@
+"""
+ASGI (FastAPI) server for the integrated voice consultation system.
+
+Same routes, request and response shapes as api.py (Flask), served from an event
+loop instead of a thread per request:
+
+- Extraction jobs run as coroutines (AsyncJobQueue + MedicalSystem.process_async),
+  PROCESSING_CONCURRENCY at a time, so a consultation waiting on Whisper or Groq
+  holds no thread.
+- Uploads are parsed as the body arrives and written into a StreamingUpload
+  (size, format and duration checks, SHA-256), like the Flask app.
+- Each route group has a concurrency limit (ROUTE_LIMIT_*). A request that cannot
+  get a slot within ROUTE_QUEUE_WAIT_SEC is answered 503 with Retry-After, so a
+  burst of uploads cannot starve status polls and event streams.
+
+    uvicorn asgi_app:app --app-dir consultation_pages --port 5000
+"""
+
+import os
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Import medical system (api_common puts src/ on the path)
+from api_common import (AUDIO_DIR, RESULTS_FILE, UPLOAD_MAX_MB, UPLOAD_MAX_BYTES, LIVE_EXTRACTION_DEADLINE_SEC,
+                        JOBS_DB, JOB_LEASE_SEC, SSE_HEADERS, COALESCE_WAIT_SEC, UNAVAILABLE_CONSULTATION,
+                        UNAVAILABLE_REACT_UPLOAD, UNAVAILABLE_WEB_UPLOAD, JobEventStream, make_session_registry,
+                        make_coalescer, make_upload, upload_path, discard_upload, save_result, pipeline_callbacks,
+                        job_payload, coalesce_key, job_accepted, build_prescription_pdf)
+
+try:
+    from medical_system_v2 import MedicalSystem
+    from reporting import make_reporter
+except ImportError:
+    MedicalSystem = None
+from job_queue import AsyncJobQueue, SQLiteJobBackend
+from session_registry import SessionLimitError
+from upload_stream import UploadInfo, UploadRejected
+
+# Setup logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Extraction jobs running at once in this process (each is mostly waiting on Whisper / Groq)
+PROCESSING_CONCURRENCY = int(os.getenv("PROCESSING_CONCURRENCY", "8"))
+
+# Concurrent requests per route group, and how long a request may wait for a slot before a 503
+ROUTE_LIMITS = {
+    "upload": int(os.getenv("ROUTE_LIMIT_UPLOAD", "16")),      # Upload bodies being received
+    "session": int(os.getenv("ROUTE_LIMIT_SESSION", "128")),   # Live recording start / chunks / stop
+    "events": int(os.getenv("ROUTE_LIMIT_EVENTS", "256")),     # Open Server-Sent Events streams
+    "pdf": int(os.getenv("ROUTE_LIMIT_PDF", "4")),             # PDF rendering (CPU)
+    "default": int(os.getenv("ROUTE_LIMIT_DEFAULT", "256")),   # Status, jobs, results
+}
+ROUTE_QUEUE_WAIT_SEC = float(os.getenv("ROUTE_QUEUE_WAIT_SEC", "2"))
+
+
+class RouteBusy(Exception):
+    """No slot for a route group within ROUTE_QUEUE_WAIT_SEC."""
+
+    def __init__(self, route: str):
+        super().__init__(f"Too many concurrent '{route}' requests, retry shortly")
+        self.route = route
+
+
+class RouteLimiter:
+    """Bounded concurrency per route group (one semaphore each)."""
+
+    def __init__(self, limits: Dict[str, int], wait_sec: float):
+        self.wait_sec = wait_sec
+        self._semaphores = {route: asyncio.Semaphore(max(1, limit)) for route, limit in limits.items()}
+
+    async def acquire(self, route: str) -> None:
+        try:
+            await asyncio.wait_for(self._semaphores[route].acquire(), self.wait_sec)
+        except asyncio.TimeoutError:
+            logger.warning(f"[ASGI] '{route}' at its limit - rejecting request")
+            raise RouteBusy(route)
+
+    def release(self, route: str) -> None:
+        self._semaphores[route].release()
+
+    @asynccontextmanager
+    async def slot(self, route: str):
+        await self.acquire(route)
+        try:
+            yield
+        finally:
+            self.release(route)
+
+
+limits = RouteLimiter(ROUTE_LIMITS, ROUTE_QUEUE_WAIT_SEC)
+
+# Initialize medical system
+try:
+    # Server path: structured events, no console banners or transcript text
+    medical_system = MedicalSystem(reporter=make_reporter(os.getenv("VOICE_RX_REPORTER", "events")))
+except Exception as e:
+    logger.warning(f"Medical system not available: {e}")
+    medical_system = None
+
+# Live consultations: one recording session per doctor (session id from /api/start-consultation)
+sessions = make_session_registry()
+
+# Double-submitted / retried uploads share the job already extracting the same audio
+coalescer = make_coalescer(medical_system)
+
+
+async def _run_job(job, progress):
+    """Job handler: run the pipeline on the event loop, reporting stages and partial results as job events"""
+    callbacks = pipeline_callbacks(job_queue, job, progress, len(medical_system.pipeline.stages))
+    key = coalesce_key(job.payload)
+    try:
+        result = await medical_system.process_async(job.payload["audio_path"], **callbacks)
+        await run_in_threadpool(save_result, result)
+    except BaseException:
+        coalescer.finish(key, job.id, succeeded=False)
+        raise
+    coalescer.finish(key, job.id, succeeded=bool(result.get("success")))  # Failures come back as success=False
+    return result
+
+
+async def _queue_job(audio_path, deadline_sec=LIVE_EXTRACTION_DEADLINE_SEC, audio_sha256=None):
+    """202 response with the id of a queued extraction job, or of the job already extracting this audio"""
+    payload = job_payload(audio_path, deadline_sec, audio_sha256)
+    flight, leader = coalescer.join(coalesce_key(payload))
+    if not leader:
+        await run_in_threadpool(discard_upload, audio_path)  # The joined job reads the first upload of these bytes
+        # Rarely waits: only while the first request is still writing the job
+        if not (flight.wait_submitted(0) or await run_in_threadpool(flight.wait_submitted, COALESCE_WAIT_SEC)):
+            return JSONResponse({"error": "Could not queue extraction, retry"}, status_code=503)
+        return JSONResponse(job_accepted(flight.job_id, coalesced=True, finished=flight.finished), status_code=202)
+    try:
+        await job_queue.submit(payload, job_id=flight.job_id)
+    except Exception:
+        coalescer.abandon(flight)
+        raise
+    coalescer.submitted(flight)
+    return JSONResponse(job_accepted(flight.job_id), status_code=202)
+
+
+job_queue = AsyncJobQueue(_run_job, SQLiteJobBackend(JOBS_DB), concurrency=PROCESSING_CONCURRENCY,
+                          lease_sec=JOB_LEASE_SEC)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if medical_system:
+        await job_queue.start()
+    yield
+    await job_queue.stop()
+
+
+# Configure FastAPI
+app = FastAPI(title="Medical Consultation API", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.exception_handler(RouteBusy)
+async def route_busy(request: Request, e: RouteBusy):
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(Exception)
+async def unhandled_error(request: Request, e: Exception):
+    logger.error(f"❌ Error in {request.url.path}: {str(e)}")
+    return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, progress and (once done) result of an extraction job"""
+    async with limits.slot("default"):
+        job = await job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return job.to_dict()
+
+
+async def _job_event_stream(job_id, last_seq):
+    """SSE frames for a job's events after last_seq; ends once the final result is out.
+
+    Owns the caller's 'events' slot: released when the stream ends, fails or is
+    closed because the client disconnected.
+    """
+    try:
+        stream = JobEventStream(last_seq)
+        while True:
+            events = await job_queue.events(job_id, after_seq=stream.last_seq)
+            for event in events:
+                yield stream.frame(event)
+                if stream.finished:
+                    return
+            frame = stream.idle(None if events else await job_queue.get(job_id))
+            if frame:
+                yield frame
+            if stream.finished:
+                return
+            await job_queue.wait_for_events(timeout=1.0)  # Woken at once by this process's workers
+    finally:
+        limits.release("events")
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request):
+    """Server-Sent Events stream of a job (same events as api.py); holds an 'events' slot while open"""
+    if await job_queue.get(job_id) is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    last_seq = JobEventStream.parse_last_seq(request.headers.get("Last-Event-ID") or request.query_params.get("after"))
+    await limits.acquire("events")  # Released by _job_event_stream, also when the client disconnects
+    return StreamingResponse(_job_event_stream(job_id, last_seq), media_type="text/event-stream",
+                             headers=SSE_HEADERS)
+
+
+@app.get("/api/health")
+async def health():
+    """Health check endpoint"""
+    return {"status": "ok", "service": "Medical Consultation API"}
+
+
+async def _session_id(request: Request) -> Optional[str]:
+    """Session id of a request: JSON body, query string or X-Session-Id header"""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+    return (body.get("session_id") or request.query_params.get("session_id")
+            or request.headers.get("X-Session-Id"))
+
+
+@app.post("/api/start-consultation")
+async def start_consultation(request: Request):
+    """Start a recording session for a consultation; returns its session_id"""
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    async with limits.slot("session"):
+        try:
+            session = await run_in_threadpool(sessions.start, body.get("session_id"),
+                                              suffix="." + body.get("format", "wav"))
+        except SessionLimitError as e:
+            return JSONResponse({"error": str(e)}, status_code=503)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    logger.info(f"📍 Consultation started: {session.audio_file}")
+
+    return {
+        "status": "recording_started",
+        "session_id": session.id,
+        "audio_file": session.audio_file,
+        "timestamp": session.started_at,
+    }
+
+
+@app.post("/api/consultations/{session_id}/audio")
+async def append_consultation_audio(session_id: str, request: Request):
+    """Append a recorded audio chunk (raw request body) to a session"""
+    async with limits.slot("session"):
+        chunk = await request.body()
+        try:
+            total = await run_in_threadpool(sessions.append, session_id, chunk)
+        except KeyError:
+            return JSONResponse({"error": "No active recording"}, status_code=404)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+    return {"session_id": session_id, "bytes_received": total}
+
+
+@app.post("/api/stop-consultation")
+async def stop_consultation(request: Request):
+    """Stop a session's recording and extract consultation data"""
+    session_id = await _session_id(request)
+    if not session_id:
+        return JSONResponse({"error": "session_id required"}, status_code=400)
+    async with limits.slot("session"):
+        try:
+            audio_file = await run_in_threadpool(sessions.stop, session_id)
+        except KeyError:
+            return JSONResponse({"error": "No active recording"}, status_code=400)
+
+    if audio_file is None:
+        logger.error(f"❌ No audio recorded for session {session_id}")
+        return JSONResponse({"error": "Audio file not saved"}, status_code=400)
+
+    logger.info(f"⏹️  Processing audio: {audio_file}")
+
+    # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
+    if medical_system:
+        logger.info(f"✅ Consultation queued for extraction")
+        return await _queue_job(audio_file)
+
+    # Return mock data if medical system not available
+    await run_in_threadpool(save_result, UNAVAILABLE_CONSULTATION)
+    return UNAVAILABLE_CONSULTATION
+
+
+@app.post("/api/save-consultation")
+async def save_consultation(request: Request):
+    """Save consultation data to database"""
+    data = await request.json()
+
+    logger.info(f"💾 Saving consultation: {data.get('patient_name', 'Unknown')}")
+
+    return {
+        "status": "saved",
+        "consultation_id": f"CONSULT_{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "timestamp": datetime.now().isoformat(),
+        "data": data,
+    }
+
+
+def _load_result() -> Optional[Dict]:
+    if not RESULTS_FILE.exists():
+        return None
+    with open(RESULTS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@app.get("/api/consultation-data")
+async def get_consultation_data():
+    """Get last extracted consultation data"""
+    async with limits.slot("default"):
+        data = await run_in_threadpool(_load_result)
+    if data is None:
+        return JSONResponse({"error": "No consultation data available"}, status_code=404)
+    return data
+
+
+@app.get("/api/status")
+async def get_status(request: Request):
+    """Recording status of a session (?session_id=...), or session counts without one"""
+    session_id = await _session_id(request)
+    if not session_id:
+        return sessions.stats()
+    session = sessions.get(session_id)  # Polling status keeps the session alive
+    if session is None:
+        return JSONResponse({"session_id": session_id, "is_recording": False}, status_code=404)
+    return session.to_dict()
+
+
+class _MultipartFile:
+    """Multipart parser callbacks that write the file part named `field` into a StreamingUpload"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.upload = None
+        self.filename: Optional[str] = None
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._target = None
+
+    def callbacks(self) -> Dict:
+        return {"on_part_begin": self._on_part_begin, "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value, "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished, "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end}
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        is_file = options.get(b"name", b"").decode("latin-1") == self.field and b"filename" in options
+        if is_file and self.upload is None:  # First file in the field, like request.files.get()
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+            self.upload = self._target = make_upload()
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._target is not None:
+            self._target.write(data[start:end])  # Checks, hashes, spools; may raise UploadRejected
+
+    def _on_part_end(self) -> None:
+        self._target = None
+
+
+async def _receive_upload(request: Request, field: str,
+                          prefix: str) -> Tuple[Optional[UploadInfo], Optional[Response]]:
+    """
+    Stream the upload in form field `field` to AUDIO_DIR; returns (UploadInfo, None) or
+    (None, error response). Oversized, overlong or non-audio uploads are cut off while
+    the body is still arriving.
+    """
+    too_large = JSONResponse({"error": f"Upload exceeds {UPLOAD_MAX_MB:.0f} MB"}, status_code=413)
+    max_body = UPLOAD_MAX_BYTES + 64 * 1024  # Multipart overhead
+    if int(request.headers.get("content-length") or 0) > max_body:
+        return None, too_large
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        logger.error("❌ No audio file provided")
+        return None, JSONResponse({"error": "No audio file provided"}, status_code=400)
+
+    receiver = _MultipartFile(field)
+    parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                return None, too_large
+            parser.write(chunk)
+        parser.finalize()
+
+        upload = receiver.upload
+        if upload is None:
+            logger.error("❌ No audio file provided")
+            return None, JSONResponse({"error": "No audio file provided"}, status_code=400)
+        if receiver.filename == "":
+            return None, JSONResponse({"error": "No file selected"}, status_code=400)
+
+        return await run_in_threadpool(upload.save, str(upload_path(prefix, upload))), None
+    except UploadRejected as e:
+        return None, JSONResponse({"error": str(e)}, status_code=e.status)
+    finally:
+        if receiver.upload is not None:
+            receiver.upload.close()  # Deletes the spooled temp file unless it was saved
+
+
+@app.post("/api/process-audio")
+async def api_process_audio(request: Request):
+    """Process uploaded audio file from React frontend"""
+    # Streamed to disk and hashed as it arrives
+    async with limits.slot("upload"):
+        upload, error = await _receive_upload(request, "audio", "react_upload")
+    if error:
+        return error
+
+    logger.info(f"📍 Processing uploaded audio from React: {upload.path}")
+
+    # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
+    if medical_system:
+        return await _queue_job(upload.path, audio_sha256=upload.sha256)
+    # Return mock data if medical system not available
+    return UNAVAILABLE_REACT_UPLOAD
+
+
+# ============= Frontend HTML endpoints (no /api prefix) =============
+
+@app.post("/process-audio")
+async def process_audio(request: Request):
+    """Process uploaded audio file - for HTML frontend"""
+    # Streamed to disk and hashed as it arrives
+    async with limits.slot("upload"):
+        upload, error = await _receive_upload(request, "file", "web_upload")
+    if error:
+        return error
+
+    logger.info(f"📍 Processing uploaded audio: {upload.path}")
+
+    # Queue extraction if the medical system is available (poll /api/jobs/<job_id>)
+    if medical_system:
+        return await _queue_job(upload.path, deadline_sec=None, audio_sha256=upload.sha256)
+    return UNAVAILABLE_WEB_UPLOAD
+
+
+@app.post("/generate-pdf")
+async def generate_pdf(request: Request):
+    """Generate PDF from prescription data - for HTML frontend"""
+    data = await request.json()
+    try:
+        async with limits.slot("pdf"):
+            pdf = await run_in_threadpool(build_prescription_pdf, data)
+    except ImportError as e:  # reportlab not installed
+        logger.error(f"❌ Error generating PDF: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    return Response(pdf, media_type="application/pdf",
+                    headers={"Content-Disposition": "attachment; filename=prescription.pdf"})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logger.info("🚀 Starting Medical Consultation API Server (ASGI)...")
+    logger.info(f"📂 Audio directory: {AUDIO_DIR}")
+    logger.info(f"📄 Results file: {RESULTS_FILE}")
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,333 @@
+"""
+Artifact Store Module: Compressed, content-addressed storage for pipeline artifacts.
+
+ArtifactStore: Blobs keyed by SHA-256 of their content, plus a SQLite index
+Artifact: One stored reference (kind, consultation, version, metadata → blob)
+
+Layout under root:
+    objects/ab/abcdef...   compressed blob (zstd if `zstandard` is installed, else zlib)
+    index.db               blobs (hash, sizes, codec) and artifacts (references)
+
+Identical content is stored once however often it is put (raw audio uploaded
+twice, an unchanged transcript version); every put still records a reference,
+so a consultation's artifacts can be listed and replayed. Writes stream through
+a temp file and are renamed into place, so a crash never leaves a partial blob.
+Reads stream too (open_blob / iter_chunks), so large recordings are never held
+in memory.
+
+Kinds used by MedicalSystem: audio_raw, transcript (metadata.stage = transcribe,
+clean, thanglish, normalize, compact) and extraction (raw extraction JSON).
+"""
+
+import io
+import os
+import json
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from dataclasses import asdict, dataclass, field, is_dataclass
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+@dataclass
+class Artifact:
+    """A stored reference to a blob."""
+    sha256: str
+    kind: str
+    size: int          # Uncompressed bytes
+    stored_size: int   # Compressed bytes on disk
+    consultation_id: Optional[str] = None
+    version: int = 1   # Per (consultation_id, kind), in put order
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    created_at: str = ""
+
+
+class _ZlibReader(io.RawIOBase):
+    """Readable stream decompressing a zlib file chunk by chunk."""
+
+    def __init__(self, raw: BinaryIO):
+        self._raw = raw
+        self._decompressor = zlib.decompressobj()
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            chunk = self._raw.read(CHUNK_SIZE)
+            if not chunk:
+                self._buffer = self._decompressor.flush()
+                break
+            self._buffer = self._decompressor.decompress(chunk)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self) -> None:
+        self._raw.close()
+        super().close()
+
+
+class ArtifactStore:
+    """Content-addressed, compressed blobs with a SQLite metadata index."""
+
+    def __init__(self, root: str, codec: Optional[str] = None, level: Optional[int] = None):
+        """
+        Args:
+            root:  Store directory (created if missing)
+            codec: 'zstd' or 'zlib' for new blobs (default: zstd if installed)
+            level: Compression level (default: 10 for zstd, 6 for zlib)
+        """
+        self.root = root
+        self.codec = codec or ("zstd" if ZSTD_AVAILABLE else "zlib")
+        if self.codec == "zstd" and not ZSTD_AVAILABLE:
+            raise ValueError("codec 'zstd' needs the zstandard package")
+        if self.codec not in ("zstd", "zlib"):
+            raise ValueError(f"Unknown codec '{self.codec}'")
+        self.level = level if level is not None else (10 if self.codec == "zstd" else 6)
+        self.db_file = os.path.join(root, "index.db")
+        self._lock = threading.Lock()  # Serializes version numbering within this process
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    stored_size INTEGER NOT NULL,
+                    codec TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    id INTEGER PRIMARY KEY,
+                    sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+                    kind TEXT NOT NULL,
+                    consultation_id TEXT,
+                    version INTEGER NOT NULL,
+                    metadata TEXT,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_consultation "
+                         "ON artifacts (consultation_id, kind)")
+            conn.commit()
+
+    # ── Writing ──────────────────────────────────────────────────────────────
+
+    def put_stream(self, stream: BinaryIO, kind: str, consultation_id: Optional[str] = None,
+                   metadata: Optional[Dict[str, Any]] = None) -> Artifact:
+        """Store a binary stream (read in chunks, hashed and compressed incrementally)."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "objects"), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                compressor = self._compressor(out)
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    compressor.write(chunk)
+                compressor.finish()
+            sha256 = digest.hexdigest()
+            stored_size = self._commit_blob(tmp_path, sha256, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self._add_reference(sha256, size, stored_size, kind, consultation_id, metadata)
+
+    def put_file(self, path: str, kind: str, consultation_id: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None, sha256: Optional[str] = None) -> Artifact:
+        """Store a file; with its sha256 already known (e.g. hashed on upload), a stored blob is not re-read."""
+        metadata = dict(metadata or {})
+        metadata.setdefault("filename", os.path.basename(path))
+        if sha256 is not None:
+            stored = self._stored_blob(sha256)
+            if stored is not None:
+                return self._add_reference(sha256, stored[0], stored[1], kind, consultation_id, metadata)
+        with open(path, "rb") as f:
+            return self.put_stream(f, kind, consultation_id, metadata)
+
+    def put_bytes(self, data: bytes, kind: str, consultation_id: Optional[str] = None,
+                  metadata: Optional[Dict[str, Any]] = None) -> Artifact:
+        return self.put_stream(io.BytesIO(data), kind, consultation_id, metadata)
+
+    def put_text(self, text: str, kind: str, consultation_id: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None) -> Artifact:
+        return self.put_bytes(text.encode("utf-8"), kind, consultation_id, metadata)
+
+    def put_json(self, value: Any, kind: str, consultation_id: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None) -> Artifact:
+        """Store JSON canonically (sorted keys), so equal values deduplicate."""
+        text = json.dumps(value, ensure_ascii=False, sort_keys=True, default=_json_default)
+        return self.put_text(text, kind, consultation_id, metadata)
+
+    # ── Reading ──────────────────────────────────────────────────────────────
+
+    def open_blob(self, sha256: str) -> BinaryIO:
+        """Readable, decompressing stream over a blob (close it when done)."""
+        codec = self._blob_codec(sha256)
+        raw = open(self._blob_path(sha256), "rb")
+        if codec == "zstd":
+            if not ZSTD_AVAILABLE:
+                raw.close()
+                raise RuntimeError(f"Blob {sha256[:12]} is zstd-compressed; install zstandard to read it")
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.BufferedReader(_ZlibReader(raw), CHUNK_SIZE)
+
+    def iter_chunks(self, sha256: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open_blob(sha256) as stream:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                yield chunk
+
+    def read_bytes(self, sha256: str) -> bytes:
+        return b"".join(self.iter_chunks(sha256))
+
+    def read_text(self, sha256: str) -> str:
+        return self.read_bytes(sha256).decode("utf-8")
+
+    def read_json(self, sha256: str) -> Any:
+        return json.loads(self.read_text(sha256))
+
+    def export(self, sha256: str, path: str) -> str:
+        """Write a blob back to a plain file (e.g. audio for reprocessing); returns path."""
+        with self.open_blob(sha256) as stream, open(path, "wb") as out:
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+        return path
+
+    def list(self, consultation_id: Optional[str] = None, kind: Optional[str] = None) -> List[Artifact]:
+        """References, oldest first, optionally filtered by consultation and kind."""
+        query = ("SELECT a.sha256, a.kind, b.size, b.stored_size, a.consultation_id, a.version, a.metadata, "
+                 "a.created_at FROM artifacts a JOIN blobs b ON a.sha256 = b.sha256 WHERE 1=1")
+        params: List[Any] = []
+        if consultation_id is not None:
+            query += " AND a.consultation_id = ?"
+            params.append(consultation_id)
+        if kind is not None:
+            query += " AND a.kind = ?"
+            params.append(kind)
+        with sqlite3.connect(self.db_file) as conn:
+            rows = conn.execute(query + " ORDER BY a.id", params).fetchall()
+        return [Artifact(sha, kind_, size, stored, cid, version, json.loads(meta or "{}"), created)
+                for sha, kind_, size, stored, cid, version, meta, created in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Blob/reference counts and bytes saved by compression and deduplication."""
+        with sqlite3.connect(self.db_file) as conn:
+            blobs, size, stored = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM blobs"
+            ).fetchone()
+            refs, referenced = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(b.size), 0) FROM artifacts a JOIN blobs b ON a.sha256 = b.sha256"
+            ).fetchone()
+        return {
+            "blobs": blobs,
+            "references": refs,
+            "bytes_referenced": referenced,  # What storing every put separately would take
+            "bytes_unique": size,
+            "bytes_stored": stored,
+            "compression_ratio": size / stored if stored else 1.0,
+            "dedup_ratio": referenced / size if size else 1.0,
+        }
+
+    # ── Internals ────────────────────────────────────────────────────────────
+
+    def _compressor(self, out: BinaryIO):
+        if self.codec == "zstd":
+            return _ZstdWriter(out, self.level)
+        return _ZlibWriter(out, self.level)
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def _blob_codec(self, sha256: str) -> str:
+        with sqlite3.connect(self.db_file) as conn:
+            row = conn.execute("SELECT codec FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown artifact blob {sha256}")
+        return row[0]
+
+    def _stored_blob(self, sha256: str) -> Optional[Tuple[int, int]]:
+        """(size, stored size) of a blob present on disk, else None"""
+        with sqlite3.connect(self.db_file) as conn:
+            row = conn.execute("SELECT size, stored_size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return row if row is not None and os.path.exists(self._blob_path(sha256)) else None
+
+    def _commit_blob(self, tmp_path: str, sha256: str, size: int) -> int:
+        """Move a compressed temp file into place unless the blob exists; returns its stored size."""
+        path = self._blob_path(sha256)
+        with sqlite3.connect(self.db_file) as conn:
+            row = conn.execute("SELECT stored_size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None and os.path.exists(path):
+                logger.debug(f"[ARTIFACT] Dedup hit {sha256[:12]} ({size} bytes)")
+                return row[0]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            stored_size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            conn.execute("INSERT OR REPLACE INTO blobs (sha256, size, stored_size, codec, created_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (sha256, size, stored_size, self.codec, datetime.now().isoformat()))
+            conn.commit()
+        return stored_size
+
+    def _add_reference(self, sha256: str, size: int, stored_size: int, kind: str,
+                       consultation_id: Optional[str], metadata: Optional[Dict[str, Any]]) -> Artifact:
+        created_at = datetime.now().isoformat()
+        metadata = metadata or {}
+        with self._lock, sqlite3.connect(self.db_file) as conn:
+            version = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM artifacts WHERE consultation_id IS ? AND kind = ?",
+                (consultation_id, kind)
+            ).fetchone()[0]
+            conn.execute("INSERT INTO artifacts (sha256, kind, consultation_id, version, metadata, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (sha256, kind, consultation_id, version, json.dumps(metadata, default=str), created_at))
+            conn.commit()
+        return Artifact(sha256, kind, size, stored_size, consultation_id, version, metadata, created_at)
+
+
+def _json_default(value: Any) -> Any:
+    if is_dataclass(value) and not isinstance(value, type):
+        return asdict(value)
+    return str(value)
+
+
+class _ZlibWriter:
+    def __init__(self, out: BinaryIO, level: int):
+        self._out = out
+        self._compressor = zlib.compressobj(level)
+
+    def write(self, chunk: bytes) -> None:
+        self._out.write(self._compressor.compress(chunk))
+
+    def finish(self) -> None:
+        self._out.write(self._compressor.flush())
+
+
+class _ZstdWriter:
+    def __init__(self, out: BinaryIO, level: int):
+        self._writer = zstandard.ZstdCompressor(level=level).stream_writer(out, closefd=False)
+
+    def write(self, chunk: bytes) -> None:
+        self._writer.write(chunk)
+
+    def finish(self) -> None:
+        self._writer.flush(zstandard.FLUSH_FRAME)
+        self._writer.close()
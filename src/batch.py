@@ -0,0 +1,231 @@
+"""
+Batch Module: Process directories of recordings on a worker pool.
+
+expand_inputs: Directories, globs and files → sorted audio paths
+Checkpoint: Append-only record of finished inputs, so a rerun skips them
+BatchProgress: Completed/failed counts, throughput and ETA
+run_batch: Process inputs concurrently, streaming one NDJSON line per result
+
+Usage:
+    python src/batch.py data/ --workers 4 --output results.ndjson
+    python src/batch.py "recordings/2026-*/*.mp3" --metrics metrics.json
+
+Each result is appended to the NDJSON output (and flushed) as soon as it
+completes, then recorded in the checkpoint (default: <output>.checkpoint).
+A crash loses at most the in-flight files; rerunning the same command skips
+everything already checkpointed. An input is re-run if its size or mtime
+changed, or with --retry-failed if it previously failed.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .reporting import make_reporter
+except ImportError:
+    from reporting import make_reporter
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".mp3", ".mp4", ".wav", ".webm", ".m4a", ".ogg", ".flac")
+
+OK = "ok"
+FAILED = "failed"  # process() returned success=False (corrupted audio, transcription failed, ...)
+ERROR = "error"    # process() raised
+
+
+def expand_inputs(patterns: Iterable[str]) -> List[str]:
+    """Audio files named by directories (searched recursively), glob patterns or plain paths."""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = glob.glob(os.path.join(pattern, "**", "*"), recursive=True)
+        elif glob.has_magic(pattern):
+            candidates = glob.glob(pattern, recursive=True)
+        else:
+            candidates = [pattern]
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(AUDIO_EXTENSIONS):
+                paths.add(os.path.abspath(path))
+            elif path == pattern:
+                logger.warning(f"[BATCH] Skipping {pattern}: not an audio file")
+    return sorted(paths)
+
+
+class Checkpoint:
+    """Finished inputs, one JSON line each (input, size, mtime_ns, status)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["input"]] = entry
+                    except (ValueError, KeyError):
+                        logger.warning(f"[BATCH] Ignoring malformed checkpoint line in {path}")
+
+    @staticmethod
+    def fingerprint(path: str) -> Optional[Dict]:
+        """Size and mtime of path (None if it cannot be stat'ed, e.g. deleted)."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, path: str, retry_failed: bool = False) -> bool:
+        """True if path was finished with its current size/mtime (and succeeded, with retry_failed)."""
+        entry = self.entries.get(path)
+        if entry is None or (retry_failed and entry.get("status") != OK):
+            return False
+        fingerprint = self.fingerprint(path)
+        if fingerprint is None:
+            return False
+        return entry.get("size") == fingerprint["size"] and entry.get("mtime_ns") == fingerprint["mtime_ns"]
+
+    def mark(self, path: str, status: str, fingerprint: Optional[Dict] = None) -> None:
+        """
+        Record path as finished (flushed and fsynced before returning). fingerprint is the
+        one taken before processing (default: now); an input that vanished is recorded
+        without one, so it is never skipped.
+        """
+        fingerprint = fingerprint or self.fingerprint(path) or {"size": None, "mtime_ns": None}
+        entry = {"input": path, "status": status, **fingerprint}
+        self.entries[path] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BatchProgress:
+    """Counts, throughput and ETA for one batch run."""
+
+    def __init__(self, total: int, skipped: int = 0, clock: Callable[[], float] = time.monotonic):
+        self.total = total        # Inputs to process in this run (after skipping)
+        self.skipped = skipped    # Inputs skipped via the checkpoint
+        self.completed = 0
+        self.failed = 0
+        self.clock = clock
+        self.start = clock()
+
+    def update(self, status: str) -> None:
+        self.completed += 1
+        if status != OK:
+            self.failed += 1
+
+    @property
+    def elapsed_sec(self) -> float:
+        return self.clock() - self.start
+
+    @property
+    def files_per_min(self) -> float:
+        elapsed = self.elapsed_sec
+        return self.completed / elapsed * 60 if elapsed > 0 else 0.0
+
+    @property
+    def eta_sec(self) -> Optional[float]:
+        """Seconds until the remaining inputs finish at the current rate (None before the first one)."""
+        if not self.completed:
+            return None
+        return (self.total - self.completed) * self.elapsed_sec / self.completed
+
+    def line(self) -> str:
+        eta = self.eta_sec
+        eta_label = "--" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+        return (f"{self.completed}/{self.total} done, {self.failed} failed | "
+                f"{self.files_per_min:.1f} files/min | ETA {eta_label}")
+
+
+def run_batch(system, inputs: List[str], output: str, checkpoint: Checkpoint, workers: int = 4,
+              language: Optional[str] = None, deadline_sec: Optional[float] = None,
+              retry_failed: bool = False, clock: Callable[[], float] = time.monotonic) -> BatchProgress:
+    """
+    Process inputs with system.process on a thread pool.
+
+    Results are written by this (single) thread as they complete: the NDJSON line
+    first, then the checkpoint entry, so a checkpointed input always has its result
+    on disk. Returns the final progress.
+    """
+    pending = [path for path in inputs if not checkpoint.is_done(path, retry_failed)]
+    progress = BatchProgress(len(pending), skipped=len(inputs) - len(pending), clock=clock)
+    if progress.skipped:
+        print(f"[BATCH] Skipping {progress.skipped} checkpointed input(s)")
+    if not pending:
+        return progress
+
+    def _process(path: str) -> Tuple[Dict, Optional[Dict]]:
+        start = clock()
+        fingerprint = checkpoint.fingerprint(path)  # Before processing: a file changed meanwhile is re-run
+        try:
+            result = system.process(path, language=language, deadline_sec=deadline_sec)
+            status = OK if result.get("success") else FAILED
+        except Exception as e:
+            logger.error(f"[BATCH] {path} failed: {e}", exc_info=True)
+            result, status = {"success": False, "error": f"{type(e).__name__}: {e}"}, ERROR
+        return {"input": path, "status": status, "elapsed_sec": round(clock() - start, 3),
+                "finished_at": datetime.now().isoformat(), "result": result}, fingerprint
+
+    with open(output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_process, path) for path in pending]
+        for future in as_completed(futures):
+            record, fingerprint = future.result()
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            checkpoint.mark(record["input"], record["status"], fingerprint)
+            progress.update(record["status"])
+            print(f"[BATCH] {os.path.basename(record['input'])}: {record['status']} "
+                  f"({record['elapsed_sec']:.1f}s) | {progress.line()}", flush=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch prescription extraction with resumable checkpoints")
+    parser.add_argument("inputs", nargs="+", help="Audio files, directories or glob patterns")
+    parser.add_argument("--output", default="prescriptions.ndjson", help="NDJSON results (appended)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_WORKERS", "4")))
+    parser.add_argument("--language", help="Force a language ('en', 'ta', 'tanglish') instead of auto-detect")
+    parser.add_argument("--deadline", type=float, help="Extraction deadline in seconds (default: wait for Groq)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run inputs that previously failed")
+    parser.add_argument("--metrics", help="Export the metrics summary to this JSON file")
+    parser.add_argument("--reporter", choices=["console", "null", "events"], default="null",
+                        help="Per-request progress sink (console output interleaves across workers)")
+    args = parser.parse_args()
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        sys.exit("No audio files found")
+
+    try:
+        from .medical_system_v2 import MedicalSystem
+    except ImportError:
+        from medical_system_v2 import MedicalSystem
+    system = MedicalSystem(reporter=make_reporter(args.reporter))
+
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint")
+    print(f"[BATCH] {len(inputs)} input(s), {args.workers} worker(s) → {args.output}")
+    progress = run_batch(system, inputs, args.output, checkpoint, workers=args.workers,
+                         language=args.language, deadline_sec=args.deadline, retry_failed=args.retry_failed)
+
+    print(f"[BATCH] Finished: {progress.completed} processed ({progress.failed} failed), "
+          f"{progress.skipped} skipped in {progress.elapsed_sec:.1f}s ({progress.files_per_min:.1f} files/min)")
+    if args.metrics:
+        system.metrics_collector.export_json(args.metrics)
+    if progress.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Checkpoints Module: Persist pipeline stage outputs per consultation.
+
+StageCheckpointStore: SQLite table of (consultation_id, stage) → JSON outputs
+
+A pipeline run with a checkpoint store saves each completed stage's outputs
+(transcript, normalized text, raw LLM extraction, validated prescription, ...)
+and, on a later run for the same consultation, restores the longest prefix of
+completed stages instead of re-running them. A failed extraction or database
+write is retried without paying for Whisper again; discard(..., from_stage)
+drops a stage and everything after it so it is recomputed (reprocess).
+
+Outputs are stored as JSON. Dataclass values keep their type (registered via
+types=...) so a restored TranscriptionResult or Prescription is the same object
+the stage produced. Keys in TRANSIENT_KEYS (futures, callbacks) are not stored.
+"""
+
+import json
+import sqlite3
+import logging
+import dataclasses
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INPUTS = "__inputs__"  # Pseudo-stage holding the run's initial inputs (audio path, language)
+TRANSIENT_KEYS = {"upgrade_future"}
+
+
+class StageCheckpointStore:
+    """Stage outputs per consultation, in SQLite."""
+
+    def __init__(self, db_file: str, types: Iterable[type] = ()):
+        """
+        Args:
+            db_file: SQLite file (may be shared with the prescriptions table)
+            types:   Dataclasses that may appear in stage outputs
+        """
+        self.db_file = db_file
+        self.types = {cls.__name__: cls for cls in types}
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stage_checkpoints (
+                    consultation_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    outputs TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (consultation_id, stage)
+                )
+            ''')
+            conn.commit()
+
+    # ── Persistence ──────────────────────────────────────────────────────────
+
+    def load(self, consultation_id: str) -> Dict[str, Dict[str, Any]]:
+        """Stage name → restored outputs for a consultation (empty if none)."""
+        with sqlite3.connect(self.db_file) as conn:
+            rows = conn.execute(
+                "SELECT stage, outputs FROM stage_checkpoints WHERE consultation_id = ? ORDER BY seq",
+                (consultation_id,)
+            ).fetchall()
+        return {stage: self._decode(json.loads(outputs)) for stage, outputs in rows}
+
+    def save(self, consultation_id: str, stage: str, outputs: Dict[str, Any], seq: int = 0) -> None:
+        """Store (or replace) one stage's outputs; seq orders stages within a consultation."""
+        payload = json.dumps(self._encode(outputs), ensure_ascii=False)
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stage_checkpoints (consultation_id, stage, seq, outputs, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (consultation_id, stage, seq, payload, datetime.now().isoformat())
+            )
+            conn.commit()
+
+    def discard(self, consultation_id: str, from_stage: Optional[str] = None,
+                stage_order: Optional[List[str]] = None) -> int:
+        """
+        Drop checkpoints so they are recomputed; returns the number removed.
+
+        With from_stage, only that stage and the stages after it in stage_order go
+        (the initial inputs are kept); without it, everything for the consultation.
+        """
+        if from_stage is None:
+            stages = None
+        else:
+            if not stage_order or from_stage not in stage_order:
+                raise ValueError(f"Unknown stage '{from_stage}'")
+            stages = stage_order[stage_order.index(from_stage):]
+        with sqlite3.connect(self.db_file) as conn:
+            if stages is None:
+                cursor = conn.execute("DELETE FROM stage_checkpoints WHERE consultation_id = ?", (consultation_id,))
+            else:
+                cursor = conn.execute(
+                    f"DELETE FROM stage_checkpoints WHERE consultation_id = ? "
+                    f"AND stage IN ({','.join('?' * len(stages))})",
+                    (consultation_id, *stages)
+                )
+            conn.commit()
+            return cursor.rowcount
+
+    # ── Typed JSON encoding ──────────────────────────────────────────────────
+
+    def _encode(self, value: Any) -> Any:
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            name = type(value).__name__
+            if name not in self.types:
+                raise TypeError(f"Checkpoint type {name} is not registered")
+            return {"__type__": name,
+                    "fields": {f.name: self._encode(getattr(value, f.name)) for f in dataclasses.fields(value)}}
+        if isinstance(value, dict):
+            return {str(k): self._encode(v) for k, v in value.items() if k not in TRANSIENT_KEYS}
+        if isinstance(value, (list, tuple)):
+            return [self._encode(v) for v in value]
+        if hasattr(value, "item") and not isinstance(value, (str, bytes)):  # numpy scalars
+            return value.item()
+        return value
+
+    def _decode(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            if "__type__" in value and set(value) == {"__type__", "fields"}:
+                cls = self.types.get(value["__type__"])
+                if cls is None:
+                    raise TypeError(f"Checkpoint type {value['__type__']} is not registered")
+                return cls(**{k: self._decode(v) for k, v in value["fields"].items()})
+            return {k: self._decode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        return value
@@ -0,0 +1,152 @@
+"""
+Chunking Module: Map-reduce support for very long consultations.
+
+split_transcript: Splits a transcript at sentence/topic boundaries into chunks under a token budget
+merge_extractions: Merges per-chunk prescriptions with deterministic de-duplication
+
+Chunks overlap by a sentence so a medicine mentioned across a boundary is seen whole
+by at least one chunk; the merge collapses the resulting duplicates.
+"""
+
+import re
+import logging
+from typing import Dict, List, Optional
+
+try:
+    from .prompt_builder import estimate_tokens
+except ImportError:
+    from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends: Latin, Arabic (؟) and Devanagari/Tamil danda (।), or line breaks
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?؟।])\s+|\n+')
+
+# Sentences that usually open a new clinical topic - preferred places to cut a chunk
+TOPIC_CUES = re.compile(
+    r'^(now|next|also|secondly|second|another|regarding|for (your|the) '
+    r'|about (your|the) |as for|coming to|moving on|and for)\b',
+    re.IGNORECASE
+)
+
+MEDICINE_FIELDS = ("dose", "frequency", "duration", "instruction", "route")
+LIST_FIELDS = ("complaints", "diagnosis", "tests", "advice")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into non-empty sentences."""
+    return [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+
+
+def split_transcript(text: str, max_tokens: int, overlap_sentences: int = 1) -> List[str]:
+    """
+    Split a transcript into chunks of at most ~max_tokens.
+
+    Sentences are packed greedily; once a chunk is at least half full, a sentence
+    that opens a new topic starts the next chunk. A single sentence longer than
+    max_tokens is split on word boundaries.
+
+    Args:
+        text:              Transcript text
+        max_tokens:        Token budget per chunk (estimate_tokens)
+        overlap_sentences: Trailing sentences repeated at the start of the next chunk
+
+    Returns:
+        List of chunk strings (a single element if the text already fits)
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    sentences = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) > max_tokens:
+            sentences.extend(_split_words(sentence, max_tokens))
+        else:
+            sentences.append(sentence)
+
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for sentence in sentences:
+        tokens = estimate_tokens(sentence)
+        topic_break = TOPIC_CUES.match(sentence) and current_tokens >= max_tokens // 2
+        if current and (current_tokens + tokens > max_tokens or topic_break):
+            chunks.append(current)
+            current = current[-overlap_sentences:] if overlap_sentences else []
+            current_tokens = sum(estimate_tokens(s) for s in current)
+            # Overlap must never push a chunk over budget
+            while current and current_tokens + tokens > max_tokens:
+                current_tokens -= estimate_tokens(current.pop(0))
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+
+    logger.info(f"[CHUNK] Split {len(sentences)} sentences into {len(chunks)} chunks (≤{max_tokens} tokens)")
+    return [" ".join(chunk) for chunk in chunks]
+
+
+def _split_words(sentence: str, max_tokens: int) -> List[str]:
+    """Split an overlong sentence on word boundaries."""
+    pieces, current = [], []
+    for word in sentence.split():
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def merge_extractions(parts: List[Dict]) -> Dict:
+    """
+    Merge per-chunk extraction data (in chunk order) into one prescription.
+
+    Deterministic: the same parts in the same order always give the same result.
+    - patient_name / age: first non-empty value
+    - medicines: keyed by normalized name; first chunk's order, missing fields
+      (dose, frequency, ...) filled from later mentions
+    - complaints / diagnosis / tests / advice: case- and whitespace-insensitive
+      de-duplication, first occurrence wins
+    """
+    merged: Dict = {"patient_name": None, "age": None}
+    medicines: Dict[str, Dict] = {}
+    lists: Dict[str, List] = {name: [] for name in LIST_FIELDS}
+    seen: Dict[str, set] = {name: set() for name in LIST_FIELDS}
+
+    for data in parts:
+        if not data:
+            continue
+        for key in ("patient_name", "age"):
+            if merged[key] in (None, "") and data.get(key) not in (None, ""):
+                merged[key] = data[key]
+
+        for med in data.get("medicines") or []:
+            if not isinstance(med, dict) or not med.get("name"):
+                continue
+            key = _normalize(med["name"])
+            existing = medicines.get(key)
+            if existing is None:
+                medicines[key] = dict(med)
+                continue
+            for name in MEDICINE_FIELDS:
+                if not existing.get(name) and med.get(name):
+                    existing[name] = med[name]
+
+        for name in LIST_FIELDS:
+            for item in data.get(name) or []:
+                key = _normalize(item)
+                if key and key not in seen[name]:
+                    seen[name].add(key)
+                    lists[name].append(item)
+
+    merged["medicines"] = list(medicines.values())
+    merged.update(lists)
+    return merged
+
+
+def _normalize(value: Optional[object]) -> str:
+    """Comparison key: lowercase, punctuation dropped, whitespace collapsed."""
+    text = re.sub(r'[^\w\s]', ' ', str(value or '').lower())
+    return " ".join(text.split())
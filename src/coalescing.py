@@ -0,0 +1,137 @@
+"""
+Coalescing Module: Single-flight extraction jobs for identical uploads.
+
+RequestCoalescer: Thread-safe map of content key → the job extracting that content
+Flight: One job as seen by the requests that share it
+
+A double-submitted or retried upload carries the same bytes, hence the same
+SHA-256 (computed while it streamed in). Instead of running the pipeline again,
+the duplicate joins the job already extracting those bytes and gets its job id,
+so it sees the same progress events and the same result. A finished job stays
+joinable for window_sec, so a retry shortly after completion gets the result at
+once; a failed job is forgotten, so a retry runs again.
+
+The first request for a key is the leader: join() reserves a job id for it,
+and it submits the job with that id and calls submitted(). Followers wait for
+that (wait_submitted) before handing out the id, so it never points at a job
+that does not exist yet. The job's handler reports the outcome with finish():
+the pipeline returns failures as {"success": False, ...} rather than raising,
+so a job succeeded only if its result says so.
+
+    flight, leader = coalescer.join(f"{sha256}:{deadline_sec}")
+    if leader:
+        queue.submit(payload, job_id=flight.job_id)
+        coalescer.submitted(flight)
+    elif not flight.wait_submitted(5):
+        ...                                   # Leader failed to submit: retry
+"""
+
+import time
+import uuid
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+
+
+class Flight:
+    """One extraction job shared by the requests for the same content."""
+
+    def __init__(self, key: Optional[str], job_id: str):
+        self.key = key
+        self.job_id = job_id
+        self.finished_at: Optional[float] = None
+        self.abandoned = False
+        self.joined = 0  # Followers attached to this job
+        self._submitted = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def wait_submitted(self, timeout: float) -> bool:
+        """Block until the leader has queued the job; False if it gave up or timeout passed"""
+        return self._submitted.wait(timeout) and not self.abandoned
+
+
+class RequestCoalescer:
+    """Single-flight map from content key to the job extracting that content."""
+
+    def __init__(self, window_sec: float = 300.0, clock: Callable[[], float] = time.monotonic,
+                 on_coalesced: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            window_sec:   How long a finished job stays joinable (0 = only while in flight)
+            on_coalesced: Called with IN_FLIGHT or COMPLETED for every joined duplicate (metrics)
+        """
+        self.window_sec = window_sec
+        self.clock = clock
+        self.on_coalesced = on_coalesced
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = {IN_FLIGHT: 0, COMPLETED: 0}
+
+    def join(self, key: Optional[str]) -> Tuple[Flight, bool]:
+        """
+        (flight, leader): the existing flight for key (leader=False), or a new one with
+        a fresh job id that the caller must submit (leader=True). key=None never coalesces.
+        """
+        if key is None:
+            return Flight(None, uuid.uuid4().hex), True
+        with self._lock:
+            self._prune()
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight(key, uuid.uuid4().hex)
+                return flight, True
+            flight.joined += 1
+            state = COMPLETED if flight.finished else IN_FLIGHT
+            self.coalesced[state] += 1
+        logger.info(f"[COALESCE] Duplicate upload joined job {flight.job_id} ({state})")
+        if self.on_coalesced:
+            try:
+                self.on_coalesced(state)
+            except Exception as e:
+                logger.warning(f"[COALESCE] on_coalesced callback failed: {e}")
+        return flight, False
+
+    def submitted(self, flight: Flight) -> None:
+        """Leader: the job is queued, followers may use its id"""
+        flight._submitted.set()
+
+    def abandon(self, flight: Flight) -> None:
+        """Leader: submitting failed - forget the flight and release waiting followers"""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.abandoned = True
+        flight._submitted.set()
+
+    def finish(self, key: Optional[str], job_id: str, succeeded: bool) -> None:
+        """Job handler: the job ended. A success stays joinable for window_sec; a failure is forgotten"""
+        if key is None:
+            return
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or flight.job_id != job_id:
+                return  # Not started by this process (e.g. resumed after a restart)
+            if succeeded and self.window_sec > 0:
+                flight.finished_at = self.clock()
+            else:
+                del self._flights[key]
+
+    def _prune(self) -> None:
+        cutoff = self.clock() - self.window_sec
+        for key in [k for k, f in self._flights.items() if f.finished and f.finished_at < cutoff]:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = sum(1 for f in self._flights.values() if not f.finished)
+            return {"in_flight": in_flight, "completed": len(self._flights) - in_flight,
+                    "coalesced_in_flight": self.coalesced[IN_FLIGHT],
+                    "coalesced_completed": self.coalesced[COMPLETED]}
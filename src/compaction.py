@@ -0,0 +1,121 @@
+"""
+Compaction Module: Drop clinically irrelevant sentences before the LLM call.
+
+TranscriptCompactor: Keeps labelled/medicine-bearing sentences plus a context window
+CompactionResult: Compacted text with kept/dropped ratios
+
+A sentence is relevant if SmartLabelClassifier labels it (complaint, diagnosis,
+test, advice, medicine) or it carries a medicine cue (drug name, dose, frequency)
+or a patient name/age cue. Relevant sentences keep context_sentences neighbours
+on each side; greetings, small talk and unrelated narration are dropped.
+
+Only the Groq input is compacted: rules extraction and post-processing still see
+the full transcript, so a dropped sentence can never hide a field from them.
+"""
+
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+try:
+    from .chunking import split_sentences
+    from .model_tiering import count_medicine_cues
+    from .prompt_builder import estimate_tokens
+    from .smart_labeling import SmartLabelClassifier
+except ImportError:
+    from chunking import split_sentences
+    from model_tiering import count_medicine_cues
+    from prompt_builder import estimate_tokens
+    from smart_labeling import SmartLabelClassifier
+
+logger = logging.getLogger(__name__)
+
+PATIENT_CUE = re.compile(r'\b(?:name|patient|years?\s+old|age[ds]?|mr|mrs|ms|miss)\b', re.IGNORECASE)
+
+
+@dataclass
+class CompactionResult:
+    """Compacted transcript and what was kept."""
+    text: str
+    original_tokens: int
+    compacted_tokens: int
+    total_sentences: int
+    kept_sentences: int
+    labels: Dict[str, int] = field(default_factory=dict)  # Label → relevant sentences with it
+    applied: bool = False  # False when the transcript was too short to bother
+
+    @property
+    def kept_ratio(self) -> float:
+        """Share of tokens sent to the LLM (1.0 = nothing dropped)."""
+        return self.compacted_tokens / self.original_tokens if self.original_tokens else 1.0
+
+    @property
+    def dropped_ratio(self) -> float:
+        return 1.0 - self.kept_ratio
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.compacted_tokens
+
+
+class TranscriptCompactor:
+    """Keeps clinically relevant sentences (plus neighbours) of a transcript."""
+
+    RELEVANT_LABELS = {"complaint", "diagnosis", "test", "advice", "medicine"}
+
+    def __init__(self, context_sentences: int = 1, min_tokens: int = 150, head_sentences: int = 1):
+        """
+        Args:
+            context_sentences: Neighbours kept on each side of a relevant sentence
+            min_tokens:        Transcripts shorter than this are passed through unchanged
+            head_sentences:    Opening sentences always kept (greetings often carry the name)
+        """
+        self.context_sentences = context_sentences
+        self.min_tokens = min_tokens
+        self.head_sentences = head_sentences
+        self.classifier = SmartLabelClassifier()
+
+    def compact(self, transcript: str) -> CompactionResult:
+        """Compact a transcript (applied=False and the text unchanged if nothing is worth dropping)."""
+        original_tokens = estimate_tokens(transcript)
+        sentences = split_sentences(transcript or "")
+        unchanged = CompactionResult(transcript, original_tokens, original_tokens,
+                                     len(sentences), len(sentences))
+        if original_tokens < self.min_tokens or len(sentences) < 2:
+            return unchanged
+
+        keep = [False] * len(sentences)
+        labels: Dict[str, int] = {}
+        for i, sentence in enumerate(sentences):
+            label = self._relevance(sentence)
+            if label is None:
+                continue
+            labels[label] = labels.get(label, 0) + 1
+            for j in range(max(0, i - self.context_sentences), min(len(sentences), i + self.context_sentences + 1)):
+                keep[j] = True
+        for i in range(min(self.head_sentences, len(sentences))):
+            keep[i] = True
+
+        if all(keep):
+            unchanged.labels = labels
+            return unchanged
+        if not labels:
+            logger.info("[COMPACT] No clinically relevant sentence found - sending full transcript")
+            return unchanged
+
+        text = " ".join(s for s, k in zip(sentences, keep) if k)
+        result = CompactionResult(text, original_tokens, estimate_tokens(text), len(sentences),
+                                  sum(keep), labels, applied=True)
+        logger.info(f"[COMPACT] Kept {result.kept_sentences}/{result.total_sentences} sentences, "
+                    f"{result.compacted_tokens}/{result.original_tokens} tokens ({result.kept_ratio:.0%})")
+        return result
+
+    def _relevance(self, sentence: str) -> Optional[str]:
+        """Why a sentence matters ('medicine_cue', 'patient', or its clinical label), else None."""
+        if count_medicine_cues(sentence):
+            return "medicine_cue"
+        if PATIENT_CUE.search(sentence):
+            return "patient"
+        label, _, _ = self.classifier.classify(sentence)
+        return label if label in self.RELEVANT_LABELS else None
@@ -0,0 +1,53 @@
+"""
+Cost Module: What each request pays for (Whisper audio seconds, Groq tokens).
+
+whisper_cost: USD for audio seconds sent to Whisper
+groq_cost: USD for one model's prompt/completion tokens (cached prompt tokens discounted)
+cache_savings: USD saved by cached prompt tokens
+
+Prices are list prices per unit and can be overridden without a code change:
+  WHISPER_USD_PER_MINUTE              (default 0.006)
+  GROQ_PRICING='{"model": [input_usd_per_1m, output_usd_per_1m], ...}'
+  GROQ_CACHED_INPUT_DISCOUNT          (fraction off cached prompt tokens, default 0.5)
+"""
+
+import os
+import json
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+WHISPER_USD_PER_MINUTE = float(os.getenv("WHISPER_USD_PER_MINUTE", "0.006"))
+CACHED_INPUT_DISCOUNT = float(os.getenv("GROQ_CACHED_INPUT_DISCOUNT", "0.5"))
+
+# USD per 1M tokens: (input, output)
+GROQ_PRICING: Dict[str, Tuple[float, float]] = {
+    "openai/gpt-oss-120b": (0.15, 0.60),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+}
+DEFAULT_GROQ_PRICE = GROQ_PRICING["openai/gpt-oss-120b"]  # Unknown models are costed as the large model
+
+try:
+    GROQ_PRICING.update({model: tuple(price) for model, price in
+                         json.loads(os.getenv("GROQ_PRICING", "{}")).items()})
+except (ValueError, TypeError) as e:
+    logger.warning(f"[COST] Ignoring invalid GROQ_PRICING: {e}")
+
+
+def whisper_cost(audio_sec: float) -> float:
+    """USD for audio_sec seconds of audio sent to Whisper."""
+    return audio_sec / 60.0 * WHISPER_USD_PER_MINUTE
+
+
+def groq_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """USD for one model's tokens; cached prompt tokens are billed at the discounted rate."""
+    input_price, output_price = GROQ_PRICING.get(model, DEFAULT_GROQ_PRICE)
+    billed_prompt = prompt_tokens - cached_tokens * CACHED_INPUT_DISCOUNT
+    return (billed_prompt * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def cache_savings(model: str, cached_tokens: int) -> float:
+    """USD saved by cached prompt tokens (versus paying the full input price)."""
+    input_price, _ = GROQ_PRICING.get(model, DEFAULT_GROQ_PRICE)
+    return cached_tokens * CACHED_INPUT_DISCOUNT * input_price / 1_000_000
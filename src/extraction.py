@@ -9,7 +9,10 @@ import os
 import json
 import logging
 import re
-from typing import Dict, List, Optional
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 from difflib import get_close_matches, SequenceMatcher
 
@@ -33,6 +36,27 @@ try:
 except ImportError:
     MEDICINE_DB_AVAILABLE = False
 
+try:
+    from .prompt_builder import ExtractionPromptBuilder, estimate_tokens
+    from .json_stream import IncrementalJSONParser
+    from .chunking import split_transcript, merge_extractions
+    from .rate_limit import RateLimiter, backoff_delay, is_rate_limit_error, retry_after_from
+    from .model_router import ModelRouter
+    from .hedging import HedgeBudget, StreamHandle
+    from .model_tiering import ModelTierSelector, ComplexityEstimate
+    from .record_replay import wrap_client, replay_mode, MODE_REPLAY
+    from .cost import groq_cost, cache_savings
+except ImportError:
+    from prompt_builder import ExtractionPromptBuilder, estimate_tokens
+    from json_stream import IncrementalJSONParser
+    from chunking import split_transcript, merge_extractions
+    from rate_limit import RateLimiter, backoff_delay, is_rate_limit_error, retry_after_from
+    from model_router import ModelRouter
+    from hedging import HedgeBudget, StreamHandle
+    from model_tiering import ModelTierSelector, ComplexityEstimate
+    from record_replay import wrap_client, replay_mode, MODE_REPLAY
+    from cost import groq_cost, cache_savings
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,128 +82,63 @@ class GroqLLMExtractor:
     - Automatic fallback between methods
     """
 
-    EXTRACTION_PROMPT = """
-You are a medical data extraction specialist. Extract prescription data from the following medical consultation in ANY LANGUAGE.
-
-⚠️ CRITICAL JSON FORMAT REQUIREMENTS:
-- You MUST return STRICTLY VALID JSON ONLY
-- Do NOT include markdown, code blocks, or explanations
-- Do NOT include comments
-- Do NOT use trailing commas
-- Ensure ALL strings are properly closed (no unterminated strings)
-- Output must begin with {{ and end with }}
-- Escape special characters properly: \" for quotes, \\ for backslashes
-
-📦 COMPACT JSON OUTPUT:
-- Return compact JSON only (no extra whitespace)
-- Do not include extra whitespace or newlines inside JSON
-- Keep advice concise (short, actionable strings max 100 chars)
-- Keep complaint and diagnosis strings concise
-- Minimize array/object nesting where possible
-- Output MUST begin with {{ and MUST end with }}
-- All medicine names, diagnoses, and complaints MUST be in ENGLISH ONLY
-
-🌍 MULTILINGUAL SUPPORT - CRITICAL EXTRACTION RULES:
-
-📍 ENGLISH CONSULTATION:
-- Extract directly. Diagnoses like: viral pharyngitis, bacterial infection, sinusitis, asthma, diabetes
-- Medicines: paracetamol, amoxicillin, levocetirizine, omeprazole, amlodipine
-- Frequency terms: "3 times a day", "once daily", "every 8 hours", "at night"
-
-📍 TAMIL/THANGLISH CONSULTATION (Tamil words in English letters):
-- 'noi' = disease, 'marunthu' = medicine, 'vali' = pain, 'kaichal'/'kayachel'/'kaiachel' = fever
-- 'irukku' = has/is, 'irundha' = if there is, 'varaam'/'varum' = may occur
-- 'daily X murai' or 'daily X times' = X times a day
-- 'food apram'/'saptu patthu' = after food, 'iravu'/'night time' = at night
-- 'nalla vali' = severe pain, 'slight vali' = mild pain
-- 'mookkadaippu' = nasal congestion, 'sinus vali' = sinusitis
-- Medicines: aspirin = 'aspirin', paracetamol = 'paracetamol'/'para', amoxicillin = 'amox'/'amoxycillin'
-- Amount: '500 mg' = '500 milligram', 'oru tablet' = '1 tablet', 'rendu tablet' = '2 tablets'
-- 'kammi panna' = reduce/do less, 'confirm panna' = diagnose/confirm
-
-📍 ARABIC CONSULTATION:
-- 'مرض'/'marad' = disease, 'دواء'/'dawa' = medicine, 'ألم'/'alam' = pain, 'حمى'/'humma' = fever
-- 'صداع'/'sudaa' = headache, 'سعال'/'suaal' = cough, 'إسهال'/'ishal' = diarrhea
-- 'عدوى بكتيرية'/'adwa bakteriya' = bacterial infection, 'التهاب الحلق'/'iltiab alhalq' = pharyngitis
-- Frequency: 'مرات في اليوم'/'marat fi alyawm' = times a day, 'ثلاث مرات'/'talat marat' = 3 times
-- Duration: 'أيام'/'ayyam' = days, 'أسبوع'/'usbua' = week
-- Instructions: 'بعد الأكل'/'baada alakl' = after food, 'قبل النوم'/'qabl alnawm' = before sleep
-- Medicines in Arabic: 'الأسبرين'/'aspireen', 'الباراسيتامول'/'paracetamol', 'الأموكسيسيللين'/'amoxicillin'
-
-IMPORTANT EXTRACTION RULES:
-- ALWAYS translate/convert medicine names, diagnoses, and complaints to ENGLISH EQUIVALENTS
-- For ambiguous terms, use medical context to determine meaning
-- If text is very unclear, return null rather than guessing
-- Recognize common ASR artifacts: 'inflection'→'infection', 'paragenesis'→'pharyngitis', 'antibiotic risk'→'antibiotics'
-- Patient names should be extracted as given (can be local language), but all clinical data MUST be ENGLISH
-
-Return JSON with these exact keys (NO OTHER TEXT, NO EXPLANATIONS):
-{{
-  "patient_name": "string or null",
-  "age": null,
-  "complaints": ["fever", "throat pain"],
-  "diagnosis": ["viral pharyngitis"],
-  "medicines": [
-    {{
-      "name": "paracetamol",
-      "dose": "500 mg",
-      "frequency": "3 times a day",
-      "duration": "5 days",
-      "instruction": "after food"
-    }},
-    {{
-      "name": "levocetirizine",
-      "dose": "5 mg",
-      "frequency": "once a day",
-      "duration": "5 days",
-      "instruction": "at night"
-    }}
-  ],
-  "tests": [],
-  "advice": ["avoid cold drinks", "drink warm water", "rest adequately"]
-}}
-
-Medical Consultation:
-{consultation}
-
-EXTRACTION RULES:
-- Return ONLY valid JSON, nothing else
-- Capture ALL medicines mentioned: including tablets, sprays, lozenges, and supplements.
-- Patient name: Extract ONCE, no duplicates (e.g. "Hi Rohit, Rohit..." → "Rohit")
-- Complaints: Specific symptoms mentioned (fever, throat pain, cough, etc.)
-- Diagnosis: Medical conditions (viral pharyngitis, bacterial infection, etc.)
-- Medicines: Only prescribed items with best available information
-  * name: medicine name (e.g., "levocetirizine")
-  * dose: include units (mg, ml, mcg, gm, iu, tablet, capsule, sprays, lozenge)
-  * frequency: times per day (e.g., "once a day", "2 times a day", "every 6-8 hours")
-  * duration: days/weeks (e.g., "5 days") - capture if mentioned per medicine
-  * instruction: timing/method ("after food", "at night", "topical", "as needed")
-- Tests: Capture ALL lab tests/investigations mentioned. Common ones:
-  * "CBC" = Complete Blood Count
-  * "CRP" = C-Reactive Protein
-  * "X-ray PNS" or "PNS x-ray" = Paranasal Sinus X-ray
-  * "nasal swab" = nasal swab culture
-  * Include any blood test, imaging, or culture mentioned
-- Advice: Patient guidance strings in English (translate Thanglish to English if needed)
-
-Output ONLY the JSON object. No markdown. No code blocks. No explanations.
-"""
-
+    # Extraction models only (safety classifiers such as llama-prompt-guard cannot produce prescriptions)
     GROQ_MODELS = [
         "openai/gpt-oss-120b",
         "meta-llama/llama-4-scout-17b-16e-instruct",
-        "meta-llama/llama-prompt-guard-2-8k",
     ]
 
+    # Models that accept response_format={"type": "json_object"} (provider JSON mode)
+    JSON_MODE_MODELS = {
+        "openai/gpt-oss-120b",
+        "meta-llama/llama-4-scout-17b-16e-instruct",
+    }
+    MAX_COMPLETION_TOKENS = 2000
+    MAX_CONTINUATIONS = 2  # Continuation requests after truncated output (never a full re-generation)
+
+    # Map-reduce: consultations above this many tokens are split and extracted per chunk
+    CHUNK_THRESHOLD_TOKENS = int(os.getenv("GROQ_CHUNK_THRESHOLD_TOKENS", "3000"))
+    CHUNK_TARGET_TOKENS = int(os.getenv("GROQ_CHUNK_TARGET_TOKENS", "1500"))
+    MAX_CHUNK_WORKERS = 4
+
+    # Rate limiting: tokens reserved per request = prompt estimate + expected completion
+    EXPECTED_COMPLETION_TOKENS = 600
+    MAX_RATE_LIMIT_RETRIES = 4
+    RATE_LIMIT_BACKOFF_BASE_SEC = 0.5
+
+    BREAKER_COOLDOWN_SEC = float(os.getenv("GROQ_BREAKER_COOLDOWN_SEC", "30"))
+
+    # Hedging: duplicate a call that is slower than this percentile of recent latency
+    HEDGE_BUDGET_PCT = float(os.getenv("GROQ_HEDGE_BUDGET_PCT", "0"))  # 0 = disabled
+    HEDGE_PERCENTILE = float(os.getenv("GROQ_HEDGE_PERCENTILE", "95"))
+    HEDGE_NEXT_MODEL = os.getenv("GROQ_HEDGE_NEXT_MODEL", "true").lower() == "true"
+    HEDGE_MIN_SAMPLES = 10  # Latency samples needed before the percentile is trusted
+
+    # Billed usage kept on every result that made Groq calls (summed across chunks)
+    COST_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens", "groq_requests", "groq_retries",
+                 "cost_usd", "cache_savings_usd")
+
     def __init__(self):
         """Initialize Groq client if API key available, otherwise use rules-only mode."""
-        self.use_groq = GROQ_AVAILABLE and self._check_groq()
+        replaying = replay_mode() == MODE_REPLAY  # Recorded Groq responses: no SDK or key needed
+        self.use_groq = replaying or (GROQ_AVAILABLE and self._check_groq())
         self.client = None
         self.available_model = None
+        self.prompt_builder = ExtractionPromptBuilder()
+        self._json_mode_rejected = set()  # Models that refused response_format at runtime
+        self._chunk_executor = ThreadPoolExecutor(max_workers=self.MAX_CHUNK_WORKERS,
+                                                  thread_name_prefix="extract-chunk")
+        self.rate_limiter = RateLimiter.from_env()  # Shared by every thread calling this extractor
+        # Per-request model choice: breakers + rolling error rate/latency per GROQ_MODELS entry
+        self.model_router = ModelRouter(self.GROQ_MODELS, cooldown_sec=self.BREAKER_COOLDOWN_SEC)
+        self.hedge_budget = HedgeBudget(self.HEDGE_BUDGET_PCT)
+        self.tier_selector = ModelTierSelector()  # Small/simple transcripts → faster model
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="extract-hedge")
+        self._usage_lock = threading.Lock()  # A losing hedge may still be adding tokens to the usage dict
 
         if self.use_groq:
             try:
-                self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+                self.client = wrap_client(None if replaying else Groq(api_key=os.getenv("GROQ_API_KEY")), "groq")
                 self.available_model = self._find_available_model()
                 if self.available_model:
                     logger.info(f"[OK] Groq initialized - using {self.available_model}")
@@ -192,81 +151,491 @@ Output ONLY the JSON object. No markdown. No code blocks. No explanations.
         else:
             logger.info("Using rule-based extraction (stable, always available)")
 
-    def extract(self, transcript: str, use_groq: bool = True) -> Dict:
+    def extract(self, transcript: str, use_groq: bool = True,
+                language: Optional[str] = None,
+                on_partial: Optional[Callable[[str, Any], None]] = None) -> Dict:
         """
         Extract prescription data.
         
         Args:
             transcript: Medical consultation text
             use_groq: Whether to try Groq API (falls back to rules if unavailable)
+            language: Detected language ('en', 'ta', 'tanglish', 'ar') - selects prompt sections
+            on_partial: Optional callback(kind, payload) fired while Groq streams:
+                        ("field", {key: value}) or ("medicine", medicine_dict)
         
         Returns:
-            Dict with keys: success, data, method
+            Dict with keys: success, data, method (+ usage, raw_output for Groq)
         """
         if self.use_groq and use_groq:
-            return self._extract_groq(transcript)
+            return self._extract_groq(transcript, language=language, on_partial=on_partial)
         else:
             return self._extract_rules(transcript)
 
+    def extract_many(self, transcripts: List[str], language: Any = None, max_workers: int = 4,
+                     on_result: Optional[Callable[[int, Dict], None]] = None) -> Dict:
+        """
+        Extract a batch of transcripts concurrently under the shared rate limiter.
+
+        Args:
+            transcripts: Consultation texts
+            language:    One language for all, or a list (one per transcript)
+            max_workers: Concurrent requests in flight
+            on_result:   Optional callback(index, result) as each transcript finishes
+
+        Returns:
+            {"results": [...] in input order, "stats": throughput and throttle counters}
+        """
+        languages = language if isinstance(language, (list, tuple)) else [language] * len(transcripts)
+        results: List[Optional[Dict]] = [None] * len(transcripts)
+        before = self.rate_limiter.snapshot()
+        start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="extract-batch") as pool:
+            futures = {pool.submit(self.extract, text, True, lang): index
+                       for index, (text, lang) in enumerate(zip(transcripts, languages))}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    logger.error(f"[BATCH] Transcript {index} failed: {type(e).__name__}: {e}")
+                    results[index] = {"success": False, "data": {}, "method": "error", "error": str(e)}
+                if on_result:
+                    on_result(index, results[index])
+
+        elapsed = time.monotonic() - start
+        after = self.rate_limiter.snapshot()
+        methods: Dict[str, int] = {}
+        for result in results:
+            methods[result.get("method", "unknown")] = methods.get(result.get("method", "unknown"), 0) + 1
+        succeeded = sum(1 for r in results if r.get("success"))
+
+        stats = {
+            "total": len(transcripts),
+            "succeeded": succeeded,
+            "failed": len(transcripts) - succeeded,
+            "methods": methods,
+            "elapsed_sec": round(elapsed, 3),
+            "throughput_per_min": round(len(transcripts) / elapsed * 60, 1) if elapsed > 0 else 0.0,
+            "requests_sent": after["requests"] - before["requests"],
+            "tokens_reserved": after["tokens_reserved"] - before["tokens_reserved"],
+            "throttle_events": after["throttle_events"] - before["throttle_events"],
+            "throttled_sec": round(after["throttled_sec"] - before["throttled_sec"], 3),
+            "rate_limited_429": after["rate_limited"] - before["rate_limited"],
+        }
+        logger.info(f"[BATCH] {succeeded}/{len(transcripts)} extracted in {elapsed:.1f}s "
+                    f"({stats['throughput_per_min']}/min, {stats['throttle_events']} throttled, "
+                    f"{stats['rate_limited_429']} x 429)")
+        return {"results": results, "stats": stats}
+
     # ── Groq extraction ────────────────────────────────────────────────────────
 
-    def _extract_groq(self, transcript: str) -> Dict:
-        """Extract using Groq API with automatic fallback to rules."""
+    def _extract_groq(self, transcript: str, language: Optional[str] = None,
+                      on_partial: Optional[Callable[[str, Any], None]] = None) -> Dict:
+        """Extract with Groq; consultations above CHUNK_THRESHOLD_TOKENS go through map-reduce."""
+        if self.available_model and estimate_tokens(transcript) > self.CHUNK_THRESHOLD_TOKENS:
+            return self._extract_groq_chunked(transcript, language=language, on_partial=on_partial)
+        return self._extract_groq_single(transcript, language=language, on_partial=on_partial)
+
+    def _extract_groq_chunked(self, transcript: str, language: Optional[str] = None,
+                              on_partial: Optional[Callable[[str, Any], None]] = None) -> Dict:
+        """
+        Map-reduce extraction for long consultations.
+
+        Map: split at sentence/topic boundaries and extract every chunk concurrently.
+        Reduce: merge the partial prescriptions in chunk order (deterministic de-duplication).
+        Chunks that fall back to rules still contribute; the method is 'groq' if any chunk used Groq.
+        """
+        chunks = split_transcript(transcript, self.CHUNK_TARGET_TOKENS)
+        if len(chunks) == 1:
+            return self._extract_groq_single(transcript, language=language, on_partial=on_partial)
+
+        logger.info(f"[CHUNK] Map-reduce extraction over {len(chunks)} chunks "
+                    f"(~{estimate_tokens(transcript)} tokens)")
+        # Tier from the whole consultation: chunks of a long visit stay on the large model
+        complexity = self.tier_selector.select(transcript, language)
+        futures = [self._chunk_executor.submit(self._extract_groq_single, chunk, language, on_partial, complexity)
+                   for chunk in chunks]
+        results = [future.result() for future in futures]  # Input order, not completion order
+
+        data = merge_extractions([r.get("data") for r in results if r.get("success")])
+        groq_chunks = sum(1 for r in results if r.get("method") == "groq")
+        usage = {
+            "prompt_tokens_estimate": sum(r.get("usage", {}).get("prompt_tokens_estimate", 0) for r in results),
+            "continuations": sum(r.get("usage", {}).get("continuations", 0) for r in results),
+            "chunks": len(chunks),
+            "groq_chunks": groq_chunks,
+            "tier": complexity.tier,
+            "medicine_cues": complexity.medicine_cues,
+            "latency_sec": max((r.get("usage", {}).get("latency_sec", 0.0) for r in results), default=0.0),
+            "latency_saved_sec": 0.0,
+            "tokens_estimated": any(r.get("usage", {}).get("tokens_estimated") for r in results),
+        }
+        for key in self.COST_KEYS:
+            usage[key] = sum(r.get("usage", {}).get(key, 0) for r in results)
+        logger.info(f"[CHUNK] Merged {len(chunks)} chunks ({groq_chunks} via Groq): "
+                    f"{len(data.get('medicines', []))} medicines, {len(data.get('diagnosis', []))} diagnoses")
+        return {"success": True, "data": data, "method": "groq" if groq_chunks else "rules", "usage": usage}
+
+    def _extract_groq_single(self, transcript: str, language: Optional[str] = None,
+                             on_partial: Optional[Callable[[str, Any], None]] = None,
+                             complexity: Optional[ComplexityEstimate] = None) -> Dict:
+        """
+        Extract using streamed Groq completion with automatic fallback to rules.
+
+        The response is fed into an IncrementalJSONParser as it arrives. Truncated
+        output triggers a continuation request (not a full re-generation); if the
+        object still never closes, the fields that did close are used.
+
+        The model comes from the size/complexity tier while that model is healthy,
+        otherwise from the model router's health ranking.
+        """
         if not self.available_model:
             return self._extract_rules(transcript)
 
+        complexity = complexity or self.tier_selector.select(transcript, language)
+        model = self.model_router.select(prefer=complexity.model)
+        if not model:
+            logger.warning("[ROUTER] All Groq model breakers open - using rules")
+            return self._extract_rules(transcript)
+        selected, probe = model, self.model_router.is_probing(model)
+
         try:
-            logger.info(f"Extracting with Groq ({self.available_model})...")
+            logger.info(f"Extracting with Groq ({model})...")
 
-            prompt = self.EXTRACTION_PROMPT.format(consultation=transcript)
+            # Static instructions first (system), consultation last (user) → cacheable prefix
+            prompt = self.prompt_builder.build(transcript, language=language)
+            usage = {"prompt_tokens_estimate": prompt.total_tokens, "continuations": 0, "model": model,
+                     "tier": complexity.tier, "medicine_cues": complexity.medicine_cues,
+                     "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                     "groq_requests": 0, "groq_retries": 0, "tokens_estimated": False}
 
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.available_model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0,
-                    max_tokens=2000
-                )
+            parser = IncrementalJSONParser(
+                on_field=(lambda key, value: on_partial("field", {key: value})) if on_partial else None,
+                on_medicine=(lambda med: on_partial("medicine", med)) if on_partial else None,
+            )
 
-                output = response.choices[0].message.content.strip()
+            api_failed = False
+            try:
+                model, parser, output, latency = self._stream_hedged(model, prompt.messages, parser, usage)
+                usage["model"] = model
                 logger.debug(f"Groq raw response ({len(output)} chars): {output[:200]}...")
             except Exception as e:
                 logger.warning(f"[GROQ] API call failed: {type(e).__name__}: {e}")
-                return self._extract_rules(transcript)
+                api_failed = True
+                output = parser.text
+                if not parser.partial_result():
+                    return self._rules_after_groq(transcript, usage)
 
-            # Parse JSON safely with multiple fallback strategies
-            data = self._robust_json_parse(output)
+            # Completed object → direct; otherwise robust parse of full text, then closed fields
+            data = parser.result() or self._robust_json_parse(output)
             if not data:
-                # RETRY: Try once more with explicit complete-JSON instruction
-                logger.info("[GROQ] First parse failed, retrying with explicit completion instruction...")
-                try:
-                    retry_prompt = prompt + "\n\nIMPORTANT: Return complete valid JSON. Ensure it ends with }}. Do not truncate. Return ONLY the JSON object."
-                    retry_response = self.client.chat.completions.create(
-                        model=self.available_model,
-                        messages=[{"role": "user", "content": retry_prompt}],
-                        temperature=0,
-                        max_tokens=2000
-                    )
-                    retry_output = retry_response.choices[0].message.content.strip()
-                    logger.debug(f"Groq retry response ({len(retry_output)} chars): {retry_output[:200]}...")
-                    data = self._robust_json_parse(retry_output)
-                except Exception as e:
-                    logger.warning(f"[GROQ] Retry failed: {type(e).__name__}: {e}")
-                    data = None
-                
-                if not data:
-                    logger.warning(f"[GROQ] Could not parse JSON after 2 attempts, response was: {output[:300]}...")
-                    return self._extract_rules(transcript)
+                data = parser.partial_result()
+                if data:
+                    logger.warning(f"[GROQ] JSON never closed - using {len(data)} fields that completed "
+                                   f"({len(parser.medicines)} medicines)")
+                else:
+                    logger.warning(f"[GROQ] Could not parse JSON, response was: {output[:300]}...")
+                    self.model_router.record_failure(model, "unparseable output")
+                    return self._rules_after_groq(transcript, usage)
+            if not api_failed:
+                self.model_router.record_success(model, latency)
+                usage["latency_sec"] = round(latency, 3)
+                usage["latency_saved_sec"] = self._latency_saved(model, latency)
+            self._price_usage(usage)
 
             # Post-process
             data = self._post_process(data)
             logger.info(f"[OK] Groq extraction: {len(data.get('medicines', []))} medicines, "
                        f"{len(data.get('diagnosis', []))} diagnoses")
-            return {"success": True, "data": data, "method": "groq"}
+            return {"success": True, "data": data, "method": "groq", "usage": usage, "raw_output": output}
 
         except Exception as e:
             logger.warning(f"[GROQ] Unexpected error during extraction: {type(e).__name__}: {str(e)[:100]}")
             return self._extract_rules(transcript)
+        finally:
+            if probe:  # No-op once success/failure was recorded; otherwise (429, partial output, error) frees it
+                self.model_router.record_cancelled(selected)
+
+    def _price_usage(self, usage: Dict) -> Dict:
+        """Add cost_usd and cache_savings_usd for the tokens counted in usage (priced at usage['model'])."""
+        with self._usage_lock:
+            model = usage.get("model", "")
+            usage["cost_usd"] = groq_cost(model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                                          usage.get("cached_tokens", 0))
+            usage["cache_savings_usd"] = cache_savings(model, usage.get("cached_tokens", 0))
+        return usage
+
+    def _rules_after_groq(self, transcript: str, usage: Dict) -> Dict:
+        """Rules fallback after Groq calls were made: keeps what those calls cost."""
+        result = self._extract_rules(transcript)
+        self._price_usage(usage)
+        result["usage"] = {key: usage.get(key, 0) for key in self.COST_KEYS}
+        return result
+
+    def _add_usage(self, usage: Optional[Dict], **counts) -> None:
+        """Thread-safe increments of usage counters (no-op without a usage dict)."""
+        if usage is None:
+            return
+        with self._usage_lock:
+            for key, value in counts.items():
+                usage[key] = usage.get(key, 0) + value
+
+    def _latency_saved(self, model: str, latency: float) -> float:
+        """Seconds saved versus the large model's recent p50 (0 on the large model or without history)."""
+        large_model = self.tier_selector.large_model
+        if model == large_model:
+            return 0.0
+        baseline = self.model_router.latency_percentile(large_model, 50)
+        return round(baseline - latency, 3) if baseline is not None else 0.0
+
+    def _stream_hedged(self, model: str, messages: List[Dict], parser: IncrementalJSONParser,
+                       usage: Dict) -> Tuple[str, IncrementalJSONParser, str, float]:
+        """
+        Stream the extraction, hedging slow calls.
+
+        If the first call has not finished by HEDGE_PERCENTILE of the model's recent
+        latency and the hedge budget allows, an identical request is fired (to the next
+        healthy model when HEDGE_NEXT_MODEL is set). The first attempt to produce valid
+        JSON wins and the other stream is cancelled. Only the first attempt's parser
+        carries the on_partial callbacks, muted if the hedge wins. Both attempts' tokens
+        are counted in usage.
+
+        Returns:
+            (model, parser, output, latency_sec) of the winning attempt
+        Raises:
+            The first attempt's error if no attempt produced any output
+        """
+        self.hedge_budget.record_request()
+        delay = None
+        if self.hedge_budget.enabled:
+            delay = self.model_router.latency_percentile(model, self.HEDGE_PERCENTILE,
+                                                         min_samples=self.HEDGE_MIN_SAMPLES)
+        if delay is None:
+            return self._stream_attempt(model, messages, parser, usage, None)
+
+        primary_handle = StreamHandle()
+        primary = self._hedge_executor.submit(self._stream_attempt, model, messages, parser,
+                                              usage, primary_handle)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedge_budget.try_acquire():
+            return primary.result()
+
+        hedge_model = (self.model_router.select(exclude=[model]) if self.HEDGE_NEXT_MODEL else None) or model
+        logger.info(f"[HEDGE] {model} slower than p{self.HEDGE_PERCENTILE:.0f} ({delay:.2f}s) - "
+                    f"hedging to {hedge_model}")
+        usage["hedged"] = True
+        hedge_handle = StreamHandle()
+        hedge_usage = {"continuations": 0}
+        hedge = self._hedge_executor.submit(self._stream_attempt, hedge_model, messages,
+                                            IncrementalJSONParser(), hedge_usage, hedge_handle, usage)
+        handles = {primary: primary_handle, hedge: hedge_handle}
+        hedge_probe = hedge_model != model and self.model_router.is_probing(hedge_model)
+
+        first_error, fallback, returned = None, None, None
+        try:
+            for future in as_completed([primary, hedge]):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+                _, attempt_parser, output, _ = result
+                if attempt_parser.result() is not None or self._robust_json_parse(output):
+                    if future is hedge:
+                        parser.mute()  # The losing primary may still stream: no more partials from it
+                    for other, handle in handles.items():
+                        if other is not future:
+                            handle.cancel()
+                    if future is hedge:
+                        self._add_usage(usage, continuations=hedge_usage["continuations"])
+                        logger.info(f"[HEDGE] Hedge to {hedge_model} won")
+                    returned = future
+                    return result
+                fallback = fallback or (future, result)
+            if fallback:
+                returned = fallback[0]
+                return fallback[1]
+            raise first_error
+        finally:
+            # A hedge probe that finished but is not handed to the caller gets no outcome: free its slot
+            if hedge_probe and hedge.done() and returned is not hedge:
+                self.model_router.record_cancelled(hedge_model)
+
+    def _stream_attempt(self, model: str, messages: List[Dict], parser: IncrementalJSONParser,
+                        usage: Dict, handle: Optional[StreamHandle],
+                        cost: Optional[Dict] = None) -> Tuple[str, IncrementalJSONParser, str, float]:
+        """
+        One streamed extraction attempt; failures are reported to the model router.
+        Tokens and requests go to cost (default: usage), so a hedge bills the request it hedges.
+        """
+        start = time.monotonic()
+        try:
+            output = self._stream_json(model, messages, parser, usage, handle=handle,
+                                       cost=cost if cost is not None else usage)
+        except Exception as e:
+            if not is_rate_limit_error(e):  # Provider-wide throttling says nothing about this model
+                self.model_router.record_failure(model, f"{type(e).__name__}: {str(e)[:80]}")
+            raise
+        if handle is not None and handle.cancelled.is_set():
+            self.model_router.record_cancelled(model)
+        return model, parser, output, time.monotonic() - start
+
+    def _stream_json(self, model: str, messages: List[Dict], parser: IncrementalJSONParser,
+                     usage: Dict, handle: Optional[StreamHandle] = None,
+                     cost: Optional[Dict] = None) -> str:
+        """
+        Stream a completion into parser. If the object is cut off (max_tokens or an
+        early stop), prefill the partial output as an assistant turn so the model
+        continues from where it stopped instead of starting over.
+        """
+        output = ""
+        for attempt in range(self.MAX_CONTINUATIONS + 1):
+            if output:
+                request_messages = messages + [{"role": "assistant", "content": output}]
+            else:
+                request_messages = messages
+            # JSON mode only on the first request: a continuation is not a standalone object
+            text, finish_reason = self._stream_completion(model, request_messages, parser,
+                                                          json_mode=not output, handle=handle,
+                                                          usage=cost if cost is not None else usage)
+            output += text
+            if handle is not None and handle.cancelled.is_set():
+                break
+
+            if parser.complete or not (parser.truncated or finish_reason == "length"):
+                break
+            if attempt < self.MAX_CONTINUATIONS:
+                self._add_usage(usage, continuations=1)
+                logger.info(f"[GROQ] Output truncated at {len(output)} chars "
+                            f"(finish_reason={finish_reason}) - requesting continuation")
+        return output
+
+    def _stream_completion(self, model: str, messages: List[Dict], parser: IncrementalJSONParser,
+                           json_mode: bool = True, handle: Optional[StreamHandle] = None,
+                           usage: Optional[Dict] = None) -> Tuple[str, Optional[str]]:
+        """
+        Run one streamed chat completion, feeding each delta to parser. Returns (text, finish_reason).
+
+        A cancelled handle stops reading and returns what arrived so far (finish_reason 'cancelled').
+        Billed tokens are added to usage: the provider's counts from the final chunk, or
+        estimates (tokens_estimated=True) when the stream ended without them.
+        """
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0,
+            "max_tokens": self.MAX_COMPLETION_TOKENS,
+            "stream": True,
+        }
+        if json_mode and model in self.JSON_MODE_MODELS and model not in self._json_mode_rejected:
+            kwargs["response_format"] = {"type": "json_object"}
+
+        prompt_estimate = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        token_estimate = prompt_estimate + self.EXPECTED_COMPLETION_TOKENS
+        try:
+            stream = self._create_completion(kwargs, token_estimate, usage)
+        except Exception as e:
+            if "response_format" not in kwargs or not self._is_json_mode_rejection(e):
+                raise
+            # Provider refused JSON mode for this model (e.g. not supported with streaming)
+            logger.info(f"[GROQ] JSON mode rejected for {model} ({type(e).__name__}) - streaming without it")
+            self._json_mode_rejected.add(model)
+            kwargs.pop("response_format")
+            self._add_usage(usage, groq_retries=1)
+            stream = self._create_completion(kwargs, token_estimate, usage)
+
+        if handle is not None:
+            handle.stream = stream
+
+        parts = []
+        finish_reason = None
+        reported = None
+        try:
+            for chunk in stream:
+                if handle is not None and handle.cancelled.is_set():
+                    finish_reason = "cancelled"
+                    break
+                reported = self._reported_usage(chunk) or reported
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = getattr(choice.delta, "content", None)
+                if delta:
+                    parts.append(delta)
+                    parser.feed(delta)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        except Exception:
+            if handle is None or not handle.cancelled.is_set():
+                raise
+            finish_reason = "cancelled"  # Stream closed under us by the winning attempt
+        finally:
+            self._count_tokens(usage, reported, prompt_estimate, parts)
+        return "".join(parts), finish_reason
+
+    @staticmethod
+    def _is_json_mode_rejection(error: Exception) -> bool:
+        """Whether an SDK exception is a 400 refusing response_format (not a transient or unrelated failure)"""
+        status = getattr(error, "status_code", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        if status != 400 and type(error).__name__ != "BadRequestError":
+            return False
+        message = str(error).lower()
+        return "response_format" in message or "json_object" in message
+
+    @staticmethod
+    def _reported_usage(chunk) -> Optional[Any]:
+        """Provider token counts on a stream chunk (Groq: x_groq.usage on the last chunk; OpenAI-style: usage)."""
+        return getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+    def _count_tokens(self, usage: Optional[Dict], reported: Optional[Any], prompt_estimate: int,
+                      parts: List[str]) -> None:
+        """Add one completion's tokens to usage (reported counts when present, else estimates)."""
+        if usage is None:
+            return
+        if isinstance(getattr(reported, "prompt_tokens", None), int):
+            completion = getattr(reported, "completion_tokens", 0)
+            cached = getattr(getattr(reported, "prompt_tokens_details", None), "cached_tokens", 0)
+            self._add_usage(usage, prompt_tokens=reported.prompt_tokens,
+                            completion_tokens=completion if isinstance(completion, int) else 0,
+                            cached_tokens=cached if isinstance(cached, int) else 0)
+        else:
+            self._add_usage(usage, prompt_tokens=prompt_estimate,
+                            completion_tokens=estimate_tokens("".join(parts)))
+            usage["tokens_estimated"] = True
+
+    def _create_completion(self, kwargs: Dict, token_estimate: int, usage: Optional[Dict] = None):
+        """
+        Start a completion within the rate limiter's budget.
+
+        Rate-limit headers on the response adapt the budget; 429s pause all callers
+        and are retried with jittered exponential backoff (honouring Retry-After).
+        Every request and retry is counted in usage (groq_requests, groq_retries).
+        """
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES + 1):
+            self.rate_limiter.acquire(token_estimate)
+            self._add_usage(usage, groq_requests=1)
+            try:
+                stream = self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.MAX_RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = retry_after_from(e)
+                self.rate_limiter.on_rate_limited(retry_after)
+                delay = backoff_delay(attempt, retry_after, base_sec=self.RATE_LIMIT_BACKOFF_BASE_SEC)
+                self._add_usage(usage, groq_retries=1)
+                logger.warning(f"[RATE] 429 from Groq (attempt {attempt + 1}) - retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            # Streams expose the underlying HTTP response (and its x-ratelimit-* headers)
+            headers = getattr(getattr(stream, "response", None), "headers", None)
+            if headers:
+                self.rate_limiter.update_from_headers(headers)
+            return stream
 
     def _robust_json_parse(self, text: str) -> Optional[Dict]:
         """
@@ -1054,7 +1423,7 @@ Output ONLY the JSON object. No markdown. No code blocks. No explanations.
         return False
 
     def _find_available_model(self) -> Optional[str]:
-        """Find first available Groq model."""
+        """Find first available Groq model (models that fail the probe start with an open breaker)."""
         for model in self.GROQ_MODELS:
             try:
                 logger.info(f"Testing Groq model: {model}...")
@@ -1066,7 +1435,8 @@ Output ONLY the JSON object. No markdown. No code blocks. No explanations.
                 )
                 logger.info(f"✅ Model available: {model}")
                 return model
-            except Exception:
+            except Exception as e:
+                self.model_router.trip(model, f"startup probe failed: {type(e).__name__}")
                 continue
 
         logger.warning("No Groq models available")
@@ -1074,34 +1444,81 @@ Output ONLY the JSON object. No markdown. No code blocks. No explanations.
 
 
 class EnsembleExtractor:
-    """Combines Groq and rule-based results with confidence voting."""
+    """
+    Combines Groq and rule-based results with confidence voting.
 
-    def __init__(self, extractor: GroqLLMExtractor):
+    Both methods run concurrently (Groq is network-bound on a worker, rules run
+    inline on the calling thread), so ensemble latency is ~max(groq, rules)
+    instead of their sum. If Groq misses the deadline the merge proceeds with
+    the rules result alone.
+    """
+
+    DEFAULT_DEADLINE_SEC = 30.0
+
+    def __init__(self, extractor: GroqLLMExtractor, deadline_sec: Optional[float] = None):
         """Initialize with base extractor."""
         self.extractor = extractor
+        self.deadline_sec = deadline_sec if deadline_sec is not None else self.DEFAULT_DEADLINE_SEC
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ensemble")
+
+    def extract_ensemble(self, transcript: str, language: Optional[str] = None,
+                         deadline_sec: Optional[float] = None,
+                         on_partial: Optional[Callable[[str, Any], None]] = None,
+                         rules_transcript: Optional[str] = None) -> Dict:
+        """
+        Extract using both Groq and rules concurrently, merge results intelligently (on_partial: Groq stream).
+
+        rules_transcript (default transcript) is the text the rules half reads, e.g. the
+        full consultation when Groq gets a compacted one.
+        """
+        logger.info("Running ensemble extraction (both systems, concurrent)...")
+        deadline_sec = deadline_sec if deadline_sec is not None else self.deadline_sec
+        start = time.monotonic()
+
+        streaming = {"on_partial": on_partial} if on_partial else {}
+        groq_future = self._executor.submit(self._timed, self.extractor.extract,
+                                            transcript, use_groq=True, language=language, **streaming)
+
+        # Rules are CPU-only and bounded - run them inline so they never queue behind slow Groq workers
+        rules_result, rules_sec = self._timed(self.extractor.extract, rules_transcript or transcript, use_groq=False)
 
-    def extract_ensemble(self, transcript: str) -> Dict:
-        """Extract using both Groq and rules, merge results intelligently."""
-        logger.info("Running ensemble extraction (both systems)...")
+        # Merge when Groq finishes or when the (overall) deadline expires
+        wait([groq_future], timeout=max(0.0, deadline_sec - (time.monotonic() - start)))
 
-        # Get both results
-        groq_result = self.extractor.extract(transcript, use_groq=True)
-        rules_result = self.extractor.extract(transcript, use_groq=False)
+        groq_timed_out = not groq_future.done()
+        if groq_timed_out:
+            # The Groq call keeps running on its worker; its result is simply not used
+            logger.warning(f"[ENSEMBLE] Groq missed the {deadline_sec:.1f}s deadline - merging rules result only")
+            groq_result, groq_sec = {"success": False, "data": {}}, None
+        else:
+            groq_result, groq_sec = groq_future.result()
 
         # Merge intelligently
         merged = self._merge(groq_result, rules_result)
+        elapsed = time.monotonic() - start
 
         logger.info(f"Ensemble result: {len(merged.get('medicines', []))} medicines, "
-                   f"{len(merged.get('diagnosis', []))} diagnoses")
+                   f"{len(merged.get('diagnosis', []))} diagnoses in {elapsed:.2f}s "
+                   f"(groq {'timeout' if groq_sec is None else f'{groq_sec:.2f}s'}, rules {rules_sec:.2f}s)")
 
         return {
             "success": True,
             "data": merged,
             "method": "ensemble",
             "groq_success": groq_result.get("success"),
-            "rules_success": rules_result.get("success")
+            "rules_success": rules_result.get("success"),
+            "groq_timed_out": groq_timed_out,
+            "latency_sec": elapsed,
+            "usage": groq_result.get("usage", {})
         }
 
+    @staticmethod
+    def _timed(fn, *args, **kwargs) -> Tuple[Dict, float]:
+        """Run fn and return (result, seconds) measured on a monotonic clock."""
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        return result, time.monotonic() - start
+
     def _merge(self, groq_result: Dict, rules_result: Dict) -> Dict:
         """Merge results: Groq for medicines, rules for patient name."""
         groq_data = groq_result.get("data", {})
@@ -0,0 +1,74 @@
+"""
+Hedging Module: Bounded duplicate requests to cut tail latency.
+
+HedgeBudget: Credit-based cap on hedges as a percentage of traffic
+StreamHandle: Lets the winning attempt cancel the losing streamed completion
+
+Every request earns budget_pct/100 of a credit (capped at a small burst); a hedge
+spends one credit. Over any stretch of traffic, hedges therefore stay at or below
+budget_pct of requests plus the burst.
+"""
+
+import logging
+import threading
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeBudget:
+    """Allows at most ~budget_pct hedged requests per 100 requests."""
+
+    def __init__(self, budget_pct: float, burst: float = 2.0):
+        self.budget_pct = max(0.0, float(budget_pct))
+        self.burst = burst
+        self.credits = 0.0  # In percent of a hedge (100 = one hedge), so 10 x 10% adds up exactly
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_pct > 0
+
+    def record_request(self) -> None:
+        """Count one primary request (earns hedge credit)."""
+        with self._lock:
+            self.requests += 1
+            self.credits = min(self.burst * 100.0, self.credits + self.budget_pct)
+
+    def try_acquire(self) -> bool:
+        """Spend a credit for one hedge (False if the budget is exhausted)."""
+        with self._lock:
+            if self.credits < 100.0:
+                return False
+            self.credits -= 100.0
+            self.hedges += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.requests, 3) if self.requests else 0.0,
+                "budget_pct": self.budget_pct,
+            }
+
+
+class StreamHandle:
+    """Cancellation handle for one streamed completion."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.stream: Any = None
+
+    def cancel(self) -> None:
+        """Stop the stream: the reader loop sees the flag; closing aborts a blocked read."""
+        self.cancelled.set()
+        close = getattr(self.stream, "close", None)
+        if close:
+            try:
+                close()
+            except Exception as e:
+                logger.debug(f"[HEDGE] Closing cancelled stream failed: {e}")
@@ -0,0 +1,613 @@
+"""
+Job Queue Module: Persistent background jobs with a worker pool.
+
+Job: One unit of work (payload in, progress/result/error out)
+JobEvent: One entry of a job's event log (stage started/finished, partial results, done)
+JobBackend: Storage interface (enqueue, claim, update, get, events)
+SQLiteJobBackend: Default backend - jobs survive restarts, safe across processes
+JobQueue: Worker threads claiming jobs from a backend and running a handler
+AsyncJobQueue: The same on an event loop - coroutine workers running an async handler
+
+A claimed job holds a lease (JOB_LEASE_SEC) that is renewed on every progress
+update. If the process dies, the lease expires and the job is claimed again
+(up to max_attempts), so a restart resumes queued and interrupted work. Claims
+are atomic (BEGIN IMMEDIATE), so several server processes can share one queue.
+
+    queue = JobQueue(handler, SQLiteJobBackend("data/jobs.db"), workers=2)
+    queue.start()
+    job_id = queue.submit({"audio_path": "..."})
+    queue.get(job_id).status   # queued → running → done | failed
+
+handler(job, progress) returns the job's result dict; progress(dict) records
+progress (e.g. the current pipeline stage). An exception fails the attempt.
+
+Each job also has an append-only event log: the queue records started / done /
+failed, and the handler adds its own with queue.emit(job_id, event, data).
+Events are numbered (seq, increasing across all jobs), so a reader - e.g. a
+Server-Sent Events stream - resumes with events(job_id, after_seq=last_seen),
+also from another process. wait_for_events() wakes readers in this process as
+soon as an event is added.
+
+Writes that follow up on a job's result after its handler returned (e.g. a late
+upgrade of a provisional result) go through after_done(job_id, fn): fn runs once
+the job's done status and event are recorded, so the handler's own result never
+overwrites the follow-up and readers see done before it.
+
+AsyncJobQueue serves asyncio applications (the ASGI API): `concurrency` worker
+coroutines await handler(job, progress), so jobs waiting on Whisper or Groq cost
+no thread. Backend reads run in the default executor; writes (progress, events,
+results) go through one writer thread, so they never block the loop and are
+recorded in the order they were made. emit() may be called from any thread.
+
+    queue = AsyncJobQueue(async_handler, SQLiteJobBackend("data/jobs.db"), concurrency=4)
+    await queue.start()
+    job_id = await queue.submit({"audio_path": "..."})
+"""
+
+import json
+import asyncio
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """A background job and its current state."""
+    id: str
+    payload: Dict[str, Any]
+    status: str = QUEUED
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: str = ""
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class JobEvent:
+    """One entry of a job's event log."""
+    seq: int
+    job_id: str
+    event: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    created_at: str = ""
+
+
+class JobBackend:
+    """Job storage; subclass for another store (Redis, Postgres, ...)."""
+
+    def enqueue(self, job: Job) -> None:
+        raise NotImplementedError
+
+    def claim(self, lease_sec: float, max_attempts: int) -> Optional[Job]:
+        """Atomically take the oldest runnable job (queued, or running with an expired lease)."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, lease_sec: Optional[float] = None, **fields: Any) -> None:
+        """Set fields (status, progress, result, error, finished_at); lease_sec renews the lease."""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        raise NotImplementedError
+
+    def add_event(self, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        """Append to a job's event log; returns the event's seq."""
+        raise NotImplementedError
+
+    def events(self, job_id: str, after_seq: int = 0, limit: int = 500) -> List[JobEvent]:
+        """A job's events with seq > after_seq, oldest first."""
+        raise NotImplementedError
+
+
+class SQLiteJobBackend(JobBackend):
+    """Jobs in a SQLite table (WAL mode, so status reads don't wait for workers)."""
+
+    JSON_FIELDS = ("payload", "progress", "result")
+    COLUMNS = ("id", "payload", "status", "progress", "result", "error", "attempts",
+               "created_at", "started_at", "finished_at")
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    lease_expires REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+
+    def enqueue(self, job: Job) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, payload, status, progress, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, json.dumps(job.payload), job.status, json.dumps(job.progress), job.attempts, job.created_at)
+            )
+
+    def claim(self, lease_sec: float, max_attempts: int) -> Optional[Job]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Interrupted too often: give up rather than crash-loop on a poison job (failed event included,
+            # so event streams waiting on it end)
+            abandoned = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (RUNNING, now, max_attempts)
+            ).fetchall()
+            error = f"Abandoned after {max_attempts} interrupted attempt(s)"
+            for (job_id,) in abandoned:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                             (FAILED, error, datetime.now().isoformat(), job_id))
+                self._insert_event(conn, job_id, FAILED, {"error": error})
+                logger.warning(f"[JOBS] {job_id} failed: {error}")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_expires = ? WHERE id = ?",
+                (RUNNING, datetime.now().isoformat(), now + lease_sec, row[0])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row[0])
+
+    def update(self, job_id: str, lease_sec: Optional[float] = None, **fields: Any) -> None:
+        assignments, values = [], []
+        for key, value in fields.items():
+            assignments.append(f"{key} = ?")
+            values.append(json.dumps(value, default=str) if key in self.JSON_FIELDS else value)
+        if lease_sec is not None:
+            assignments.append("lease_expires = ?")
+            values.append(time.time() + lease_sec)
+        if not assignments:
+            return
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(assignments)} WHERE id = ?", (*values, job_id))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM jobs"
+        params: List[Any] = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY created_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def add_event(self, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        with self._connect() as conn:
+            return self._insert_event(conn, job_id, event, data)
+
+    @staticmethod
+    def _insert_event(conn: sqlite3.Connection, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        cursor = conn.execute(
+            "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data, default=str), datetime.now().isoformat())
+        )
+        return cursor.lastrowid
+
+    def events(self, job_id: str, after_seq: int = 0, limit: int = 500) -> List[JobEvent]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, job_id, event, data, created_at FROM job_events "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after_seq, limit)
+            ).fetchall()
+        return [JobEvent(seq, job, event, json.loads(data) if data else {}, created_at)
+                for seq, job, event, data, created_at in rows]
+
+    def _to_job(self, row) -> Job:
+        data = dict(zip(self.COLUMNS, row))
+        for key in self.JSON_FIELDS:
+            data[key] = json.loads(data[key]) if data[key] else None
+        data["progress"] = data["progress"] or {}
+        return Job(**data)
+
+
+def _run_deferred(job_id: str, fns: List[Callable[[], None]]) -> None:
+    """Run a finished job's after_done callbacks (a failing one does not stop the rest)"""
+    for fn in fns:
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"[JOBS] after_done callback failed for {job_id}: {e}")
+
+
+class JobQueue:
+    """Runs jobs from a backend on a pool of worker threads."""
+
+    def __init__(self, handler: Callable[[Job, Callable[[Dict[str, Any]], None]], Dict[str, Any]],
+                 backend: JobBackend, workers: int = 2, poll_interval: float = 1.0,
+                 lease_sec: float = 600.0, max_attempts: int = 3):
+        """
+        Args:
+            handler:       handler(job, progress) → result dict
+            backend:       Job storage
+            workers:       Worker threads in this process
+            poll_interval: Idle wait between claims (submits in this process wake workers at once)
+            lease_sec:     A running job not updated for this long is considered interrupted
+            max_attempts:  Interrupted attempts before a job is failed
+        """
+        self.handler = handler
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._event_added = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._deferred: Dict[str, List[Callable[[], None]]] = {}  # Running job → after_done callbacks
+        self._deferred_lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"voice-rx-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[JOBS] {self.workers} worker(s) started")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop after the running jobs finish (queued jobs stay queued)."""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """Queue a job (with a new id unless job_id is given); returns its id."""
+        job = Job(id=job_id or uuid.uuid4().hex, payload=payload, created_at=datetime.now().isoformat())
+        self.backend.enqueue(job)
+        self._wakeup.set()
+        logger.info(f"[JOBS] Queued {job.id}")
+        return job.id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.backend.get(job_id)
+
+    def emit(self, job_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """Append to a job's event log (best effort, never raises); returns the seq."""
+        try:
+            seq = self.backend.add_event(job_id, event, data or {})
+        except Exception as e:
+            logger.warning(f"[JOBS] Could not record event '{event}' for {job_id}: {e}")
+            return None
+        with self._event_added:
+            self._event_added.notify_all()
+        return seq
+
+    def events(self, job_id: str, after_seq: int = 0) -> List[JobEvent]:
+        return self.backend.events(job_id, after_seq)
+
+    def wait_for_events(self, timeout: float) -> None:
+        """Block until an event is emitted in this process or timeout passes (then poll events())."""
+        with self._event_added:
+            self._event_added.wait(timeout)
+
+    def after_done(self, job_id: str, fn: Callable[[], None]) -> None:
+        """
+        Run fn after the job's done status and event are recorded: deferred while the job
+        runs in this process (dropped if it fails), at once otherwise. Any thread.
+        """
+        with self._deferred_lock:
+            deferred = self._deferred.get(job_id)
+            if deferred is not None:
+                deferred.append(fn)
+                return
+        _run_deferred(job_id, [fn])
+
+    def run_pending(self) -> int:
+        """Run queued jobs in the calling thread until none is left; returns how many ran."""
+        ran = 0
+        while self._run_one():
+            ran += 1
+        return ran
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self._run_one():
+                    continue
+            except Exception as e:  # Backend trouble (e.g. database locked): back off and retry
+                logger.error(f"[JOBS] Worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _run_one(self) -> bool:
+        job = self.backend.claim(self.lease_sec, self.max_attempts)
+        if job is None:
+            return False
+
+        def progress(fields: Dict[str, Any]) -> None:
+            job.progress.update(fields)
+            try:
+                self.backend.update(job.id, lease_sec=self.lease_sec, progress=job.progress)
+            except Exception as e:
+                logger.warning(f"[JOBS] Could not record progress for {job.id}: {e}")
+
+        logger.info(f"[JOBS] Running {job.id} (attempt {job.attempts})")
+        self.emit(job.id, "started", {"attempt": job.attempts})
+        with self._deferred_lock:
+            self._deferred[job.id] = []
+        try:
+            result = self.handler(job, progress)
+        except Exception as e:
+            self._take_deferred(job.id)
+            logger.error(f"[JOBS] {job.id} failed: {e}", exc_info=True)
+            error = f"{type(e).__name__}: {e}"
+            self.backend.update(job.id, status=FAILED, error=error, finished_at=datetime.now().isoformat())
+            self.emit(job.id, FAILED, {"error": error})
+        else:
+            try:
+                self.backend.update(job.id, status=DONE, result=result, error=None,
+                                    finished_at=datetime.now().isoformat())
+                self.emit(job.id, DONE, {"result": result})
+            finally:
+                deferred = self._take_deferred(job.id)
+            logger.info(f"[JOBS] {job.id} done")
+            _run_deferred(job.id, deferred)
+        return True
+
+    def _take_deferred(self, job_id: str) -> List[Callable[[], None]]:
+        with self._deferred_lock:
+            return self._deferred.pop(job_id, [])
+
+
+class AsyncJobQueue:
+    """Runs jobs from a backend as coroutines on the running event loop."""
+
+    def __init__(self, handler: Callable[[Job, Callable[[Dict[str, Any]], None]], Awaitable[Dict[str, Any]]],
+                 backend: JobBackend, concurrency: int = 4, poll_interval: float = 1.0,
+                 lease_sec: float = 600.0, max_attempts: int = 3):
+        """
+        Args:
+            handler:       async handler(job, progress) → result dict
+            backend:       Job storage
+            concurrency:   Jobs run at once in this process
+            poll_interval: Idle wait between claims (submits in this process wake workers at once)
+            lease_sec:     A running job not updated for this long is considered interrupted
+            max_attempts:  Interrupted attempts before a job is failed
+        """
+        self.handler = handler
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._writer_ident: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._event_added: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._deferred: Dict[str, List[Callable[[], None]]] = {}  # Running job → after_done callbacks
+        self._deferred_lock = threading.Lock()
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voice-rx-job-writer",
+                                          initializer=self._writer_started)
+        self._wakeup = asyncio.Event()
+        self._event_added = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._work(), name=f"voice-rx-job-{i}")
+                       for i in range(self.concurrency)]
+        logger.info(f"[JOBS] {self.concurrency} async worker(s) started")
+
+    async def stop(self) -> None:
+        """Stop after the running jobs finish (queued jobs stay queued)."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer is not None:
+            await self._loop.run_in_executor(None, self._writer.shutdown)  # Flush pending writes
+            self._writer = None
+
+    async def submit(self, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """Queue a job (with a new id unless job_id is given); returns its id."""
+        job = Job(id=job_id or uuid.uuid4().hex, payload=payload, created_at=datetime.now().isoformat())
+        await self._write(self.backend.enqueue, job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"[JOBS] Queued {job.id}")
+        return job.id
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.backend.get, job_id)
+
+    def emit(self, job_id: str, event: str, data: Optional[Dict[str, Any]] = None) -> None:
+        """Append to a job's event log (best effort, never raises, never blocks; any thread)."""
+        if self._writer is None:
+            logger.warning(f"[JOBS] Queue not started, dropping event '{event}' for {job_id}")
+            return
+        if threading.get_ident() == self._writer_ident:  # From a write (e.g. after_done): already in order
+            self._add_event(job_id, event, data or {})
+            return
+        try:
+            self._writer.submit(self._add_event, job_id, event, data or {})
+        except RuntimeError:  # Writer shut down (queue stopping)
+            logger.warning(f"[JOBS] Queue stopped, dropping event '{event}' for {job_id}")
+
+    def after_done(self, job_id: str, fn: Callable[[], None]) -> None:
+        """
+        Run fn on the writer thread after the job's done status and event are recorded:
+        deferred while the job runs in this process (dropped if it fails), otherwise
+        after the writes already queued. Any thread.
+        """
+        with self._deferred_lock:
+            deferred = self._deferred.get(job_id)
+            if deferred is not None:
+                deferred.append(fn)
+                return
+        self._submit_deferred(job_id, [fn])
+
+    def _submit_deferred(self, job_id: str, fns: List[Callable[[], None]]) -> None:
+        if not fns:
+            return
+        if self._writer is None:
+            _run_deferred(job_id, fns)
+        else:
+            self._writer.submit(_run_deferred, job_id, fns)
+
+    def _take_deferred(self, job_id: str) -> List[Callable[[], None]]:
+        with self._deferred_lock:
+            return self._deferred.pop(job_id, [])
+
+    async def events(self, job_id: str, after_seq: int = 0) -> List[JobEvent]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.backend.events, job_id, after_seq)
+
+    async def wait_for_events(self, timeout: float) -> None:
+        """Wait until an event is emitted in this process or timeout passes (then poll events())."""
+        event_added = self._event_added
+        if event_added is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event_added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _writer_started(self) -> None:
+        self._writer_ident = threading.get_ident()
+
+    def _add_event(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        """Writer thread: record the event, then wake the loop's readers"""
+        try:
+            self.backend.add_event(job_id, event, data)
+        except Exception as e:
+            logger.warning(f"[JOBS] Could not record event '{event}' for {job_id}: {e}")
+            return
+        self._loop.call_soon_threadsafe(self._notify_readers)
+
+    def _notify_readers(self) -> None:
+        self._event_added.set()
+        self._event_added = asyncio.Event()  # Readers waiting now were woken; later waits need a new event
+
+    async def _write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Backend write on the writer thread (after every write queued before it)"""
+        loop = asyncio.get_running_loop()
+        if self._writer is None:
+            return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+        return await asyncio.wrap_future(self._writer.submit(fn, *args, **kwargs))
+
+    async def _work(self) -> None:
+        while not self._stopping:
+            try:
+                if await self._run_one():
+                    continue
+            except Exception as e:  # Backend trouble (e.g. database locked): back off and retry
+                logger.error(f"[JOBS] Worker error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _run_one(self) -> bool:
+        job = await self._loop.run_in_executor(None, self.backend.claim, self.lease_sec, self.max_attempts)
+        if job is None:
+            return False
+
+        def progress(fields: Dict[str, Any]) -> None:
+            job.progress.update(fields)
+            self._writer.submit(self._record_progress, job.id, dict(job.progress))
+
+        logger.info(f"[JOBS] Running {job.id} (attempt {job.attempts})")
+        self.emit(job.id, "started", {"attempt": job.attempts})
+        with self._deferred_lock:
+            self._deferred[job.id] = []
+        try:
+            result = await self.handler(job, progress)
+        except Exception as e:
+            self._take_deferred(job.id)
+            logger.error(f"[JOBS] {job.id} failed: {e}", exc_info=True)
+            error = f"{type(e).__name__}: {e}"
+            await self._write(self.backend.update, job.id, status=FAILED, error=error,
+                              finished_at=datetime.now().isoformat())
+            self.emit(job.id, FAILED, {"error": error})
+        else:
+            try:
+                await self._write(self.backend.update, job.id, status=DONE, result=result, error=None,
+                                  finished_at=datetime.now().isoformat())
+                self.emit(job.id, DONE, {"result": result})
+            finally:
+                deferred = self._take_deferred(job.id)
+            logger.info(f"[JOBS] {job.id} done")
+            self._submit_deferred(job.id, deferred)  # Queued behind the done write and event
+        return True
+
+    def _record_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        try:
+            self.backend.update(job_id, lease_sec=self.lease_sec, progress=progress)
+        except Exception as e:
+            logger.warning(f"[JOBS] Could not record progress for {job_id}: {e}")
@@ -0,0 +1,206 @@
+"""
+JSON Stream Module: Incremental parsing of streamed LLM JSON output.
+
+IncrementalJSONParser: Consumes text chunks as they arrive and emits
+  - each top-level field as soon as its value closes
+  - each medicine object as soon as it closes (inside the "medicines" array)
+and reports whether the root object is still open (truncated output).
+
+Tolerates prefix text and markdown fences before the first '{'.
+Work per chunk is proportional to the chunk length (no re-scanning).
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONParser:
+    """
+    Streaming parser for a single top-level JSON object.
+
+    Usage:
+        parser = IncrementalJSONParser(on_field=..., on_medicine=...)
+        for chunk in stream:
+            parser.feed(chunk)
+        data = parser.result()          # None if incomplete/invalid
+        parser.truncated                # True if the root object never closed
+    """
+
+    def __init__(self, on_field: Optional[Callable[[str, Any], None]] = None,
+                 on_medicine: Optional[Callable[[Dict], None]] = None):
+        self.on_field = on_field
+        self.on_medicine = on_medicine
+
+        self.text = ""                 # Everything fed so far (including prefix)
+        self.fields: Dict[str, Any] = {}
+        self.medicines: List[Dict] = []
+
+        self._pos = 0                  # Next index of self.text to scan
+        self._root_start = -1
+        self._root_end = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+
+        # Top-level key/value tracking (depth 1 = inside root object)
+        self._expect_key = False
+        self._current_key: Optional[str] = None
+        self._value_start = -1
+
+        # Medicine object tracking (depth 3 = object inside "medicines" array)
+        self._medicine_start = -1
+
+    # ── Public API ────────────────────────────────────────────────────────────
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Feed the next chunk of streamed text.
+
+        Returns:
+            List of events emitted by this chunk: ("field", (key, value)) or ("medicine", dict)
+        """
+        if not chunk:
+            return []
+        self.text += chunk
+        events: List[Tuple[str, Any]] = []
+        self._scan(events)
+        return events
+
+    @property
+    def started(self) -> bool:
+        """Whether the root object has begun."""
+        return self._root_start >= 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether the root object has closed."""
+        return self._root_end >= 0
+
+    @property
+    def truncated(self) -> bool:
+        """Whether output began a JSON object but stopped before closing it."""
+        return self.started and not self.complete
+
+    def mute(self) -> None:
+        """Stop firing on_field/on_medicine (e.g. once its stream lost a hedge); parsing continues."""
+        self.on_field = None
+        self.on_medicine = None
+
+    def result(self) -> Optional[Dict]:
+        """Parse the completed root object (None if incomplete or invalid)."""
+        if not self.complete:
+            return None
+        try:
+            data = json.loads(self.text[self._root_start:self._root_end + 1])
+            return data if isinstance(data, dict) else None
+        except json.JSONDecodeError:
+            return None
+
+    def partial_result(self) -> Optional[Dict]:
+        """Fields and medicines that closed before the stream ended (None if nothing closed)."""
+        if not self.fields and not self.medicines:
+            return None
+        data = dict(self.fields)
+        if "medicines" not in data and self.medicines:
+            data["medicines"] = list(self.medicines)
+        return data
+
+    # ── Scanner ───────────────────────────────────────────────────────────────
+
+    def _scan(self, events: List[Tuple[str, Any]]) -> None:
+        text = self.text
+        i = self._pos
+        n = len(text)
+
+        while i < n and not self.complete:
+            c = text[i]
+
+            if self._root_start < 0:
+                if c == '{':
+                    self._root_start = i
+                    self._depth = 1
+                    self._expect_key = True
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        try:
+                            self._current_key = json.loads(text[self._string_start:i + 1])
+                        except json.JSONDecodeError:
+                            self._current_key = text[self._string_start + 1:i]
+                i += 1
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                if self._depth == 1 and not self._expect_key and self._value_start < 0:
+                    self._value_start = i
+            elif c == ':' and self._depth == 1:
+                self._expect_key = False
+            elif c in '{[':
+                if self._depth == 1 and self._value_start < 0:
+                    self._value_start = i
+                if (c == '{' and self._depth == 2 and self._current_key == "medicines"
+                        and self._value_start >= 0 and text[self._value_start] == '['):
+                    self._medicine_start = i
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 2 and self._medicine_start >= 0 and c == '}':
+                    self._emit_medicine(text[self._medicine_start:i + 1], events)
+                    self._medicine_start = -1
+                elif self._depth == 1 and self._value_start >= 0:
+                    self._emit_field(text[self._value_start:i + 1], events)
+                elif self._depth == 0:
+                    if self._value_start >= 0:
+                        self._emit_field(text[self._value_start:i].strip(), events)
+                    self._root_end = i
+            elif c == ',' and self._depth == 1:
+                if self._value_start >= 0:
+                    self._emit_field(text[self._value_start:i].strip(), events)
+                self._expect_key = True
+            elif self._depth == 1 and not self._expect_key and self._value_start < 0 and not c.isspace():
+                self._value_start = i  # Scalar: number, true, false, null
+            i += 1
+
+        self._pos = i
+
+    def _emit_field(self, raw: str, events: List[Tuple[str, Any]]) -> None:
+        key = self._current_key
+        self._value_start = -1
+        if key is None or not raw:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.debug(f"[STREAM] Could not parse field '{key}': {raw[:80]}")
+            return
+        self.fields[key] = value
+        events.append(("field", (key, value)))
+        if self.on_field:
+            self.on_field(key, value)
+
+    def _emit_medicine(self, raw: str, events: List[Tuple[str, Any]]) -> None:
+        try:
+            medicine = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.debug(f"[STREAM] Could not parse medicine: {raw[:80]}")
+            return
+        if not isinstance(medicine, dict):
+            return
+        self.medicines.append(medicine)
+        events.append(("medicine", medicine))
+        if self.on_medicine:
+            self.on_medicine(medicine)
@@ -10,9 +10,12 @@ import logging
 import sqlite3
 import numpy as np
 import re
+import time
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict, field
 
 # Load environment
@@ -44,7 +47,13 @@ from validation import ValidationLayer, Prescription
 from metrics import MetricsCollector, MetricsDashboard, ExtractionMetrics
 from language_detection import LanguageDetector
 from thanglish_normalizer import ThanglishNormalizer
-from normalization import TranscriptNormalizer
+from normalization import TranscriptNormalizer, RepetitionCollapser
+from compaction import TranscriptCompactor, CompactionResult
+from stages import Pipeline, PipelineRun, Stage, StageResult, StopPipeline
+from checkpoints import StageCheckpointStore, INPUTS
+from artifact_store import ArtifactStore
+from reporting import Reporter, make_reporter
+from cost import whisper_cost
 import medicine_database
 
 # Configuration
@@ -53,6 +62,23 @@ DB_FILE = "data/prescriptions.db"
 # Local Whisper (medium) for transcription + Groq for LLM extraction
 WHISPER_MODEL = "medium"
 TRANSCRIBER_SOURCE = "local"  # Using local Whisper for cost-effective transcription
+# Ensemble runs Groq + rules concurrently; merge after both finish or this deadline
+ENSEMBLE_DEADLINE_SEC = float(os.getenv("ENSEMBLE_DEADLINE_SEC", "30"))
+# Extraction SLA: past this, return the rules result as provisional and upgrade later (unset = wait)
+EXTRACTION_DEADLINE_SEC = float(os.getenv("EXTRACTION_DEADLINE_SEC")) if os.getenv("EXTRACTION_DEADLINE_SEC") else None
+# Whisper hallucination loops: a phrase repeated this many times back to back collapses to one copy
+REPETITION_MIN_REPEATS = int(os.getenv("REPETITION_MIN_REPEATS", "3"))
+# Optional: send Groq only clinically relevant sentences (+ neighbours); rules still see everything
+TRANSCRIPT_COMPACTION = os.getenv("TRANSCRIPT_COMPACTION", "false").lower() == "true"
+COMPACTION_CONTEXT_SENTENCES = int(os.getenv("COMPACTION_CONTEXT_SENTENCES", "1"))
+# Progress reporting: console (CLI banners), events (JSON log lines, no patient data) or null
+REPORTER = os.getenv("VOICE_RX_REPORTER", "console")
+# process_async: threads for blocking I/O stages (Whisper, Groq, SQLite) shared by concurrent requests
+ASYNC_IO_WORKERS = int(os.getenv("ASYNC_IO_WORKERS", "16"))
+# Stage outputs of runs with a consultation_id (resume after failures, reprocess_from)
+CHECKPOINT_DB = os.getenv("STAGE_CHECKPOINT_DB", DB_FILE)
+# Content-addressed archive of audio, transcript versions and raw extractions (unset = off)
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", "")
 
 # Use centralized Medicine Database
 KNOWN_DRUGS = medicine_database.KNOWN_DRUGS
@@ -64,27 +90,110 @@ STANDARD_ADVICE = medicine_database.STANDARD_ADVICE
 class AdvancedExtractor:
     """Advanced extraction with improved medicine/diagnosis detection"""
 
+    # Late primary results with these methods replace a provisional rules result
+    UPGRADE_METHODS = ("groq", "ensemble")
+
     def __init__(self):
         self.extractor = GroqLLMExtractor()
-        self.ensemble = EnsembleExtractor(self.extractor)
-
-    def extract_advanced(self, transcript: str, use_ensemble: bool = False) -> Dict:
-        """Extract with advanced pattern matching"""
+        self.ensemble = EnsembleExtractor(self.extractor, deadline_sec=ENSEMBLE_DEADLINE_SEC)
+        # Primary extraction runs here when a deadline is set (late results finish in background)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="extract-primary")
+
+    def extract_advanced(self, transcript: str, use_ensemble: bool = False,
+                         language: Optional[str] = None,
+                         deadline_sec: Optional[float] = None,
+                         llm_transcript: Optional[str] = None,
+                         on_partial: Optional[Callable[[str, Any], None]] = None) -> Dict:
+        """
+        Extract with advanced pattern matching.
+
+        llm_transcript (e.g. a compacted transcript) replaces transcript as the
+        Groq input only; rules (the ensemble's rules half, the rules fallback and the
+        early rules answer) and post-processing always use transcript.
+        on_partial receives fields and medicines as Groq streams them (before
+        post-processing, so they are provisional).
+
+        With deadline_sec set, rules extraction runs immediately alongside the
+        primary (Groq/ensemble) call. If the primary misses the deadline, the rules
+        result is returned with provisional=True, and result['upgrade_future']
+        resolves to the post-processed primary result once it arrives (None if the
+        primary itself fell back to rules).
+        """
         logger.info(f"Running advanced extraction on {len(transcript)} chars...")
-        logger.info(f"Transcript begins: {transcript[:150]}...")
-        
-        # Try primary extraction
+        logger.debug("Transcript begins: %.150s...", transcript)
+
+        primary_input = llm_transcript or transcript
+        if deadline_sec is None:
+            result = self._extract_primary(primary_input, use_ensemble, language, on_partial, transcript)
+            return self._post_process(result, transcript)
+
+        start = time.monotonic()
+        primary_future = self._executor.submit(self._extract_primary, primary_input, use_ensemble, language,
+                                               on_partial, transcript)
+        rules_result = self._extract_rules_advanced(transcript)  # Early answer, ready before the deadline
+
+        remaining = max(0.0, deadline_sec - (time.monotonic() - start))
+        try:
+            result = primary_future.result(timeout=remaining)
+        except FuturesTimeout:
+            logger.warning(f"[DEADLINE] Primary extraction missed {deadline_sec:.1f}s deadline - "
+                           f"returning provisional rules result")
+            provisional = self._post_process(rules_result, transcript)
+            provisional.update(provisional=True, deadline_missed=True,
+                               upgrade_future=self._chain_upgrade(primary_future, transcript))
+            return provisional
+
+        return self._post_process(result, transcript)
+
+    def _extract_primary(self, transcript: str, use_ensemble: bool, language: Optional[str],
+                         on_partial: Optional[Callable[[str, Any], None]] = None,
+                         rules_transcript: Optional[str] = None) -> Dict:
+        """Run the primary extraction (language selects the prompt sections sent to Groq).
+
+        transcript goes to Groq; rules read rules_transcript (default transcript).
+        """
+        rules_transcript = rules_transcript or transcript
+        streaming = {"on_partial": on_partial} if on_partial else {}
         if use_ensemble:
-            result = self.ensemble.extract_ensemble(transcript)
-        else:
-            result = self.extractor.extract(transcript, use_groq=True)
-        
+            return self.ensemble.extract_ensemble(transcript, language=language,
+                                                  rules_transcript=rules_transcript, **streaming)
+        result = self.extractor.extract(transcript, use_groq=True, language=language, **streaming)
+        if result.get('method') == 'rules' and rules_transcript != transcript:
+            # Groq fell back to rules on the LLM input - redo them on the full transcript, keeping Groq's cost
+            fallback = self.extractor.extract(rules_transcript, use_groq=False)
+            if 'usage' in result:
+                fallback['usage'] = result['usage']
+            return fallback
+        return result
+
+    def _chain_upgrade(self, primary_future: Future, transcript: str) -> Future:
+        """Future resolving to the post-processed primary result, or None if it fell back to rules"""
+        upgrade_future: Future = Future()
+
+        def _on_primary_done(done: Future):
+            try:
+                result = done.result()
+                if (result.get('success') and result.get('method') in self.UPGRADE_METHODS
+                        and not result.get('groq_timed_out')):
+                    upgrade_future.set_result(self._post_process(result, transcript))
+                else:
+                    logger.info("[DEADLINE] Late primary result fell back to rules - keeping provisional result")
+                    upgrade_future.set_result(None)
+            except Exception as e:
+                logger.error(f"[DEADLINE] Late primary extraction failed: {e}")
+                upgrade_future.set_exception(e)
+
+        primary_future.add_done_callback(_on_primary_done)
+        return upgrade_future
+
+    def _post_process(self, result: Dict, transcript: str) -> Dict:
+        """Fill gaps in an extraction result (rules fallback, name, medicines, diagnosis, advice)"""
         if not result.get('success'):
             logger.info("Primary extraction failed, using rules...")
             result = self._extract_rules_advanced(transcript)
         
-        # Log FULL transcript for debugging (in DEBUG level or shorter first 2000 chars)
-        logger.debug(f"Full transcript for extraction: {transcript}")
+        # Log FULL transcript for debugging (DEBUG only - patient data, formatted lazily)
+        logger.debug("Full transcript for extraction: %s", transcript)
         
         # Post-process: improve extracted data
         data = result.get('data', {})
@@ -104,7 +213,8 @@ class AdvancedExtractor:
         
         logger.info(f"Post-improvement: medicines={len(data.get('medicines', []))}, diagnosis={len(data.get('diagnosis', []))}")
         
-        return {"success": True, "data": data, "method": result.get('method', 'rules')}
+        return {"success": True, "data": data, "method": result.get('method', 'rules'),
+                "usage": result.get('usage', {}), "provisional": False, "deadline_missed": False}
 
     def _extract_rules_advanced(self, transcript: str) -> Dict:
         """Advanced rule-based extraction"""
@@ -676,13 +786,31 @@ class PrescriptionDatabase:
             conn.commit()
             return cursor.lastrowid
 
+    def update(self, prescription_id: int, prescription: Prescription) -> None:
+        """Replace the extracted fields of a saved prescription (provisional → upgraded)"""
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('''
+                UPDATE prescriptions
+                SET patient_name = ?, diagnosis = ?, medicines = ?, extraction_method = ?, confidence = ?
+                WHERE id = ?
+            ''', (
+                prescription.patient_name or "Unknown Patient",
+                json.dumps(prescription.diagnosis),
+                json.dumps(prescription.medicines),
+                prescription.extraction_method,
+                prescription.confidence,
+                prescription_id
+            ))
+            conn.commit()
+
 
 # ==================== MAIN MEDICAL SYSTEM ====================
 
 class MedicalSystem:
     """Production medical system with advanced extraction"""
 
-    def __init__(self):
+    def __init__(self, reporter: Optional[Reporter] = None):
+        """reporter: progress sink (default: VOICE_RX_REPORTER, console)"""
         logger.info("\n" + "=" * 80)
         logger.info("INITIALIZING PRODUCTION MEDICAL SYSTEM V2 (Advanced Extraction)")
         logger.info("=" * 80)
@@ -692,6 +820,8 @@ class MedicalSystem:
         self.language_detector = LanguageDetector()
         self.thanglish_normalizer = ThanglishNormalizer()
         self.transcript_normalizer = TranscriptNormalizer()
+        self.repetition_collapser = RepetitionCollapser(min_repeats=REPETITION_MIN_REPEATS)
+        self.compactor = TranscriptCompactor(COMPACTION_CONTEXT_SENTENCES) if TRANSCRIPT_COMPACTION else None
         self.advanced_extractor = AdvancedExtractor()
 
         # Intelligent routing
@@ -701,78 +831,381 @@ class MedicalSystem:
         # Validation
         self.validator = ValidationLayer()
         self.database = PrescriptionDatabase(DB_FILE)
+        self.checkpoints = StageCheckpointStore(
+            CHECKPOINT_DB, types=(TranscriptionResult, Prescription, CompactionResult, Medicine)
+        )
+        self.artifacts = ArtifactStore(ARTIFACT_STORE_DIR) if ARTIFACT_STORE_DIR else None
 
         # Metrics collection
         self.metrics_collector = MetricsCollector()
 
+        # Export Groq model breaker state/transitions as metrics
+        model_router = self.advanced_extractor.extractor.model_router
+        model_router.on_transition = self.metrics_collector.record_breaker_transition
+        self.metrics_collector.model_health_source = model_router.snapshot
+
+        self.reporter = reporter if reporter is not None else make_reporter(REPORTER)
+        self.pipeline = self._build_pipeline()
+        self._io_executor: Optional[ThreadPoolExecutor] = None  # Created by the first process_async
+
         logger.info("[OK] System ready with advanced extraction\n")
 
-    def process(self, audio_path: str, language: Optional[str] = None) -> Dict:
+    def _build_pipeline(self) -> Pipeline:
+        """The extraction pipeline: one timed stage per step of process()"""
+        return Pipeline([
+            Stage("transcribe", self._stage_transcribe, inputs=("audio_path", "language"),
+                  outputs=("tx_result", "transcript"), io=True),
+            Stage("clean", self._stage_clean, inputs=("transcript",), outputs=("transcript", "was_modified")),
+            Stage("detect_language", self._stage_detect_language, inputs=("transcript", "tx_result"),
+                  outputs=("lang_code", "lang_metadata")),
+            Stage("thanglish", self._stage_thanglish, inputs=("transcript", "lang_code"), outputs=("transcript",),
+                  skip_if=lambda ctx: ctx["lang_code"] != "tanglish"),
+            Stage("normalize", self._stage_normalize, inputs=("transcript",),
+                  outputs=("transcript", "norm_metadata", "repeat_metadata")),
+            Stage("route", self._stage_route, inputs=("transcript", "tx_result", "lang_code", "lang_metadata"),
+                  outputs=("analysis", "route")),
+            Stage("compact", self._stage_compact, inputs=("transcript", "route"), outputs=("compaction",),
+                  skip_if=lambda ctx: self.compactor is None or ctx["route"] == 'rules_only',
+                  defaults={"compaction": None}),
+            Stage("extract", self._stage_extract,
+                  inputs=("transcript", "route", "lang_code", "deadline_sec", "compaction", "analysis", "tx_result"),
+                  outputs=("extract_result", "prescription"), io=True),
+            Stage("validate", self._stage_validate, inputs=("prescription",),
+                  outputs=("is_valid", "errors", "warnings")),
+            Stage("persist", self._stage_persist, inputs=("prescription", "route"), outputs=("prescription_id",),
+                  io=True),
+        ], initial_inputs=("audio_path", "language", "deadline_sec", "start_time", "existing_prescription_id"))
+
+    def process(self, audio_path: str, language: Optional[str] = None,
+                deadline_sec: Optional[float] = EXTRACTION_DEADLINE_SEC,
+                on_upgrade: Optional[Callable[[Dict], None]] = None,
+                on_stage: Optional[Callable[[StageResult], None]] = None,
+                consultation_id: Optional[str] = None,
+                on_stage_start: Optional[Callable[[str], None]] = None,
+                on_partial: Optional[Callable[[str, Any], None]] = None,
+                audio_sha256: Optional[str] = None,
+                on_upgrade_failed: Optional[Callable[[str], None]] = None) -> Dict:
         """
         Process audio file end-to-end with clean architecture.
 
         Args:
-            audio_path: Path to audio file
-            language:   Optional language override ('en', 'ta', 'tanglish').
-                        If None, auto-detected from audio (probe pass).
+            audio_path:   Path to audio file
+            language:     Optional language override ('en', 'ta', 'tanglish').
+                          If None, auto-detected from audio (probe pass).
+            deadline_sec: Extraction SLA. If Groq misses it, the rules result is returned
+                          with provisional=True and upgraded in the background.
+            on_upgrade:   Called with the upgraded output once a provisional result has
+                          been replaced by the late Groq result (already persisted). If Groq
+                          finishes before process() returns, the upgraded output is returned
+                          instead and on_upgrade is not called.
+            on_stage:     Called with each StageResult (name, status, duration) as stages finish.
+            consultation_id: Checkpoint every stage's outputs under this id. A later call
+                          with the same id (and audio) resumes after the last completed
+                          stage, so a failed extraction or save does not re-run Whisper.
+            on_stage_start: Called with a stage's name just before it runs.
+            on_partial:   Called with (kind, payload) as partial results become available:
+                          ("transcript", {"stage", "text", ...}) after transcription and
+                          normalization, then ("field", {key: value}) and ("medicine", dict)
+                          while Groq streams (provisional until the final result).
+            audio_sha256: Content hash of the audio if already known (computed while it was
+                          uploaded), so archiving it does not re-read the file to hash it.
+            on_upgrade_failed: Called with a reason instead of on_upgrade when the late Groq
+                          result fails or is empty (the provisional result stands).
         """
         start_time = datetime.now()
+        self.reporter.report("start")
+        context, restored, checkpoint = self._prepare_run(audio_path, language, deadline_sec, start_time,
+                                                          consultation_id, audio_sha256=audio_sha256)
+        context["on_partial"] = self._partial_callback(on_partial)
+        run = self.pipeline.run(context, on_stage=self._stage_callback(on_stage),
+                                restored=restored, checkpoint=checkpoint, on_stage_start=on_stage_start)
+        return self._finish_run(run, audio_path, start_time, on_upgrade, consultation_id, on_upgrade_failed)
+
+    async def process_async(self, audio_path: str, language: Optional[str] = None,
+                            deadline_sec: Optional[float] = EXTRACTION_DEADLINE_SEC,
+                            on_upgrade: Optional[Callable[[Dict], None]] = None,
+                            on_stage: Optional[Callable[[StageResult], None]] = None,
+                            consultation_id: Optional[str] = None,
+                            on_stage_start: Optional[Callable[[str], None]] = None,
+                            on_partial: Optional[Callable[[str, Any], None]] = None,
+                            audio_sha256: Optional[str] = None,
+                            on_upgrade_failed: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        process() as a coroutine, for running many consultations concurrently on one event loop.
 
-        print("\n" + "=" * 80)
-        print("MEDICAL CONSULTATION EXTRACTION - GROQ-FIRST SYSTEM")
-        print("=" * 80)
+        Same stages and same result. Transcription, extraction and the database write
+        run on a shared I/O thread pool (ASYNC_IO_WORKERS); the CPU-bound text stages
+        run on the loop's default executor. on_stage/on_stage_start are called on the
+        event loop; on_partial and on_upgrade/on_upgrade_failed (late Groq result) from worker threads.
+        """
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix="voice-rx-io")
+        start_time = datetime.now()
+        self.reporter.report("start")
+        context, restored, checkpoint = await asyncio.get_running_loop().run_in_executor(
+            self._io_executor, self._prepare_run, audio_path, language, deadline_sec, start_time, consultation_id,
+            None, audio_sha256
+        )
+        context["on_partial"] = self._partial_callback(on_partial)
+        run = await self.pipeline.run_async(context, on_stage=self._stage_callback(on_stage),
+                                            io_executor=self._io_executor,
+                                            restored=restored, checkpoint=checkpoint,
+                                            on_stage_start=on_stage_start)
+        return self._finish_run(run, audio_path, start_time, on_upgrade, consultation_id, on_upgrade_failed)
+
+    def reprocess_from(self, consultation_id: str, stage: str,
+                       deadline_sec: Optional[float] = EXTRACTION_DEADLINE_SEC,
+                       on_stage: Optional[Callable[[StageResult], None]] = None) -> Dict:
+        """
+        Re-run a checkpointed consultation from stage onwards (e.g. 'extract' after a
+        prompt change): earlier stages are restored, not re-run, and the saved
+        prescription is updated in place rather than duplicated.
+        """
+        saved = self.checkpoints.load(consultation_id)
+        if INPUTS not in saved:
+            raise ValueError(f"No checkpoints for consultation '{consultation_id}'")
+        existing_id = saved.get("persist", {}).get("prescription_id")
+        self.checkpoints.discard(consultation_id, from_stage=stage,
+                                 stage_order=[s.name for s in self.pipeline.stages])
+        logger.info(f"[CHECKPOINT] Reprocessing {consultation_id} from '{stage}'")
+
+        start_time = datetime.now()
+        self.reporter.report("start")
+        inputs = saved[INPUTS]
+        context, restored, checkpoint = self._prepare_run(inputs["audio_path"], inputs["language"], deadline_sec,
+                                                          start_time, consultation_id, existing_id)
+        run = self.pipeline.run(context, on_stage=self._stage_callback(on_stage),
+                                restored=restored, checkpoint=checkpoint)
+        return self._finish_run(run, inputs["audio_path"], start_time, None, consultation_id)
+
+    def _prepare_run(self, audio_path: str, language: Optional[str], deadline_sec: Optional[float],
+                     start_time: datetime, consultation_id: Optional[str],
+                     existing_prescription_id: Optional[int] = None, audio_sha256: Optional[str] = None
+                     ) -> Tuple[Dict, Optional[Dict[str, Dict]], Optional[Callable[[str, Dict], None]]]:
+        """
+        Initial context (with the artifact writer as 'archive', for a late upgrade), plus restored
+        stage outputs (consultation_id set) and a per-stage writer for checkpoints and/or artifacts
+        (None if neither is on)
+        """
+        archive = self._artifact_writer(audio_path, consultation_id, audio_sha256) if self.artifacts else None
+        context = {"audio_path": audio_path, "language": language, "deadline_sec": deadline_sec,
+                   "start_time": start_time, "existing_prescription_id": existing_prescription_id,
+                   "archive": archive}
+        if consultation_id is None:
+            return context, None, archive
+
+        inputs = {"audio_path": audio_path, "language": language}
+        restored = self.checkpoints.load(consultation_id)
+        if restored.pop(INPUTS, inputs) != inputs:
+            logger.warning(f"[CHECKPOINT] {consultation_id}: inputs changed - discarding its checkpoints")
+            self.checkpoints.discard(consultation_id)
+            restored = {}
+        if not restored:
+            self.checkpoints.save(consultation_id, INPUTS, inputs, seq=-1)
+        order = {stage.name: seq for seq, stage in enumerate(self.pipeline.stages)}
+        if restored.get("extract", {}).get("extract_result", {}).get("provisional"):
+            # Its late Groq upgrade never landed (the process ended first): extract again and
+            # update the prescription already saved rather than adding another
+            logger.info(f"[CHECKPOINT] {consultation_id}: provisional extraction - re-running from 'extract'")
+            saved_id = restored.get("persist", {}).get("prescription_id")
+            if saved_id is not None:
+                context["existing_prescription_id"] = saved_id
+            self.checkpoints.discard(consultation_id, from_stage="extract", stage_order=list(order))
+            restored = {stage: outputs for stage, outputs in restored.items() if order[stage] < order["extract"]}
+
+        def checkpoint(stage_name: str, outputs: Dict) -> None:
+            try:
+                self.checkpoints.save(consultation_id, stage_name, outputs, seq=order[stage_name])
+            except Exception as e:  # A lost checkpoint only costs a recompute on retry
+                logger.warning(f"[CHECKPOINT] Could not save '{stage_name}' for {consultation_id}: {e}")
+            if archive:
+                archive(stage_name, outputs)
+
+        if restored:
+            logger.info(f"[CHECKPOINT] {consultation_id}: {len(restored)} stage(s) checkpointed")
+        return context, restored, checkpoint
+
+    def _artifact_writer(self, audio_path: str, consultation_id: Optional[str],
+                         audio_sha256: Optional[str] = None) -> Callable[[str, Dict], None]:
+        """
+        Archive each completed stage's artifacts: raw audio, every transcript version and
+        the raw extraction JSON. Runs without a consultation_id are grouped by audio hash
+        (audio_sha256 if known, else hashed while the audio is stored).
+        """
+        state = {"group": consultation_id or audio_sha256}
+
+        def archive(stage_name: str, outputs: Dict) -> None:
+            try:
+                if stage_name == "transcribe":
+                    audio = self.artifacts.put_file(audio_path, "audio_raw", consultation_id, sha256=audio_sha256)
+                    state["group"] = consultation_id or audio.sha256
+                    tx_result = outputs['tx_result']
+                    self.artifacts.put_text(tx_result.text, "transcript", state["group"], {
+                        "stage": stage_name, "language": tx_result.detected_language,
+                        "tier": tx_result.transcription_tier, "audio_sha256": audio.sha256})
+                elif stage_name in ("clean", "thanglish", "normalize"):
+                    self.artifacts.put_text(outputs['transcript'], "transcript", state["group"], {"stage": stage_name})
+                elif stage_name == "compact" and outputs['compaction'].applied:
+                    self.artifacts.put_text(outputs['compaction'].text, "transcript", state["group"], {"stage": stage_name})
+                elif stage_name == "extract":
+                    extract_result = outputs['extract_result']
+                    self.artifacts.put_json(
+                        {key: extract_result.get(key) for key in ("method", "data", "usage", "provisional")},
+                        "extraction", state["group"], {"method": extract_result.get('method')})
+            except Exception as e:  # Archiving must never fail a request
+                logger.warning(f"[ARTIFACT] Could not archive '{stage_name}' output: {e}")
+
+        return archive
+
+    def _stage_callback(self, on_stage: Optional[Callable[[StageResult], None]]) -> Callable[[StageResult], None]:
+        """Reporter first, then the caller's on_stage"""
+        def _on_stage(stage_result: StageResult):
+            self.reporter.stage_finished(stage_result)
+            if on_stage:
+                on_stage(stage_result)
+        return _on_stage
+
+    @staticmethod
+    def _partial_callback(on_partial: Optional[Callable[[str, Any], None]]
+                          ) -> Optional[Callable[[str, Any], None]]:
+        """Caller's on_partial, guarded so a failing consumer never breaks extraction"""
+        if on_partial is None:
+            return None
+
+        def _on_partial(kind: str, payload: Any) -> None:
+            try:
+                on_partial(kind, payload)
+            except Exception as e:
+                logger.warning(f"[STAGES] on_partial callback failed for '{kind}': {e}")
+        return _on_partial
+
+    def _finish_run(self, run: PipelineRun, audio_path: str, start_time: datetime,
+                    on_upgrade: Optional[Callable[[Dict], None]], consultation_id: Optional[str] = None,
+                    on_upgrade_failed: Optional[Callable[[str], None]] = None) -> Dict:
+        """Metrics and result dict for a finished pipeline run (shared by process/process_async)"""
+        if run.stopped:
+            return run.stopped.result
+        ctx = run.context
+        tx_result, transcript, route = ctx['tx_result'], ctx['transcript'], ctx['route']
+        extract_result, prescription = ctx['extract_result'], ctx['prescription']
+        compaction, repeat_metadata = ctx['compaction'], ctx['repeat_metadata']
+        provisional = extract_result.get('provisional', False)
+
+        # Record metrics
+        processing_time = (datetime.now() - start_time).total_seconds()
+        usage = extract_result.get('usage', {})
+        metrics = ExtractionMetrics(
+            audio_file=audio_path,
+            timestamp=datetime.now().isoformat(),
+            transcription_tier=tx_result.transcription_tier,
+            transcript_length=len(tx_result.text),  # Raw length before cleaning
+            cleaned_length=len(transcript),  # Length after cleaning
+            transcript_was_modified=ctx['was_modified'],
+            detected_language=ctx['lang_code'],
+            routing_quality_score=ctx['analysis']['overall_quality'],
+            routing_decision=route,
+            extraction_method=extract_result['method'],
+            medicines_extracted=len(prescription.medicines),
+            diagnosis_extracted=len(prescription.diagnosis),
+            validation_passed=ctx['is_valid'],
+            validation_errors=ctx['errors'],
+            validation_warnings=ctx['warnings'],
+            confidence=prescription.confidence,
+            processing_time_sec=processing_time,
+            prompt_tokens_estimate=usage.get('prompt_tokens_estimate', 0),
+            deadline_missed=extract_result.get('deadline_missed', False),
+            provisional=provisional,
+            model_tier=usage.get('tier', ''),
+            extraction_model=usage.get('model', ''),
+            medicine_cues=usage.get('medicine_cues', 0),
+            groq_latency_sec=usage.get('latency_sec', 0.0),
+            latency_saved_sec=usage.get('latency_saved_sec', 0.0),
+            repetition_chars_removed=repeat_metadata['chars_removed'],
+            repetition_tokens_removed=repeat_metadata['tokens_removed'],
+            compaction_applied=bool(compaction and compaction.applied),
+            compaction_kept_ratio=compaction.kept_ratio if compaction else 1.0,
+            compaction_tokens_saved=compaction.tokens_saved if compaction else 0,
+            stage_timings=run.timings
+        )
+        # Restored stages were paid for by the run that checkpointed them
+        self._record_cost(metrics, None if 'transcribe' in run.restored else tx_result,
+                          {} if 'extract' in run.restored else usage)
+        self.metrics_collector.record(metrics)
+        self.reporter.request_finished(ctx['prescription_id'], metrics)
+
+        result = {
+            "success": True,
+            "prescription_id": ctx['prescription_id'],
+            "patient_name": prescription.patient_name,
+            "complaints": prescription.complaints,
+            "diagnosis": prescription.diagnosis,
+            "medicines": prescription.medicines,
+            "tests": prescription.tests,
+            "advice": prescription.advice,
+            "language": prescription.language,
+            "confidence": prescription.confidence,
+            "extraction_method": extract_result.get('method'),
+            "processing_time_sec": processing_time,
+            "route": route,
+            "provisional": provisional,
+            "stage_timings": run.timings
+        }
 
-        # [1] Transcription
-        lang_label = f"forced='{language}'" if language else "auto-detect"
-        print(f"\n[1/7] SPEECH RECOGNITION (Whisper multilingual, {lang_label})")
-        print("-" * 80)
+        # Late Groq result replaces the provisional one (persisted first, then pushed)
+        upgrade_future = extract_result.get('upgrade_future')
+        archive = ctx.get('archive')
+        if upgrade_future is not None:
+            if upgrade_future.done():  # Groq finished during validate/persist: return its result directly
+                upgraded = self._apply_upgrade(upgrade_future, result, prescription, route, metrics, start_time,
+                                               consultation_id, archive)
+                if upgraded is not None:
+                    return upgraded
+                self._notify_upgrade(None, on_upgrade, on_upgrade_failed)
+                return result
+            upgrade_future.add_done_callback(
+                lambda done: self._notify_upgrade(
+                    self._apply_upgrade(done, result, prescription, route, metrics, start_time, consultation_id,
+                                        archive),
+                    on_upgrade, on_upgrade_failed)
+            )
 
-        tx_result = self.transcriber.transcribe(audio_path, language=language)
+        return result
+
+    # ── Pipeline stages (each takes the run context, returns its outputs) ─────
+
+    def _stage_transcribe(self, ctx: Dict) -> Dict:
+        """[1] Transcription"""
+        language = ctx['language']
+        self.reporter.report("transcribing", language=language)
+
+        tx_result = self.transcriber.transcribe(ctx['audio_path'], language=language)
         if not tx_result.success:
             logger.error(f"Transcription failed: {tx_result.error}")
-            return {"success": False, "error": "Transcription failed"}
+            raise StopPipeline({"success": False, "error": "Transcription failed"}, tx_result.error or "")
 
-        transcript = tx_result.text
-        tier_label = {1: "base (multilingual, auto-detect)", 2: "base (multilingual, with hint)", 3: "medium (multilingual, escalated)"}.get(
-            tx_result.transcription_tier, str(tx_result.transcription_tier)
-        )
-        print(f"Model: Whisper {tier_label}")
-        print(f"Mode: transcribe (native multilingual ASR)")
-        print(f"Raw length: {len(transcript)} chars")
-        try:
-            print(f"Raw transcript: {transcript[:100]}...")
-        except UnicodeEncodeError:
-            print(f"Raw transcript: [Non-ASCII text]")
-        print(f"Confidence: {tx_result.confidence:.0%}")
-        audio_detected_lang = tx_result.detected_language or "en"
-        print(f"Audio-detected language: {audio_detected_lang.upper()} (Whisper raw: {tx_result.whisper_language})\n")
-
-        # [2] Transcript Cleaning (NEW)
-        print("[2/7] TRANSCRIPT CLEANING (ASR distortion fixes)")
-        print("-" * 80)
-        
+        self.reporter.report("transcribed", tx_result=tx_result)
+        if ctx.get('on_partial'):
+            ctx['on_partial']("transcript", {"stage": "transcribe", "text": tx_result.text,
+                                             "language": tx_result.detected_language})
+        return {"tx_result": tx_result, "transcript": tx_result.text}
+
+    def _stage_clean(self, ctx: Dict) -> Dict:
+        """[2] Transcript cleaning (ASR distortion fixes)"""
         cleaner = TranscriptCleaner()
-        cleaned_transcript, was_modified = cleaner.clean(transcript)
-        
-        print(f"Cleaning applied: {'Yes' if was_modified else 'No'}")
-        print(f"Cleaned length: {len(cleaned_transcript)} chars")
-        if was_modified and len(cleaned_transcript) < 200:
-            print(f"Cleaned transcript: {cleaned_transcript}")
-        else:
-            print(f"Cleaned (sample): {cleaned_transcript[:100]}...")
-        print()
+        cleaned_transcript, was_modified = cleaner.clean(ctx['transcript'])
+        self.reporter.report("cleaned", transcript=cleaned_transcript, was_modified=was_modified)
 
         # Use cleaned transcript for all downstream processing
-        transcript = cleaned_transcript
+        return {"transcript": cleaned_transcript, "was_modified": was_modified}
 
-        # [3] Language Detection
-        print("[3/7] LANGUAGE DETECTION")
-        print("-" * 80)
+    def _stage_detect_language(self, ctx: Dict) -> Dict:
+        """[3] Language detection (audio-level result confirmed by the text detector)"""
+        audio_detected_lang = ctx['tx_result'].detected_language or "en"
 
         # Audio-level language already detected by Whisper probe.
         # Run text-level detector as secondary confirmation.
         # If Whisper already detected Tamil, Thanglish, or Arabic, trust it over text-only fallback.
-        text_lang_code, text_lang_metadata = self.language_detector.detect(transcript)
+        text_lang_code, text_lang_metadata = self.language_detector.detect(ctx['transcript'])
 
         # Merge: audio detection wins for 'ta' (Tamil Unicode) and 'ar' (Arabic), text detection wins for 'tanglish'
         if audio_detected_lang == "ta":
@@ -793,69 +1226,46 @@ class MedicalSystem:
         else:
             lang_code, lang_metadata = text_lang_code, text_lang_metadata
 
-        lang_confidence = lang_metadata.get('confidence', 0.0)
-        
-        print(f"Audio-level: {audio_detected_lang.upper()}")
-        print(f"Text-level:  {text_lang_code.upper()}")
-        print(f"Final:       {lang_code.upper()} (confidence: {lang_confidence:.0%})")
-        if 'reason' in lang_metadata:
-            print(f"Reason: {lang_metadata['reason']}")
-        print()
-
-        # [4] Thanglish Normalization (if needed)
-        print("[4/7] THANGLISH NORMALIZATION")
-        print("-" * 80)
-
-        if lang_code == "tanglish":
-            transcript, was_thanglish_normalized = self.thanglish_normalizer.normalize(transcript)
-            print(f"Thanglish normalized: {was_thanglish_normalized}")
-            print(f"Normalized (sample): {transcript[:100]}...")
-        else:
-            print(f"No Thanglish normalization needed ({lang_code.upper()})")
-            was_thanglish_normalized = False
-        print()
+        self.reporter.report("language_detected", audio_lang=audio_detected_lang, text_lang=text_lang_code,
+                             lang_code=lang_code, lang_metadata=lang_metadata)
+        return {"lang_code": lang_code, "lang_metadata": lang_metadata}
 
-        # [5] Transcript Normalization (ASR fixes, dosage/frequency standardization)
-        print("[5/7] TRANSCRIPT NORMALIZATION (ASR fixes, dosage standardization)")
-        print("-" * 80)
+    def _stage_thanglish(self, ctx: Dict) -> Dict:
+        """[4] Thanglish normalization (skipped for other languages)"""
+        transcript, was_thanglish_normalized = self.thanglish_normalizer.normalize(ctx['transcript'])
+        self.reporter.report("thanglish_normalized", transcript=transcript, was_normalized=was_thanglish_normalized)
+        return {"transcript": transcript}
 
-        transcript, norm_metadata = self.transcript_normalizer.normalize(transcript)
-        norm_steps = norm_metadata.get('steps', [])
-        
-        print(f"Normalization steps applied: {len(norm_steps)}")
-        if norm_steps and len(norm_steps) <= 5:
-            for step in norm_steps:
-                print(f"  - {step}")
-        elif norm_steps:
-            print(f"  - {norm_steps[0]}")
-            print(f"  - ... ({len(norm_steps)-2} more steps)")
-            print(f"  - {norm_steps[-1]}")
-        
-        print(f"Normalized (sample): {transcript[:100]}...")
-        print()
+    def _stage_normalize(self, ctx: Dict) -> Dict:
+        """[5] Transcript normalization (ASR fixes, dosage/frequency standardization, repetition collapse)"""
+        transcript, norm_metadata = self.transcript_normalizer.normalize(ctx['transcript'])
 
-        # [6] Intelligent Routing & Groq-First Extraction
-        print("[6/7] GROQ-FIRST ROUTING & EXTRACTION")
-        print("-" * 80)
+        # Collapse repeated-phrase loops before routing so neither the router nor Groq sees them
+        transcript, repeat_metadata = self.repetition_collapser.collapse(transcript)
 
+        self.reporter.report("normalized", transcript=transcript, norm_steps=norm_metadata.get('steps', []),
+                             repeat_metadata=repeat_metadata)
+        if ctx.get('on_partial'):
+            ctx['on_partial']("transcript", {"stage": "normalize", "text": transcript})
+        return {"transcript": transcript, "norm_metadata": norm_metadata, "repeat_metadata": repeat_metadata}
+
+    def _stage_route(self, ctx: Dict) -> Dict:
+        """[6a] Quality analysis and route selection (stops the run on corrupted audio)"""
+        self.reporter.report("routing")
+
+        lang_code = ctx['lang_code']
         analysis = self.analyzer.analyze(
-            transcript=transcript,
-            whisper_confidence=tx_result.confidence,
+            transcript=ctx['transcript'],
+            whisper_confidence=ctx['tx_result'].confidence,
             language=lang_code,
-            language_confidence=lang_confidence
+            language_confidence=ctx['lang_metadata'].get('confidence', 0.0)
         )
 
         route, routing_config = self.router.select_route(analysis)
 
         # 🔥 SAFETY: If audio is corrupted (transcription produced almost nothing), skip extraction
         if route == 'corrupted_audio':
-            print(f"Route: {route.upper()}")
-            print("Status: Audio quality too poor - cannot extract prescription")
-            print("\n[7/7] VALIDATION (SKIPPED)")
-            print("-" * 80)
-            print("Status: Audio appears corrupted or missing")
-            
-            processing_time = (datetime.now() - start_time).total_seconds()
+            processing_time = (datetime.now() - ctx['start_time']).total_seconds()
             
             # Return empty prescription as dict (JSON serializable)
             output = {
@@ -874,42 +1284,68 @@ class MedicalSystem:
                 "processing_time_sec": processing_time,
                 "route": route
             }
-            
-            print(json.dumps({
-                "patient_name": output["patient_name"],
-                "complaints": output["complaints"],
-                "diagnosis": output["diagnosis"],
-                "medicines": output["medicines"],
-                "tests": output["tests"],
-                "advice": output["advice"]
-            }, indent=2, ensure_ascii=False))
-            
-            return output
+            self.reporter.report("corrupted_audio", output=output)
+            raise StopPipeline(output, "corrupted audio")
+
+        self.reporter.report("routed", route=route)
+        return {"analysis": analysis, "route": route}
+
+    def _stage_compact(self, ctx: Dict) -> Dict:
+        """[6b] Optional compaction of the Groq input"""
+        compaction = self.compactor.compact(ctx['transcript'])
+        self.reporter.report("compacted", compaction=compaction)
+        return {"compaction": compaction}
+
+    def _stage_extract(self, ctx: Dict) -> Dict:
+        """[6c] Groq-first extraction"""
+        transcript, route, compaction = ctx['transcript'], ctx['route'], ctx['compaction']
+
+        # Transcript content is patient data: DEBUG only, formatted lazily
+        logger.debug("Full cleaned transcript for extraction (%d chars): %.1000s...", len(transcript), transcript)
 
-        # Execute extraction based on route (Groq-first)
-        use_ensemble = (route == 'ensemble')
-        print(f"Route: {route.upper()}")
-        print(f"Extraction method: {'Groq (primary)' if route == 'groq_only' else 'Groq + Rules (voting)' if route == 'ensemble' else 'Rules-only (fallback)'}")
-        
-        logger.info(f"[OPTIMIZATION] Ensemble disabled by default for speed. Using Groq-only mode.")
-        use_ensemble = False  # 🔥 DISABLE ENSEMBLE BY DEFAULT - runs both methods (SLOW)
-        
-        # Debug: log full transcript for extraction
-        logger.info(f"Full cleaned transcript for extraction ({len(transcript)} chars): {transcript[:1000]}...")
-        
         extract_result = self.advanced_extractor.extract_advanced(
             transcript=transcript,
-            use_ensemble=use_ensemble
+            use_ensemble=(route == 'ensemble'),
+            language=ctx['lang_code'],
+            deadline_sec=ctx['deadline_sec'],
+            llm_transcript=compaction.text if compaction and compaction.applied else None,
+            on_partial=ctx.get('on_partial')
         )
 
         if not extract_result['success']:
             logger.error("Advanced extraction failed")
-            return {"success": False, "error": "Extraction failed"}
+            raise StopPipeline({"success": False, "error": "Extraction failed"}, "extraction failed")
+
+        confidence = ctx['analysis'].get('overall_quality', ctx['tx_result'].confidence)
+        prescription = self._build_prescription(extract_result, ctx['lang_code'], route, confidence,
+                                                ctx['tx_result'].transcription_tier)
+        self.reporter.report("extracted", extract_result=extract_result, prescription=prescription)
+        return {"extract_result": extract_result, "prescription": prescription}
+
+    def _stage_validate(self, ctx: Dict) -> Dict:
+        """[7] Validation"""
+        is_valid, errors, warnings = self.validator.validate(ctx['prescription'])
+        self.reporter.report("validated", is_valid=is_valid, errors=errors, warnings=warnings)
+        return {"is_valid": is_valid, "errors": errors, "warnings": warnings}
+
+    def _stage_persist(self, ctx: Dict) -> Dict:
+        """Save to database (even if validation fails, save the data)"""
+        prescription = ctx['prescription']
+        prescription_id = ctx['existing_prescription_id']
+        if prescription_id is None:
+            prescription_id = self.database.save(prescription, routing_decision=ctx['route'])
+        else:
+            self.database.update(prescription_id, prescription)  # reprocess_from: replace, don't duplicate
+        self.reporter.report("saved", prescription=prescription, prescription_id=prescription_id)
+        return {"prescription_id": prescription_id}
 
+    def _build_prescription(self, extract_result: Dict, lang_code: str, route: str,
+                            confidence: float, transcription_tier: int) -> Prescription:
+        """Build a Prescription from an extraction result"""
         data = extract_result['data']
         medicines = [Medicine(**m) if isinstance(m, dict) else m for m in data.get('medicines', [])]
 
-        prescription = Prescription(
+        return Prescription(
             patient_name=data.get('patient_name'),
             age=data.get('age'),
             language=lang_code,
@@ -918,96 +1354,108 @@ class MedicalSystem:
             medicines=[vars(m) for m in medicines],
             tests=data.get('tests', []),
             advice=data.get('advice', []),
-            confidence=analysis.get('overall_quality', tx_result.confidence),
+            confidence=confidence,
             extraction_method=f"{route}:{extract_result['method']}",
-            transcription_tier=tx_result.transcription_tier
+            transcription_tier=transcription_tier
         )
 
-        print(f"Extraction method: {extract_result['method'].upper()}")
-        print(f"Patient name: {prescription.patient_name}")
-        print(f"Diagnosis: {len(prescription.diagnosis)} found")
-        print(f"Medicines: {len(prescription.medicines)} found\n")
-
-        # [7] Validation
-        print("[7/7] VALIDATION")
-        print("-" * 80)
-
+    def _record_cost(self, metrics: ExtractionMetrics, tx_result: Optional[TranscriptionResult],
+                     usage: Dict) -> None:
+        """Whisper audio seconds and Groq usage of one request, priced; a skipped probe counts as savings"""
+        if tx_result is None:
+            self._add_groq_usage(metrics, usage)
+            return
+        metrics.audio_sec_probe = tx_result.audio_sec_probe
+        metrics.audio_sec_full = tx_result.audio_sec_full
+        metrics.probe_skipped = tx_result.probe_skipped
+        metrics.whisper_requests = tx_result.whisper_requests
+        metrics.whisper_retries = tx_result.whisper_retries
+        metrics.whisper_cost_usd = whisper_cost(tx_result.audio_sec_probe + tx_result.audio_sec_full)
+        if tx_result.probe_skipped:
+            metrics.savings_usd += whisper_cost(tx_result.audio_sec_full)  # The probe sends the whole file
+        self._add_groq_usage(metrics, usage)
+
+    @staticmethod
+    def _add_groq_usage(metrics: ExtractionMetrics, usage: Dict) -> None:
+        """Add an extraction's Groq tokens, retries and cost to its metrics record"""
+        metrics.prompt_tokens += usage.get('prompt_tokens', 0)
+        metrics.completion_tokens += usage.get('completion_tokens', 0)
+        metrics.cached_tokens += usage.get('cached_tokens', 0)
+        metrics.tokens_estimated = metrics.tokens_estimated or bool(usage.get('tokens_estimated'))
+        metrics.groq_requests += usage.get('groq_requests', 0)
+        metrics.groq_retries += usage.get('groq_retries', 0)
+        metrics.groq_cost_usd += usage.get('cost_usd', 0.0)
+        metrics.savings_usd += usage.get('cache_savings_usd', 0.0)
+        metrics.cost_usd = metrics.whisper_cost_usd + metrics.groq_cost_usd
+
+    def _apply_upgrade(self, upgrade_future: Future, provisional_output: Dict,
+                       provisional: Prescription, route: str, metrics: ExtractionMetrics,
+                       start_time: datetime, consultation_id: Optional[str] = None,
+                       archive: Optional[Callable[[str, Dict], None]] = None) -> Optional[Dict]:
+        """
+        Persist a late Groq result over its provisional prescription (and over its extract/validate
+        checkpoints, so a resume or reprocess_from starts from it); archive (the run's artifact
+        writer) stores it as the next extraction version. Returns the upgraded output
+        """
+        try:
+            upgraded = upgrade_future.result()
+        except Exception as e:
+            logger.error(f"[DEADLINE] Upgrade failed, provisional result stands: {e}")
+            return None
+        if not upgraded:
+            return None
+
+        prescription = self._build_prescription(upgraded, provisional.language, route,
+                                                provisional.confidence, provisional.transcription_tier)
         is_valid, errors, warnings = self.validator.validate(prescription)
-
-        if errors:
-            print("❌ ERRORS:")
-            for error in errors:
-                print(f"  {error}")
-
-        if warnings:
-            print("⚠️  WARNINGS:")
-            for warning in warnings:
-                clean = warning.encode('ascii', errors='ignore').decode('ascii').strip()
-                if clean:
-                    print(f"  {clean}")
-
-        if is_valid:
-            print("✅ Validation passed\n")
-        else:
-            print("⚠️  Validation completed with errors - but returning data anyway\n")
-
-        # Save to database (even if validation fails, save the data)
-        prescription_id = self.database.save(prescription, routing_decision=route)
-
-        # Output JSON
-        print("=" * 80)
-        print("PRESCRIPTION EXTRACTED & VALIDATED")
-        print("=" * 80)
-
-        output = {
-            "patient_name": prescription.patient_name,
-            "complaints": prescription.complaints,
-            "diagnosis": prescription.diagnosis,
-            "medicines": prescription.medicines,
-            "tests": prescription.tests,
-            "advice": prescription.advice
-        }
-
-        print(json.dumps(output, indent=2, ensure_ascii=False))
-        print(f"\nSaved to database (ID: {prescription_id})")
-
-        # Record metrics
-        processing_time = (datetime.now() - start_time).total_seconds()
-        metrics = ExtractionMetrics(
-            audio_file=audio_path,
-            timestamp=datetime.now().isoformat(),
-            transcription_tier=tx_result.transcription_tier,
-            transcript_length=len(tx_result.text),  # Raw length before cleaning
-            cleaned_length=len(transcript),  # Length after cleaning
-            transcript_was_modified=was_modified,
-            detected_language=lang_code,
-            routing_quality_score=analysis['overall_quality'],
-            routing_decision=route,
-            extraction_method=extract_result['method'],
-            medicines_extracted=len(prescription.medicines),
-            diagnosis_extracted=len(prescription.diagnosis),
-            validation_passed=is_valid,
-            validation_errors=errors,
-            validation_warnings=warnings,
-            confidence=prescription.confidence,
-            processing_time_sec=processing_time
-        )
-        self.metrics_collector.record(metrics)
-
-        return {
-            "success": True,
+        prescription_id = provisional_output['prescription_id']
+        self.database.update(prescription_id, prescription)
+        if consultation_id is not None:
+            order = [stage.name for stage in self.pipeline.stages]
+            try:
+                self.checkpoints.save(consultation_id, "extract", {"extract_result": upgraded,
+                                                                   "prescription": prescription},
+                                      seq=order.index("extract"))
+                self.checkpoints.save(consultation_id, "validate", {"is_valid": is_valid, "errors": errors,
+                                                                    "warnings": warnings},
+                                      seq=order.index("validate"))
+            except Exception as e:
+                logger.warning(f"[CHECKPOINT] Could not save upgraded extraction for {consultation_id}: {e}")
+        if archive:
+            archive("extract", {"extract_result": upgraded})
+
+        metrics.upgraded = True
+        metrics.upgrade_latency_sec = (datetime.now() - start_time).total_seconds()
+        self._add_groq_usage(metrics, upgraded.get('usage', {}))  # Groq was still billed after the deadline
+        logger.info(f"[DEADLINE] Prescription {prescription_id} upgraded to {upgraded['method']} "
+                    f"after {metrics.upgrade_latency_sec:.1f}s")
+
+        output = dict(provisional_output)
+        output.update({
             "patient_name": prescription.patient_name,
             "complaints": prescription.complaints,
             "diagnosis": prescription.diagnosis,
             "medicines": prescription.medicines,
             "tests": prescription.tests,
             "advice": prescription.advice,
-            "language": prescription.language,
-            "confidence": prescription.confidence,
-            "extraction_method": extract_result.get('method'),
-            "processing_time_sec": processing_time,
-            "route": route
-        }
+            "extraction_method": upgraded['method'],
+            "validation_passed": is_valid,
+            "provisional": False,
+            "upgraded": True
+        })
+        return output
+
+    @staticmethod
+    def _notify_upgrade(output: Optional[Dict], on_upgrade: Optional[Callable[[Dict], None]],
+                        on_upgrade_failed: Optional[Callable[[str], None]] = None) -> None:
+        """on_upgrade with the upgraded output, or on_upgrade_failed if there is none"""
+        try:
+            if output is not None and on_upgrade:
+                on_upgrade(output)
+            elif output is None and on_upgrade_failed:
+                on_upgrade_failed("Late Groq extraction failed - provisional result stands")
+        except Exception as e:
+            logger.error(f"[DEADLINE] Upgrade callback failed: {e}")
 
 
 # ==================== MAIN ENTRY POINT ====================
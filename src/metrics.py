@@ -8,7 +8,7 @@ MetricsDashboard: Displays real-time metrics summary
 import logging
 import json
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Any, Callable, Dict, List, Optional
 from dataclasses import dataclass, asdict, field
 from collections import defaultdict
 
@@ -35,6 +35,37 @@ class ExtractionMetrics:
     validation_warnings: List[str] = field(default_factory=list)
     confidence: float = 0.0
     processing_time_sec: float = 0.0
+    prompt_tokens_estimate: int = 0  # Estimated LLM input tokens (counted before sending)
+    deadline_missed: bool = False  # Groq missed the extraction deadline
+    provisional: bool = False  # Rules result returned while Groq was still running
+    upgraded: bool = False  # Provisional result later replaced by the Groq result
+    upgrade_latency_sec: float = 0.0  # Request start → upgrade persisted
+    model_tier: str = ""  # Size/complexity tier: 'small' or 'large' ('' = no Groq call)
+    extraction_model: str = ""  # Groq model that answered
+    medicine_cues: int = 0  # Drug names, doses and frequency phrases in the transcript
+    groq_latency_sec: float = 0.0  # Groq streaming time for the answering model
+    latency_saved_sec: float = 0.0  # Large-model p50 minus actual latency when routed small
+    audio_sec_probe: float = 0.0  # Audio seconds sent to Whisper for language detection
+    audio_sec_full: float = 0.0  # Audio seconds sent for the full transcription
+    probe_skipped: bool = False  # Language was given, so no probe pass was paid for
+    whisper_requests: int = 0
+    whisper_retries: int = 0
+    prompt_tokens: int = 0  # Groq prompt tokens billed (all calls: chunks, continuations, hedges)
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # Prompt tokens served from the provider's prompt cache
+    tokens_estimated: bool = False  # Some token counts are estimates (provider sent none)
+    groq_requests: int = 0
+    groq_retries: int = 0  # 429 retries and JSON-mode fallbacks
+    whisper_cost_usd: float = 0.0
+    groq_cost_usd: float = 0.0
+    cost_usd: float = 0.0  # Whisper + Groq
+    savings_usd: float = 0.0  # Skipped probe + cached prompt tokens
+    repetition_chars_removed: int = 0  # Repeated-phrase loops collapsed before routing
+    repetition_tokens_removed: int = 0
+    compaction_applied: bool = False  # Groq got a compacted transcript
+    compaction_kept_ratio: float = 1.0  # Share of transcript tokens sent to Groq
+    compaction_tokens_saved: int = 0
+    stage_timings: Dict[str, float] = field(default_factory=dict)  # Pipeline stage → seconds (monotonic)
 
 
 class MetricsCollector:
@@ -44,12 +75,41 @@ class MetricsCollector:
         """Initialize metrics storage."""
         self.metrics: List[ExtractionMetrics] = []
         self.start_time = datetime.now()
+        # Groq model circuit breakers: transition log + live health (set by the owner of the router)
+        self.breaker_transitions: List[Dict[str, str]] = []
+        self.model_health_source: Optional[Callable[[], Dict[str, Dict]]] = None
+        # Duplicate uploads served by an existing job (RequestCoalescer), by that job's state
+        self.coalesced: Dict[str, int] = defaultdict(int)
 
     def record(self, metrics: ExtractionMetrics) -> None:
         """Record extraction metrics."""
         self.metrics.append(metrics)
         logger.debug(f"Recorded metrics for {metrics.audio_file}")
 
+    def record_breaker_transition(self, model: str, old_state: str, new_state: str) -> None:
+        """Record a model circuit-breaker state change."""
+        self.breaker_transitions.append({
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "from": old_state,
+            "to": new_state,
+        })
+        logger.info(f"[METRICS] Breaker {model}: {old_state} → {new_state}")
+
+    def record_coalesced(self, state: str) -> None:
+        """Record a duplicate upload that joined an existing job ('in_flight' or 'completed')."""
+        self.coalesced[state] += 1
+
+    def get_model_health(self) -> Dict[str, Dict]:
+        """Per-model breaker state, error rate and latency percentiles (empty if no router attached)."""
+        if not self.model_health_source:
+            return {}
+        try:
+            return self.model_health_source()
+        except Exception as e:
+            logger.warning(f"Model health unavailable: {e}")
+            return {}
+
     def get_summary(self) -> Dict[str, Any]:
         """Get aggregated metrics summary."""
         if not self.metrics:
@@ -68,17 +128,56 @@ class MetricsCollector:
                 "avg_medicines_per_prescription": "0",
                 "avg_diagnosis_per_prescription": "0",
                 "avg_confidence": "0%",
+                "avg_prompt_tokens_estimate": "0",
+                "deadline_misses": 0,
+                "deadline_miss_rate": "0%",
+                "provisional_upgraded": 0,
+                "model_health": self.get_model_health(),
+                "breaker_transitions": len(self.breaker_transitions),
+                "coalesced_requests": sum(self.coalesced.values()),
+                "coalesced_distribution": dict(self.coalesced),
+                "tier_distribution": {},
+                "avg_groq_latency_by_tier": {},
+                "total_latency_saved_sec": "0.0",
+                "total_audio_sec_probe": "0.0",
+                "total_audio_sec_full": "0.0",
+                "probes_skipped": 0,
+                "total_prompt_tokens": 0,
+                "total_completion_tokens": 0,
+                "total_cached_tokens": 0,
+                "total_retries": 0,
+                "total_cost_usd": "0.0000",
+                "avg_cost_per_request_usd": "0.0000",
+                "total_savings_usd": "0.0000",
+                "repetition_collapsed_requests": 0,
+                "total_repetition_chars_removed": 0,
+                "total_repetition_tokens_removed": 0,
+                "compacted_requests": 0,
+                "avg_compaction_kept_ratio": "100%",
+                "total_compaction_tokens_saved": 0,
+                "avg_stage_time_sec": {},
             }
 
         total = len(self.metrics)
         passed = sum(1 for m in self.metrics if m.validation_passed)
         total_time = sum(m.processing_time_sec for m in self.metrics)
         uptime = (datetime.now() - self.start_time).total_seconds()
+        total_cost = sum(m.cost_usd for m in self.metrics)
+        compacted = [m for m in self.metrics if m.compaction_applied]
+        stage_times = defaultdict(list)
+        for m in self.metrics:
+            for stage, seconds in m.stage_timings.items():
+                stage_times[stage].append(seconds)
 
         routing_dist = defaultdict(int)
         extraction_dist = defaultdict(int)
         lang_dist = defaultdict(int)
         tier_dist = defaultdict(int)
+        deadline_misses = sum(1 for m in self.metrics if m.deadline_missed)
+        tier_latencies = defaultdict(list)
+        for m in self.metrics:
+            if m.model_tier:
+                tier_latencies[m.model_tier].append(m.groq_latency_sec)
 
         for m in self.metrics:
             routing_dist[m.routing_decision] += 1
@@ -100,6 +199,39 @@ class MetricsCollector:
             "avg_medicines_per_prescription": f"{(sum(m.medicines_extracted for m in self.metrics) / total):.1f}" if total > 0 else "0",
             "avg_diagnosis_per_prescription": f"{(sum(m.diagnosis_extracted for m in self.metrics) / total):.1f}" if total > 0 else "0",
             "avg_confidence": f"{(sum(m.confidence for m in self.metrics) / total):.0%}" if total > 0 else "0%",
+            "avg_prompt_tokens_estimate": f"{(sum(m.prompt_tokens_estimate for m in self.metrics) / total):.0f}" if total > 0 else "0",
+            "deadline_misses": deadline_misses,
+            "deadline_miss_rate": f"{(deadline_misses / total * 100):.1f}%" if total > 0 else "0%",
+            "provisional_upgraded": sum(1 for m in self.metrics if m.upgraded),
+            "model_health": self.get_model_health(),
+            "breaker_transitions": len(self.breaker_transitions),
+            "coalesced_requests": sum(self.coalesced.values()),
+            "coalesced_distribution": dict(self.coalesced),
+            "tier_distribution": {tier: len(values) for tier, values in tier_latencies.items()},
+            "avg_groq_latency_by_tier": {
+                tier: f"{(sum(values) / len(values)):.2f}" for tier, values in tier_latencies.items()
+            },
+            "total_latency_saved_sec": f"{sum(m.latency_saved_sec for m in self.metrics):.1f}",
+            "total_audio_sec_probe": f"{sum(m.audio_sec_probe for m in self.metrics):.1f}",
+            "total_audio_sec_full": f"{sum(m.audio_sec_full for m in self.metrics):.1f}",
+            "probes_skipped": sum(1 for m in self.metrics if m.probe_skipped),
+            "total_prompt_tokens": sum(m.prompt_tokens for m in self.metrics),
+            "total_completion_tokens": sum(m.completion_tokens for m in self.metrics),
+            "total_cached_tokens": sum(m.cached_tokens for m in self.metrics),
+            "total_retries": sum(m.whisper_retries + m.groq_retries for m in self.metrics),
+            "total_cost_usd": f"{total_cost:.4f}",
+            "avg_cost_per_request_usd": f"{(total_cost / total):.4f}" if total > 0 else "0.0000",
+            "total_savings_usd": f"{sum(m.savings_usd for m in self.metrics):.4f}",
+            "repetition_collapsed_requests": sum(1 for m in self.metrics if m.repetition_chars_removed),
+            "total_repetition_chars_removed": sum(m.repetition_chars_removed for m in self.metrics),
+            "total_repetition_tokens_removed": sum(m.repetition_tokens_removed for m in self.metrics),
+            "compacted_requests": len(compacted),
+            "avg_compaction_kept_ratio": (f"{(sum(m.compaction_kept_ratio for m in compacted) / len(compacted)):.0%}"
+                                          if compacted else "100%"),
+            "total_compaction_tokens_saved": sum(m.compaction_tokens_saved for m in self.metrics),
+            "avg_stage_time_sec": {
+                stage: f"{(sum(values) / len(values)):.3f}" for stage, values in stage_times.items()
+            },
         }
 
     def export_json(self, filename: str) -> None:
@@ -107,7 +239,8 @@ class MetricsCollector:
         data = {
             "timestamp": datetime.now().isoformat(),
             "summary": self.get_summary(),
-            "records": [asdict(m) for m in self.metrics]
+            "records": [asdict(m) for m in self.metrics],
+            "breaker_transitions": self.breaker_transitions
         }
         with open(filename, 'w') as f:
             json.dump(data, f, indent=2)
@@ -134,6 +267,10 @@ class MetricsDashboard:
             f"  Success Rate: {summary['success_rate']}",
             f"  Avg Processing Time: {summary['avg_extraction_time_sec']} sec",
             f"  System Uptime: {summary['system_uptime_sec']} sec",
+            f"  Deadline Misses: {summary['deadline_misses']} ({summary['deadline_miss_rate']}), "
+            f"upgraded: {summary['provisional_upgraded']}",
+            f"  Coalesced Duplicates: {summary['coalesced_requests']} "
+            f"({', '.join(f'{k}: {v}' for k, v in summary['coalesced_distribution'].items()) or 'none'})",
             "",
             "EXTRACTION QUALITY",
             "-" * 80,
@@ -141,6 +278,20 @@ class MetricsDashboard:
             f"  Avg Diagnoses/Prescription: {summary['avg_diagnosis_per_prescription']}",
             f"  Avg Confidence Score: {summary['avg_confidence']}",
             "",
+            "COST",
+            "-" * 80,
+            f"  Whisper Audio: {summary['total_audio_sec_full']} sec full, "
+            f"{summary['total_audio_sec_probe']} sec probe ({summary['probes_skipped']} probes skipped)",
+            f"  Groq Tokens: {summary['total_prompt_tokens']} prompt "
+            f"({summary['total_cached_tokens']} cached), {summary['total_completion_tokens']} completion",
+            f"  Retries: {summary['total_retries']}",
+            f"  Repetition Loops: {summary['repetition_collapsed_requests']} requests, "
+            f"-{summary['total_repetition_chars_removed']} chars, ~-{summary['total_repetition_tokens_removed']} tokens",
+            f"  Compaction: {summary['compacted_requests']} requests, avg {summary['avg_compaction_kept_ratio']} "
+            f"of tokens kept, -{summary['total_compaction_tokens_saved']} tokens",
+            f"  Total Cost: ${summary['total_cost_usd']} (avg ${summary['avg_cost_per_request_usd']}/request), "
+            f"saved ${summary['total_savings_usd']}",
+            "",
             "ROUTING DISTRIBUTION",
             "-" * 80,
         ]
@@ -179,6 +330,27 @@ class MetricsDashboard:
             percentage = (count / summary['total_processed'] * 100) if summary['total_processed'] > 0 else 0
             output.append(f"  {tier}: {count} ({percentage:.1f}%)")
 
+        if summary['avg_stage_time_sec']:
+            output.extend([
+                "",
+                "STAGE TIMINGS (avg)",
+                "-" * 80,
+            ])
+            for stage, seconds in summary['avg_stage_time_sec'].items():
+                output.append(f"  {stage}: {seconds} sec")
+
+        if summary['model_health']:
+            output.extend([
+                "",
+                f"GROQ MODELS ({summary['breaker_transitions']} breaker transitions)",
+                "-" * 80,
+            ])
+            for model, health in summary['model_health'].items():
+                p50 = f"{health['p50_sec']:.2f}s" if health['p50_sec'] is not None else "-"
+                p95 = f"{health['p95_sec']:.2f}s" if health['p95_sec'] is not None else "-"
+                output.append(f"  {model}: {health['state'].upper()} "
+                              f"(errors {health['error_rate']:.0%}, p50 {p50}, p95 {p95})")
+
         output.append("=" * 80 + "\n")
 
         # Print and log
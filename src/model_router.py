@@ -0,0 +1,239 @@
+"""
+Model Router Module: Health-aware selection between Groq models.
+
+ModelRouter: Per-model circuit breakers plus rolling error rate and latency
+             percentiles; routes each request to the healthiest model.
+
+BREAKER STATES:
+- closed:    Normal traffic
+- open:      Tripped after repeated failures; no traffic until the cooldown expires
+- half_open: Cooldown expired; a single probe request decides closed vs open again
+"""
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def percentile(values: Iterable[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile (None for no values)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+@dataclass
+class ModelHealth:
+    """Rolling health window for one model."""
+    model: str
+    window: int = 20
+    state: str = CLOSED
+    outcomes: Deque[bool] = field(default_factory=deque)      # True = success
+    latencies: Deque[float] = field(default_factory=deque)    # Successful call durations (sec)
+    consecutive_failures: int = 0
+    opened_at: float = 0.0
+    probe_in_flight: bool = False
+    transitions: int = 0
+
+    def __post_init__(self):
+        self.outcomes = deque(self.outcomes, maxlen=self.window)
+        self.latencies = deque(self.latencies, maxlen=self.window)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    @property
+    def p50(self) -> Optional[float]:
+        return percentile(self.latencies, 50)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return percentile(self.latencies, 95)
+
+
+class ModelRouter:
+    """
+    Routes requests across models using circuit breakers and recent latency.
+
+    select() picks a half-open model's probe first (so recovery is detected),
+    otherwise the closed model with the lowest (error rate, p50 latency);
+    models without latency data rank after measured ones, then by list order.
+    A preferred model is kept while its breaker is closed, unless it is in a worse
+    error-rate bucket than the best alternative. Latency is not compared: models
+    serve different tiers, so the large model's p50 is naturally higher.
+    """
+
+    def __init__(self, models: List[str], window: int = 20, failure_threshold: int = 3,
+                 error_rate_threshold: float = 0.5, min_samples: int = 5,
+                 cooldown_sec: float = 30.0, clock=time.monotonic,
+                 on_transition: Optional[Callable[[str, str, str], None]] = None):
+        self.models = list(models)
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.cooldown_sec = cooldown_sec
+        self.clock = clock
+        self.on_transition = on_transition
+        self.health: Dict[str, ModelHealth] = {m: ModelHealth(m, window=window) for m in self.models}
+        self._lock = threading.Lock()
+
+    # ── Selection ─────────────────────────────────────────────────────────────
+
+    def select(self, exclude: Iterable[str] = (), prefer: Optional[str] = None) -> Optional[str]:
+        """
+        Model for the next request (None if every breaker is open).
+
+        prefer: model to use while it is healthy (e.g. the size tier's model): its breaker is
+                closed and its error rate is no worse than the best alternative's;
+                otherwise the usual probe/health ranking applies.
+        """
+        excluded = set(exclude)
+        with self._lock:
+            now = self.clock()
+            for health in self.health.values():
+                if health.state == OPEN and now - health.opened_at >= self.cooldown_sec:
+                    self._transition(health, HALF_OPEN)
+
+            preferred = self.health.get(prefer)
+            if preferred is not None and prefer not in excluded and preferred.state == CLOSED \
+                    and not self._degraded(prefer, excluded):
+                return prefer
+
+            for model in self.models:
+                health = self.health[model]
+                if model not in excluded and health.state == HALF_OPEN and not health.probe_in_flight:
+                    health.probe_in_flight = True
+                    logger.info(f"[ROUTER] Half-open probe → {model}")
+                    return model
+
+            candidates = [m for m in self.models if m not in excluded and self.health[m].state == CLOSED]
+            if not candidates:
+                return None
+            return min(candidates, key=self._rank)
+
+    def _rank(self, model: str):
+        health = self.health[model]
+        p50 = health.p50
+        return (round(health.error_rate, 1), p50 if p50 is not None else float("inf"),
+                self.models.index(model))
+
+    def _degraded(self, model: str, excluded: set) -> bool:
+        """Whether a closed model is in a worse error-rate bucket than the best other closed model."""
+        others = [m for m in self.models if m != model and m not in excluded and self.health[m].state == CLOSED]
+        if not others:
+            return False
+        best = min(round(self.health[m].error_rate, 1) for m in others)
+        return round(self.health[model].error_rate, 1) > best
+
+    def latency_percentile(self, model: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Recent latency percentile for a model (None until min_samples successes)."""
+        with self._lock:
+            health = self.health.get(model)
+            if health is None or len(health.latencies) < min_samples:
+                return None
+            return percentile(health.latencies, pct)
+
+    # ── Outcomes ──────────────────────────────────────────────────────────────
+
+    def record_success(self, model: str, latency_sec: float) -> None:
+        with self._lock:
+            health = self.health.get(model)
+            if health is None:
+                return
+            health.outcomes.append(True)
+            health.latencies.append(latency_sec)
+            health.consecutive_failures = 0
+            if health.state == HALF_OPEN:
+                health.probe_in_flight = False
+                health.outcomes.clear()  # Errors from before the outage no longer apply
+                health.outcomes.append(True)
+                self._transition(health, CLOSED)
+
+    def record_failure(self, model: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            health = self.health.get(model)
+            if health is None:
+                return
+            health.outcomes.append(False)
+            health.consecutive_failures += 1
+            if health.state == HALF_OPEN:
+                health.probe_in_flight = False
+                self._open(health, f"probe failed: {error}")
+            elif health.state == CLOSED and (
+                    health.consecutive_failures >= self.failure_threshold
+                    or (len(health.outcomes) >= self.min_samples
+                        and health.error_rate >= self.error_rate_threshold)):
+                self._open(health, f"{health.consecutive_failures} consecutive failures, "
+                                   f"error rate {health.error_rate:.0%}: {error}")
+
+    def is_probing(self, model: str) -> bool:
+        """Whether model's half-open probe is out (held by the request select() handed it to)."""
+        with self._lock:
+            health = self.health.get(model)
+            return health is not None and health.state == HALF_OPEN and health.probe_in_flight
+
+    def record_cancelled(self, model: str) -> None:
+        """A request was abandoned (e.g. lost a hedge race): no outcome, but free the probe slot."""
+        with self._lock:
+            health = self.health.get(model)
+            if health is not None and health.state == HALF_OPEN:
+                health.probe_in_flight = False
+
+    def trip(self, model: str, reason: str = "unavailable") -> None:
+        """Open a model's breaker directly (e.g. failed startup probe)."""
+        with self._lock:
+            health = self.health.get(model)
+            if health is not None and health.state != OPEN:
+                self._open(health, reason)
+
+    def _open(self, health: ModelHealth, reason: str) -> None:
+        health.opened_at = self.clock()
+        logger.warning(f"[ROUTER] Breaker OPEN for {health.model} ({reason}) - "
+                       f"cooling down {self.cooldown_sec:.0f}s")
+        self._transition(health, OPEN)
+
+    def _transition(self, health: ModelHealth, new_state: str) -> None:
+        old_state = health.state
+        if old_state == new_state:
+            return
+        health.state = new_state
+        health.transitions += 1
+        if new_state != OPEN:
+            logger.info(f"[ROUTER] {health.model}: {old_state} → {new_state}")
+        if self.on_transition:
+            try:
+                self.on_transition(health.model, old_state, new_state)
+            except Exception as e:
+                logger.warning(f"[ROUTER] Transition callback failed: {e}")
+
+    # ── Metrics ───────────────────────────────────────────────────────────────
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Per-model breaker state, error rate and latency percentiles."""
+        with self._lock:
+            return {
+                model: {
+                    "state": h.state,
+                    "error_rate": round(h.error_rate, 3),
+                    "p50_sec": round(h.p50, 3) if h.p50 is not None else None,
+                    "p95_sec": round(h.p95, 3) if h.p95 is not None else None,
+                    "samples": len(h.outcomes),
+                    "transitions": h.transitions,
+                }
+                for model, h in self.health.items()
+            }
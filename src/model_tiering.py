@@ -0,0 +1,112 @@
+"""
+Model Tiering Module: Transcript-size-aware Groq model selection.
+
+count_medicine_cues: Counts drug names, doses and frequency phrases in a transcript
+ModelTierSelector: Estimates transcript size/complexity and picks a model tier
+
+TIERS:
+- small: short, simple consultations ("continue same medicines, review in a week")
+         in a language the small model handles well → faster model
+- large: everything else (long, many medicines, code-mixed language) → strongest model
+"""
+
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    from .prompt_builder import estimate_tokens
+except ImportError:
+    from prompt_builder import estimate_tokens
+
+try:
+    from .medicine_database import KNOWN_DRUGS
+except ImportError:
+    try:
+        from medicine_database import KNOWN_DRUGS
+    except ImportError:
+        KNOWN_DRUGS = set()
+
+logger = logging.getLogger(__name__)
+
+DOSE_CUE = re.compile(r'\b\d+(?:\.\d+)?\s*(?:mg|ml|mcg|gm|g|iu|units?|tablets?|capsules?|drops?|puffs?)\b',
+                      re.IGNORECASE)
+FREQUENCY_CUE = re.compile(
+    r'\b(?:once|twice|thrice|\d+\s*times?\s*(?:a|per)\s*day|daily|every\s+\d+\s*hours?|'
+    r'at night|before food|after food|od|bd|tds|qid|sos|murai)\b',
+    re.IGNORECASE
+)
+WORD = re.compile(r"[a-z][a-z\-]+")
+
+
+def count_medicine_cues(text: str) -> int:
+    """
+    Count medicine mentions: known drug names (one- and two-word), doses with units,
+    and frequency phrases. Linear in the transcript length (set lookups, no fuzzy matching).
+    """
+    words = WORD.findall(text.lower())
+    drugs = sum(1 for w in words if w in KNOWN_DRUGS)
+    drugs += sum(1 for a, b in zip(words, words[1:]) if f"{a} {b}" in KNOWN_DRUGS)
+    return drugs + len(DOSE_CUE.findall(text)) + len(FREQUENCY_CUE.findall(text))
+
+
+@dataclass
+class ComplexityEstimate:
+    """Size/complexity of one transcript and the tier chosen for it."""
+    tokens: int
+    medicine_cues: int
+    language: str
+    tier: str
+    model: str
+    reason: str
+
+
+class ModelTierSelector:
+    """
+    Chooses the small or large Groq model for a transcript.
+
+    small if ALL hold (thresholds configurable via env):
+        tokens        <= GROQ_SMALL_MAX_TOKENS
+        medicine cues <= GROQ_SMALL_MAX_MEDICINE_CUES
+        language      in GROQ_SMALL_LANGUAGES
+    """
+
+    def __init__(self, small_model: Optional[str] = None, large_model: Optional[str] = None):
+        self.enabled = os.getenv("GROQ_MODEL_TIERING", "true").lower() == "true"
+        self.small_model = small_model or os.getenv("GROQ_SMALL_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+        self.large_model = large_model or os.getenv("GROQ_LARGE_MODEL", "openai/gpt-oss-120b")
+        self.small_max_tokens = int(os.getenv("GROQ_SMALL_MAX_TOKENS", "600"))
+        self.small_max_medicine_cues = int(os.getenv("GROQ_SMALL_MAX_MEDICINE_CUES", "4"))
+        self.small_languages = {
+            lang.strip() for lang in os.getenv("GROQ_SMALL_LANGUAGES", "en").split(",") if lang.strip()
+        }
+
+    def select(self, transcript: str, language: Optional[str] = None) -> ComplexityEstimate:
+        """Estimate complexity and pick a tier (always 'large' when tiering is disabled)."""
+        tokens = estimate_tokens(transcript)
+        cues = count_medicine_cues(transcript)
+        language = language or "auto"
+
+        if not self.enabled:
+            tier, reason = "large", "tiering disabled"
+        elif tokens > self.small_max_tokens:
+            tier, reason = "large", f"{tokens} tokens > {self.small_max_tokens}"
+        elif cues > self.small_max_medicine_cues:
+            tier, reason = "large", f"{cues} medicine cues > {self.small_max_medicine_cues}"
+        elif language not in self.small_languages:
+            tier, reason = "large", f"language '{language}' needs the large model"
+        else:
+            tier, reason = "small", f"{tokens} tokens, {cues} medicine cues"
+
+        estimate = ComplexityEstimate(
+            tokens=tokens,
+            medicine_cues=cues,
+            language=language,
+            tier=tier,
+            model=self.small_model if tier == "small" else self.large_model,
+            reason=reason,
+        )
+        logger.info(f"[TIER] {tier} → {estimate.model} ({reason})")
+        return estimate
@@ -6,11 +6,17 @@ Handles:
 - Dosage normalization
 - Duplicate word removal
 - Frequency standardization
+- Repeated-phrase (hallucination loop) collapse
 """
 
 import logging
 import re
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List
+
+try:
+    from .prompt_builder import estimate_tokens
+except ImportError:
+    from prompt_builder import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -269,3 +275,106 @@ class TranscriptNormalizer:
                 deduped.append(word)
 
         return ' '.join(deduped)
+
+
+class RepetitionCollapser:
+    """
+    Collapse Whisper hallucination loops ("thank you thank you thank you ...",
+    "take the tablet take the tablet ...") to a single copy.
+
+    A run is a span of 1..max_ngram words repeated back to back at least
+    min_repeats times (compared case- and punctuation-insensitively); one copy is
+    kept, and the dropped copies are cut out of the original text so its line
+    breaks and spacing survive. Spans are
+    compared with a polynomial rolling hash over word ids, so each comparison is
+    O(1) and a scan is O(words x max_ngram) - linear in the transcript length.
+    Hash matches are confirmed word by word before anything is removed.
+    """
+
+    _MOD = (1 << 61) - 1
+    _BASE = 1_000_003
+    _PUNCT = re.compile(r"^\W+|\W+$")
+    _WORD = re.compile(r"\S+")
+
+    def __init__(self, min_repeats: int = 3, max_ngram: int = 16):
+        self.min_repeats = max(2, min_repeats)
+        self.max_ngram = max(1, max_ngram)
+
+    def collapse(self, text: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Collapse repeated runs.
+
+        Returns:
+            (collapsed_text, metadata) with runs, words_removed, chars_removed, tokens_removed
+        """
+        metadata = {'runs': 0, 'words_removed': 0, 'chars_removed': 0, 'tokens_removed': 0}
+        if not text or not isinstance(text, str):
+            return text, metadata
+
+        spans = [match.span() for match in self._WORD.finditer(text)]
+        words = [text[start:end] for start, end in spans]
+        ids = self._word_ids(words)
+        prefix, powers = self._prefix_hashes(ids)
+        n_words = len(words)
+
+        removed: List[Tuple[int, int]] = []  # Character spans of dropped copies (with their trailing space)
+        i = 0
+        while i < n_words:
+            best_n, best_copies = 0, 0
+            for n in range(1, min(self.max_ngram, (n_words - i) // self.min_repeats) + 1):
+                if ids[i + n] != ids[i]:  # Cheap reject: the next copy must start with the same word
+                    continue
+                copies = self._copies(ids, prefix, powers, i, n)
+                if copies >= self.min_repeats and (copies - 1) * n > (best_copies - 1) * best_n:
+                    best_n, best_copies = n, copies
+            if best_n:
+                # Drop all but the last copy and rescan from it: a loop that drifts into a
+                # longer phrase ("thank you. thank you. thank you for watching ...") is caught too
+                metadata['runs'] += 1
+                metadata['words_removed'] += (best_copies - 1) * best_n
+                next_i = i + (best_copies - 1) * best_n
+                removed.append((spans[i][0], spans[next_i][0]))
+                i = next_i
+            else:
+                i += 1
+
+        if not metadata['runs']:
+            return text, metadata
+
+        pieces, pos = [], 0
+        for start, end in removed:
+            pieces.append(text[pos:start])
+            pos = end
+        pieces.append(text[pos:])
+        result = ''.join(pieces)
+        metadata['chars_removed'] = len(text) - len(result)
+        metadata['tokens_removed'] = estimate_tokens(text) - estimate_tokens(result)
+        logger.info(f"[REPEAT] Collapsed {metadata['runs']} repeated runs: -{metadata['words_removed']} words, "
+                    f"-{metadata['chars_removed']} chars, ~-{metadata['tokens_removed']} tokens")
+        return result, metadata
+
+    def _word_ids(self, words: List[str]) -> List[int]:
+        """Small integer per distinct normalized word (lowercase, outer punctuation stripped)."""
+        vocabulary: Dict[str, int] = {}
+        return [vocabulary.setdefault(self._PUNCT.sub('', w.lower()) or w, len(vocabulary) + 1) for w in words]
+
+    def _prefix_hashes(self, ids: List[int]) -> Tuple[List[int], List[int]]:
+        prefix, powers = [0], [1]
+        for word_id in ids:
+            prefix.append((prefix[-1] * self._BASE + word_id) % self._MOD)
+            powers.append((powers[-1] * self._BASE) % self._MOD)
+        return prefix, powers
+
+    def _span_hash(self, prefix: List[int], powers: List[int], start: int, n: int) -> int:
+        return (prefix[start + n] - prefix[start] * powers[n]) % self._MOD
+
+    def _copies(self, ids: List[int], prefix: List[int], powers: List[int], start: int, n: int) -> int:
+        """How many times ids[start:start+n] repeats back to back from start."""
+        target = self._span_hash(prefix, powers, start, n)
+        copies = 1
+        pos = start + n
+        while pos + n <= len(ids) and self._span_hash(prefix, powers, pos, n) == target \
+                and ids[pos:pos + n] == ids[start:start + n]:
+            copies += 1
+            pos += n
+        return copies
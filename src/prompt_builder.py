@@ -0,0 +1,243 @@
+"""
+Prompt Builder Module: Language-conditional, cache-friendly extraction prompts.
+
+ExtractionPromptBuilder: Assembles the Groq extraction prompt from static sections
+estimate_tokens: Cheap token estimate used for budgeting before a request is sent
+
+CACHE-FRIENDLY LAYOUT:
+- All static instructions go first, in the system message
+- The consultation goes last, alone in the user message
+- Only the guidance blocks for the detected language are included, so every
+  request for the same language shares an identical (cacheable) prefix
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of text.
+
+    Uses tiktoken when installed; otherwise ~4 ASCII characters per token and
+    one token per non-ASCII character (Tamil/Arabic script tokenizes poorly).
+    """
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return len(_get_encoding().encode(text))
+        except Exception:
+            pass
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    non_ascii_chars = len(text) - ascii_chars
+    return math.ceil(ascii_chars / 4) + non_ascii_chars
+
+
+_ENCODING = None
+
+
+def _get_encoding():
+    """Lazily load the tiktoken encoding (shared across calls)."""
+    global _ENCODING
+    if _ENCODING is None:
+        _ENCODING = tiktoken.get_encoding("o200k_base")
+    return _ENCODING
+
+
+@dataclass
+class ExtractionPrompt:
+    """Chat messages for one extraction request plus their token budget."""
+    messages: List[Dict[str, str]]
+    language: str
+    sections: List[str] = field(default_factory=list)
+    system_tokens: int = 0
+    consultation_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.system_tokens + self.consultation_tokens
+
+
+class ExtractionPromptBuilder:
+    """
+    Builds the extraction prompt for a detected language.
+
+    System message = header + language blocks + rules + schema (static per language)
+    User message   = the consultation transcript (the only variable part)
+    """
+
+    HEADER = """You are a medical data extraction specialist. Extract prescription data from the medical consultation in the user message, in ANY LANGUAGE.
+
+⚠️ CRITICAL JSON FORMAT REQUIREMENTS:
+- You MUST return STRICTLY VALID JSON ONLY
+- Do NOT include markdown, code blocks, or explanations
+- Do NOT include comments
+- Do NOT use trailing commas
+- Ensure ALL strings are properly closed (no unterminated strings)
+- Output must begin with { and end with }
+- Escape special characters properly: \\" for quotes, \\\\ for backslashes
+
+📦 COMPACT JSON OUTPUT:
+- Return compact JSON only (no extra whitespace)
+- Do not include extra whitespace or newlines inside JSON
+- Keep advice concise (short, actionable strings max 100 chars)
+- Keep complaint and diagnosis strings concise
+- Minimize array/object nesting where possible
+- Output MUST begin with { and MUST end with }
+- All medicine names, diagnoses, and complaints MUST be in ENGLISH ONLY"""
+
+    LANGUAGE_BLOCKS = {
+        "english": """📍 ENGLISH CONSULTATION:
+- Extract directly. Diagnoses like: viral pharyngitis, bacterial infection, sinusitis, asthma, diabetes
+- Medicines: paracetamol, amoxicillin, levocetirizine, omeprazole, amlodipine
+- Frequency terms: "3 times a day", "once daily", "every 8 hours", "at night\"""",
+
+        "tamil": """📍 TAMIL/THANGLISH CONSULTATION (Tamil words in English letters):
+- 'noi' = disease, 'marunthu' = medicine, 'vali' = pain, 'kaichal'/'kayachel'/'kaiachel' = fever
+- 'irukku' = has/is, 'irundha' = if there is, 'varaam'/'varum' = may occur
+- 'daily X murai' or 'daily X times' = X times a day
+- 'food apram'/'saptu patthu' = after food, 'iravu'/'night time' = at night
+- 'nalla vali' = severe pain, 'slight vali' = mild pain
+- 'mookkadaippu' = nasal congestion, 'sinus vali' = sinusitis
+- Medicines: aspirin = 'aspirin', paracetamol = 'paracetamol'/'para', amoxicillin = 'amox'/'amoxycillin'
+- Amount: '500 mg' = '500 milligram', 'oru tablet' = '1 tablet', 'rendu tablet' = '2 tablets'
+- 'kammi panna' = reduce/do less, 'confirm panna' = diagnose/confirm""",
+
+        "arabic": """📍 ARABIC CONSULTATION:
+- 'مرض'/'marad' = disease, 'دواء'/'dawa' = medicine, 'ألم'/'alam' = pain, 'حمى'/'humma' = fever
+- 'صداع'/'sudaa' = headache, 'سعال'/'suaal' = cough, 'إسهال'/'ishal' = diarrhea
+- 'عدوى بكتيرية'/'adwa bakteriya' = bacterial infection, 'التهاب الحلق'/'iltiab alhalq' = pharyngitis
+- Frequency: 'مرات في اليوم'/'marat fi alyawm' = times a day, 'ثلاث مرات'/'talat marat' = 3 times
+- Duration: 'أيام'/'ayyam' = days, 'أسبوع'/'usbua' = week
+- Instructions: 'بعد الأكل'/'baada alakl' = after food, 'قبل النوم'/'qabl alnawm' = before sleep
+- Medicines in Arabic: 'الأسبرين'/'aspireen', 'الباراسيتامول'/'paracetamol', 'الأموكسيسيللين'/'amoxicillin'""",
+    }
+
+    # Detected language → guidance blocks to include (English block is the common base).
+    # LanguageDetector only tells Tamil/Thanglish apart and labels everything else 'en'
+    # (Arabic included), so 'en' keeps the Arabic block; only the Tamil block is safe to drop.
+    LANGUAGE_SECTIONS = {
+        "en": ("english", "arabic"),
+        "ta": ("english", "tamil"),
+        "tanglish": ("english", "tamil"),
+        "ar": ("english", "arabic"),
+    }
+    DEFAULT_SECTIONS = ("english", "tamil", "arabic")  # Unknown language → include everything
+
+    RULES = """IMPORTANT EXTRACTION RULES:
+- ALWAYS translate/convert medicine names, diagnoses, and complaints to ENGLISH EQUIVALENTS
+- For ambiguous terms, use medical context to determine meaning
+- If text is very unclear, return null rather than guessing
+- Recognize common ASR artifacts: 'inflection'→'infection', 'paragenesis'→'pharyngitis', 'antibiotic risk'→'antibiotics'
+- Patient names should be extracted as given (can be local language), but all clinical data MUST be ENGLISH"""
+
+    SCHEMA = """Return JSON with these exact keys (NO OTHER TEXT, NO EXPLANATIONS):
+{
+  "patient_name": "string or null",
+  "age": null,
+  "complaints": ["fever", "throat pain"],
+  "diagnosis": ["viral pharyngitis"],
+  "medicines": [
+    {
+      "name": "paracetamol",
+      "dose": "500 mg",
+      "frequency": "3 times a day",
+      "duration": "5 days",
+      "instruction": "after food"
+    },
+    {
+      "name": "levocetirizine",
+      "dose": "5 mg",
+      "frequency": "once a day",
+      "duration": "5 days",
+      "instruction": "at night"
+    }
+  ],
+  "tests": [],
+  "advice": ["avoid cold drinks", "drink warm water", "rest adequately"]
+}"""
+
+    FIELD_RULES = """EXTRACTION RULES:
+- Return ONLY valid JSON, nothing else
+- Capture ALL medicines mentioned: including tablets, sprays, lozenges, and supplements.
+- Patient name: Extract ONCE, no duplicates (e.g. "Hi Rohit, Rohit..." → "Rohit")
+- Complaints: Specific symptoms mentioned (fever, throat pain, cough, etc.)
+- Diagnosis: Medical conditions (viral pharyngitis, bacterial infection, etc.)
+- Medicines: Only prescribed items with best available information
+  * name: medicine name (e.g., "levocetirizine")
+  * dose: include units (mg, ml, mcg, gm, iu, tablet, capsule, sprays, lozenge)
+  * frequency: times per day (e.g., "once a day", "2 times a day", "every 6-8 hours")
+  * duration: days/weeks (e.g., "5 days") - capture if mentioned per medicine
+  * instruction: timing/method ("after food", "at night", "topical", "as needed")
+- Tests: Capture ALL lab tests/investigations mentioned. Common ones:
+  * "CBC" = Complete Blood Count
+  * "CRP" = C-Reactive Protein
+  * "X-ray PNS" or "PNS x-ray" = Paranasal Sinus X-ray
+  * "nasal swab" = nasal swab culture
+  * Include any blood test, imaging, or culture mentioned
+- Advice: Patient guidance strings in English (translate Thanglish to English if needed)
+
+Output ONLY the JSON object. No markdown. No code blocks. No explanations."""
+
+    CONSULTATION_HEADER = "Medical Consultation:\n"
+
+    def __init__(self):
+        # sections tuple → (system prompt, token count); built once, reused verbatim
+        self._system_cache: Dict[Tuple[str, ...], Tuple[str, int]] = {}
+
+    def build(self, transcript: str, language: Optional[str] = None) -> ExtractionPrompt:
+        """
+        Build chat messages for an extraction request.
+
+        Args:
+            transcript: Consultation text
+            language:   Detected language ('en', 'ta', 'tanglish', 'ar'); None → all blocks
+
+        Returns:
+            ExtractionPrompt with messages and token estimates
+        """
+        sections = self.LANGUAGE_SECTIONS.get(language, self.DEFAULT_SECTIONS)
+        system_prompt, system_tokens = self._system_prompt(sections)
+        user_content = self.CONSULTATION_HEADER + transcript
+
+        prompt = ExtractionPrompt(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content},
+            ],
+            language=language or "auto",
+            sections=list(sections),
+            system_tokens=system_tokens,
+            consultation_tokens=estimate_tokens(user_content),
+        )
+
+        logger.info(f"[PROMPT] lang={prompt.language} sections={'+'.join(sections)} "
+                    f"tokens≈{prompt.total_tokens} (system {prompt.system_tokens}, "
+                    f"consultation {prompt.consultation_tokens})")
+        return prompt
+
+    def _system_prompt(self, sections: Tuple[str, ...]) -> Tuple[str, int]:
+        """Assemble (and memoize) the static system prompt for a set of language blocks."""
+        cached = self._system_cache.get(sections)
+        if cached:
+            return cached
+
+        parts = [self.HEADER, "🌍 MULTILINGUAL SUPPORT - CRITICAL EXTRACTION RULES:"]
+        parts.extend(self.LANGUAGE_BLOCKS[name] for name in sections)
+        parts.extend([self.RULES, self.SCHEMA, self.FIELD_RULES])
+        system_prompt = "\n\n".join(parts)
+
+        cached = (system_prompt, estimate_tokens(system_prompt))
+        self._system_cache[sections] = cached
+        return cached
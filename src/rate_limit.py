@@ -0,0 +1,233 @@
+"""
+Rate Limit Module: Client-side throttling for Groq requests.
+
+TokenBucket: Continuous-refill bucket (capacity + refill rate)
+RateLimiter: Separate request and token budgets, adapted from provider rate-limit
+             headers, with a global pause after 429 responses
+backoff_delay: Exponential backoff with jitter (honours Retry-After)
+
+Groq reports limits on every response:
+    x-ratelimit-limit-tokens / x-ratelimit-remaining-tokens / x-ratelimit-reset-tokens
+    x-ratelimit-remaining-requests / x-ratelimit-reset-requests
+and sends retry-after with 429s.
+"""
+
+import os
+import re
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parse a reset duration ('7.66s', '2m59.56s', '120ms', '1h2m3s', '30') into seconds."""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    scale = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base_sec: float = 0.5, cap_sec: float = 30.0) -> float:
+    """
+    Delay before retry number `attempt` (0-based).
+
+    Full jitter over an exponential window; never earlier than Retry-After, with a
+    little jitter on top so throttled workers do not retry in lockstep.
+    """
+    window = min(cap_sec, base_sec * (2 ** attempt))
+    delay = random.uniform(0, window)
+    if retry_after:
+        delay = retry_after + random.uniform(0, base_sec)
+    return delay
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether an SDK exception is an HTTP 429."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after_from(error: Exception) -> Optional[float]:
+    """Retry-After seconds from an SDK exception's response headers (None if absent)."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return parse_reset(headers.get("retry-after"))
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket with continuous refill.
+
+    capacity:       Maximum burst
+    refill_per_sec: Sustained rate
+    A capacity of 0 means unlimited (no throttling).
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float, clock=time.monotonic):
+        self.clock = clock
+        self.capacity = float(capacity)
+        self.refill_per_sec = float(refill_per_sec)
+        self.tokens = float(capacity)
+        self._updated = clock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.refill_per_sec)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if available now)."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)  # A single oversized request waits for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        if self.refill_per_sec <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.refill_per_sec
+
+    def consume(self, amount: float) -> None:
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def set_limit(self, capacity: float, refill_per_sec: float) -> None:
+        """Change capacity/rate, keeping the current level (capped at the new capacity)."""
+        self._refill()
+        was_unlimited = self.unlimited
+        self.capacity = float(capacity)
+        self.refill_per_sec = float(refill_per_sec)
+        self.tokens = self.capacity if was_unlimited else min(self.tokens, self.capacity)
+
+    def set_available(self, tokens: float) -> None:
+        """Lower the level to what the provider reports as remaining."""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens = min(self.tokens, float(tokens))
+
+
+@dataclass
+class RateLimitStats:
+    """Cumulative counters (diff two snapshots to get per-batch numbers)."""
+    requests: int = 0
+    tokens_reserved: int = 0
+    throttle_events: int = 0       # Acquires that had to wait
+    throttled_sec: float = 0.0     # Total time spent waiting
+    rate_limited: int = 0          # 429 responses
+    header_updates: int = 0
+
+
+class RateLimiter:
+    """
+    Request and token budgets shared by every thread using one extractor.
+
+    acquire(tokens) blocks until both budgets allow the request. Provider headers
+    tighten the budgets (remaining tokens/requests); a 429 pauses everyone until
+    Retry-After has passed.
+    """
+
+    def __init__(self, requests_per_window: int = 0, window_sec: float = 60.0,
+                 tokens_per_minute: int = 0, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = TokenBucket(requests_per_window, requests_per_window / window_sec if window_sec else 0, clock)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0, clock)
+        self.stats = RateLimitStats()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Budgets from GROQ_RATE_LIMIT / GROQ_RATE_WINDOW_SECONDS / GROQ_TOKENS_PER_MINUTE (0 = until headers say)."""
+        return cls(
+            requests_per_window=int(os.getenv("GROQ_RATE_LIMIT", "0") or 0),
+            window_sec=float(os.getenv("GROQ_RATE_WINDOW_SECONDS", "60") or 60),
+            tokens_per_minute=int(os.getenv("GROQ_TOKENS_PER_MINUTE", "0") or 0),
+        )
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request of `tokens` fits both budgets. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = max(self._paused_until - self.clock(),
+                           self.requests.wait_time(1),
+                           self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    self.stats.requests += 1
+                    self.stats.tokens_reserved += tokens
+                    if waited:
+                        self.stats.throttle_events += 1
+                        self.stats.throttled_sec += waited
+                    return waited
+            if waited == 0:
+                logger.info(f"[RATE] Throttling: waiting {wait:.2f}s for budget ({tokens} tokens)")
+            wait = min(wait, 60.0)  # Re-check periodically (headers may loosen the budget)
+            self.sleep(wait)
+            waited += wait
+
+    def update_from_headers(self, headers: Mapping[str, Any]) -> None:
+        """Adapt budgets from x-ratelimit-* response headers."""
+        if not headers:
+            return
+        with self._lock:
+            limit_tokens = _to_float(headers.get("x-ratelimit-limit-tokens"))
+            if limit_tokens and limit_tokens != self.tokens.capacity:
+                self.tokens.set_limit(limit_tokens, limit_tokens / 60.0)
+
+            remaining_tokens = _to_float(headers.get("x-ratelimit-remaining-tokens"))
+            if remaining_tokens is not None:
+                self.tokens.set_available(remaining_tokens)
+
+            remaining_requests = _to_float(headers.get("x-ratelimit-remaining-requests"))
+            if remaining_requests is not None and remaining_requests <= 0:
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self._paused_until = max(self._paused_until, self.clock() + reset)
+                    logger.warning(f"[RATE] Request quota exhausted - pausing {reset:.1f}s")
+            self.stats.header_updates += 1
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """Record a 429 and pause all callers until Retry-After has passed."""
+        with self._lock:
+            self.stats.rate_limited += 1
+            if retry_after:
+                self._paused_until = max(self._paused_until, self.clock() + retry_after)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return asdict(self.stats)
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
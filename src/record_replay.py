@@ -0,0 +1,277 @@
+"""
+Record/Replay Module: Offline, deterministic runs of the Whisper and Groq calls.
+
+wrap_client: Wraps an OpenAI/Groq client according to VOICE_RX_REPLAY_MODE
+FixtureStore: Content-addressed store of recorded request/response pairs
+RecordReplayClient: Proxy that records or replays every API call made through it
+RecordingStream: Live stream proxy that records chunks as they pass through
+
+MODES (VOICE_RX_REPLAY_MODE):
+- off:    Real client, nothing recorded (default)
+- record: Real client; every request/response is written to the fixture store
+- replay: No network; responses are served from the fixture store
+          (VOICE_RX_REPLAY_LATENCY=true also sleeps for the recorded latency)
+
+A fixture key is the SHA-256 of the service, the call path (e.g.
+chat.completions.create) and the canonical JSON of its arguments. Uploaded audio
+files are keyed by content hash, so the same file under another path still
+matches. Streamed completions are recorded chunk by chunk, with time offsets.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "fixtures")
+
+
+def replay_mode() -> str:
+    """Current record/replay mode from VOICE_RX_REPLAY_MODE."""
+    mode = os.getenv("VOICE_RX_REPLAY_MODE", MODE_OFF).strip().lower()
+    return mode if mode in (MODE_RECORD, MODE_REPLAY) else MODE_OFF
+
+
+class FixtureNotFoundError(LookupError):
+    """Replay mode found no recording for a request."""
+
+
+class ReplayedAPIError(Exception):
+    """An API error that was recorded and is now replayed (keeps status_code for retry logic)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, error_type: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+
+
+class FixtureStore:
+    """Recorded exchanges as <root>/<key[:2]>/<key>.json."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or os.getenv("VOICE_RX_FIXTURES_DIR", DEFAULT_FIXTURES_DIR))
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Dict]:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, key: str, record: Dict) -> None:
+        path = self.path(key)
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f, indent=2, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp, path)
+
+
+def request_key(service: str, call_path: str, kwargs: Dict) -> str:
+    """Content address of one API request."""
+    canonical = json.dumps({"service": service, "call": call_path, "kwargs": _canonical(kwargs)},
+                           sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _canonical(value: Any) -> Any:
+    """JSON-safe form of request arguments; file objects become their content hash."""
+    if hasattr(value, "read") and hasattr(value, "seek"):
+        position = value.tell()
+        digest = hashlib.sha256(value.read()).hexdigest()
+        value.seek(position)
+        return {"file_sha256": digest}
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def _dump(response: Any) -> Any:
+    """Plain data from an SDK response object (pydantic models, namespaces, primitives)."""
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    if hasattr(response, "to_dict"):
+        return response.to_dict()
+    if isinstance(response, SimpleNamespace):
+        return {k: _dump(v) for k, v in vars(response).items()}
+    if isinstance(response, dict):
+        return {k: _dump(v) for k, v in response.items()}
+    if isinstance(response, (list, tuple)):
+        return [_dump(v) for v in response]
+    return response
+
+
+def _load(data: Any) -> Any:
+    """Attribute-access view of recorded data (response.text, chunk.choices[0].delta.content)."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: _load(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [_load(v) for v in data]
+    return data
+
+
+class RecordReplayClient:
+    """
+    Proxy around an SDK client. Attribute access builds the call path
+    (client.chat.completions.create); calling it records or replays.
+    """
+
+    def __init__(self, client: Any, service: str, mode: str, store: FixtureStore,
+                 replay_latency: bool = False, _path: str = ""):
+        self._client = client
+        self._service = service
+        self._mode = mode
+        self._store = store
+        self._replay_latency = replay_latency
+        self._path = _path
+
+    def __getattr__(self, name: str) -> "RecordReplayClient":
+        target = getattr(self._client, name) if self._client is not None else None
+        path = f"{self._path}.{name}" if self._path else name
+        return RecordReplayClient(target, self._service, self._mode, self._store,
+                                  self._replay_latency, path)
+
+    def __call__(self, *args, **kwargs):
+        if args:
+            raise TypeError(f"{self._path}: record/replay supports keyword arguments only")
+        key = request_key(self._service, self._path, kwargs)
+        if self._mode == MODE_REPLAY:
+            return self._replay(key, kwargs)
+        return self._record(key, kwargs)
+
+    # ── Replay ────────────────────────────────────────────────────────────────
+
+    def _replay(self, key: str, kwargs: Dict):
+        record = self._store.load(key)
+        if record is None:
+            raise FixtureNotFoundError(
+                f"No {self._service} fixture for {self._path} (key {key[:12]}, "
+                f"model={kwargs.get('model')}) in {self._store.root}"
+            )
+        logger.debug(f"[REPLAY] {self._service}.{self._path} ← {key[:12]}")
+
+        if record.get("stream"):
+            return self._replay_stream(record)
+        if self._replay_latency:
+            time.sleep(record.get("latency_sec", 0.0))
+        if "error" in record:
+            error = record["error"]
+            raise ReplayedAPIError(error.get("message", ""), error.get("status_code"), error.get("type", ""))
+        return _load(record["response"])
+
+    def _replay_stream(self, record: Dict) -> Iterator[Any]:
+        start = time.monotonic()
+        for chunk in record["chunks"]:
+            if self._replay_latency:
+                delay = chunk["offset_sec"] - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield _load(chunk["data"])
+
+    # ── Record ────────────────────────────────────────────────────────────────
+
+    def _record(self, key: str, kwargs: Dict):
+        request = _canonical(kwargs)
+        start = time.monotonic()
+        try:
+            response = self._client(**kwargs)
+        except Exception as e:
+            if self._mode == MODE_RECORD:
+                self._store.save(key, {
+                    "service": self._service, "call": self._path, "request": request,
+                    "latency_sec": round(time.monotonic() - start, 4),
+                    "error": {"type": type(e).__name__, "message": str(e),
+                              "status_code": getattr(e, "status_code", None)},
+                })
+            raise
+
+        if self._mode != MODE_RECORD:
+            return response
+        if kwargs.get("stream"):
+            return RecordingStream(response, lambda chunks: self._store.save(key, {
+                "service": self._service, "call": self._path, "request": request, "stream": True,
+                "latency_sec": round(time.monotonic() - start, 4), "chunks": chunks,
+            }), start)
+
+        self._store.save(key, {
+            "service": self._service, "call": self._path, "request": request,
+            "latency_sec": round(time.monotonic() - start, 4),
+            "response": _dump(response),
+        })
+        return response
+
+
+class RecordingStream:
+    """
+    Proxy around a live SDK stream: chunks pass through as they arrive and are
+    handed to on_complete once the stream is exhausted (a stream closed early is
+    not saved). Everything else - .response (rate-limit headers), close() (hedge
+    cancellation) - reaches the real stream.
+    """
+
+    def __init__(self, stream: Any, on_complete: Callable[[List[Dict]], None], start: float):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._on_complete = on_complete
+        self._start = start
+        self._chunks: List[Dict] = []
+        self._saved = False
+
+    def __iter__(self) -> "RecordingStream":
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            if not self._saved:
+                self._saved = True
+                self._on_complete(self._chunks)
+            raise
+        self._chunks.append({"offset_sec": round(time.monotonic() - self._start, 4), "data": _dump(chunk)})
+        return chunk
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def wrap_client(client: Any, service: str, mode: Optional[str] = None,
+                store: Optional[FixtureStore] = None) -> Any:
+    """
+    Wrap an SDK client for the current record/replay mode.
+
+    Returns the client unchanged when the mode is off. In replay mode `client` may
+    be None (no SDK or API key needed).
+    """
+    mode = mode or replay_mode()
+    if mode == MODE_OFF:
+        return client
+    store = store or FixtureStore()
+    replay_latency = os.getenv("VOICE_RX_REPLAY_LATENCY", "false").lower() == "true"
+    logger.info(f"[REPLAY] {service} client in {mode} mode (fixtures: {store.root})")
+    return RecordReplayClient(client, service, mode, store, replay_latency)
@@ -0,0 +1,243 @@
+"""
+Reporting Module: Where MedicalSystem.process reports progress.
+
+Reporter: Base sink - ignores everything (also the 'null' sink)
+ConsoleReporter: Human-readable banners, transcript samples and prescription JSON (CLI)
+EventReporter: One structured JSON log line per stage and per request (server)
+make_reporter: Sink by name ('console' | 'null' | 'events'), e.g. from VOICE_RX_REPORTER
+
+The pipeline passes raw objects (TranscriptionResult, Prescription, ...) to
+report(); only ConsoleReporter turns them into text, so the null and event sinks
+do no formatting work on the request path. EventReporter never logs transcript
+or prescription content - only names, counts and timings.
+"""
+
+import json
+import logging
+from typing import Any, Dict, Optional
+
+try:
+    from .stages import StageResult, SKIPPED
+except ImportError:
+    from stages import StageResult, SKIPPED
+
+logger = logging.getLogger(__name__)
+event_logger = logging.getLogger("voice_rx.events")
+
+
+class Reporter:
+    """Sink for pipeline progress; the base class discards everything."""
+
+    def report(self, event: str, **data: Any) -> None:
+        """Progress event from a pipeline stage (objects, not formatted text)."""
+
+    def stage_finished(self, result: StageResult) -> None:
+        """A pipeline stage finished (or was skipped)."""
+
+    def request_finished(self, prescription_id: Optional[int], metrics: Any) -> None:
+        """A request completed; metrics is its ExtractionMetrics."""
+
+
+class ConsoleReporter(Reporter):
+    """Prints the step-by-step console report used by the CLI."""
+
+    def report(self, event: str, **data: Any) -> None:
+        handler = getattr(self, f"_on_{event}", None)
+        if handler:
+            handler(**data)
+
+    @staticmethod
+    def _on_start() -> None:
+        print("\n" + "=" * 80)
+        print("MEDICAL CONSULTATION EXTRACTION - GROQ-FIRST SYSTEM")
+        print("=" * 80)
+
+    @staticmethod
+    def _on_transcribing(language: Optional[str]) -> None:
+        lang_label = f"forced='{language}'" if language else "auto-detect"
+        print(f"\n[1/7] SPEECH RECOGNITION (Whisper multilingual, {lang_label})")
+        print("-" * 80)
+
+    @staticmethod
+    def _on_transcribed(tx_result: Any) -> None:
+        transcript = tx_result.text
+        tier_label = {1: "base (multilingual, auto-detect)", 2: "base (multilingual, with hint)", 3: "medium (multilingual, escalated)"}.get(
+            tx_result.transcription_tier, str(tx_result.transcription_tier)
+        )
+        print(f"Model: Whisper {tier_label}")
+        print(f"Mode: transcribe (native multilingual ASR)")
+        print(f"Raw length: {len(transcript)} chars")
+        try:
+            print(f"Raw transcript: {transcript[:100]}...")
+        except UnicodeEncodeError:
+            print(f"Raw transcript: [Non-ASCII text]")
+        print(f"Confidence: {tx_result.confidence:.0%}")
+        audio_detected_lang = tx_result.detected_language or "en"
+        print(f"Audio-detected language: {audio_detected_lang.upper()} (Whisper raw: {tx_result.whisper_language})\n")
+
+    @staticmethod
+    def _on_cleaned(transcript: str, was_modified: bool) -> None:
+        print("[2/7] TRANSCRIPT CLEANING (ASR distortion fixes)")
+        print("-" * 80)
+        print(f"Cleaning applied: {'Yes' if was_modified else 'No'}")
+        print(f"Cleaned length: {len(transcript)} chars")
+        if was_modified and len(transcript) < 200:
+            print(f"Cleaned transcript: {transcript}")
+        else:
+            print(f"Cleaned (sample): {transcript[:100]}...")
+        print()
+
+    @staticmethod
+    def _on_language_detected(audio_lang: str, text_lang: str, lang_code: str, lang_metadata: Dict) -> None:
+        print("[3/7] LANGUAGE DETECTION")
+        print("-" * 80)
+        print(f"Audio-level: {audio_lang.upper()}")
+        print(f"Text-level:  {text_lang.upper()}")
+        print(f"Final:       {lang_code.upper()} (confidence: {lang_metadata.get('confidence', 0.0):.0%})")
+        if 'reason' in lang_metadata:
+            print(f"Reason: {lang_metadata['reason']}")
+        print()
+
+    @staticmethod
+    def _on_thanglish_normalized(transcript: str, was_normalized: bool) -> None:
+        print("[4/7] THANGLISH NORMALIZATION")
+        print("-" * 80)
+        print(f"Thanglish normalized: {was_normalized}")
+        print(f"Normalized (sample): {transcript[:100]}...")
+        print()
+
+    @staticmethod
+    def _on_normalized(transcript: str, norm_steps: list, repeat_metadata: Dict) -> None:
+        print("[5/7] TRANSCRIPT NORMALIZATION (ASR fixes, dosage standardization)")
+        print("-" * 80)
+        print(f"Normalization steps applied: {len(norm_steps)}")
+        if norm_steps and len(norm_steps) <= 5:
+            for step in norm_steps:
+                print(f"  - {step}")
+        elif norm_steps:
+            print(f"  - {norm_steps[0]}")
+            print(f"  - ... ({len(norm_steps)-2} more steps)")
+            print(f"  - {norm_steps[-1]}")
+        if repeat_metadata['runs']:
+            print(f"Repeated runs collapsed: {repeat_metadata['runs']} "
+                  f"(-{repeat_metadata['chars_removed']} chars, ~-{repeat_metadata['tokens_removed']} tokens)")
+        print(f"Normalized (sample): {transcript[:100]}...")
+        print()
+
+    @staticmethod
+    def _on_routing() -> None:
+        print("[6/7] GROQ-FIRST ROUTING & EXTRACTION")
+        print("-" * 80)
+
+    @staticmethod
+    def _on_corrupted_audio(output: Dict) -> None:
+        print(f"Route: {output['route'].upper()}")
+        print("Status: Audio quality too poor - cannot extract prescription")
+        print("\n[7/7] VALIDATION (SKIPPED)")
+        print("-" * 80)
+        print("Status: Audio appears corrupted or missing")
+        print(json.dumps({key: output[key] for key in
+                          ("patient_name", "complaints", "diagnosis", "medicines", "tests", "advice")},
+                         indent=2, ensure_ascii=False))
+
+    @staticmethod
+    def _on_routed(route: str) -> None:
+        print(f"Route: {route.upper()}")
+        print(f"Extraction method: {'Groq (primary)' if route == 'groq_only' else 'Groq + Rules (voting)' if route == 'ensemble' else 'Rules-only (fallback)'}")
+
+    @staticmethod
+    def _on_compacted(compaction: Any) -> None:
+        if compaction.applied:
+            print(f"Compaction: kept {compaction.kept_sentences}/{compaction.total_sentences} sentences "
+                  f"({compaction.kept_ratio:.0%} of tokens, -{compaction.tokens_saved})")
+
+    @staticmethod
+    def _on_extracted(extract_result: Dict, prescription: Any) -> None:
+        provisional = extract_result.get('provisional', False)
+        print(f"Extraction method: {extract_result['method'].upper()}{' (PROVISIONAL - deadline missed)' if provisional else ''}")
+        print(f"Patient name: {prescription.patient_name}")
+        print(f"Diagnosis: {len(prescription.diagnosis)} found")
+        print(f"Medicines: {len(prescription.medicines)} found\n")
+
+    @staticmethod
+    def _on_validated(is_valid: bool, errors: list, warnings: list) -> None:
+        print("[7/7] VALIDATION")
+        print("-" * 80)
+        if errors:
+            print("❌ ERRORS:")
+            for error in errors:
+                print(f"  {error}")
+        if warnings:
+            print("⚠️  WARNINGS:")
+            for warning in warnings:
+                clean = warning.encode('ascii', errors='ignore').decode('ascii').strip()
+                if clean:
+                    print(f"  {clean}")
+        if is_valid:
+            print("✅ Validation passed\n")
+        else:
+            print("⚠️  Validation completed with errors - but returning data anyway\n")
+
+    @staticmethod
+    def _on_saved(prescription: Any, prescription_id: Optional[int]) -> None:
+        print("=" * 80)
+        print("PRESCRIPTION EXTRACTED & VALIDATED")
+        print("=" * 80)
+        output = {
+            "patient_name": prescription.patient_name,
+            "complaints": prescription.complaints,
+            "diagnosis": prescription.diagnosis,
+            "medicines": prescription.medicines,
+            "tests": prescription.tests,
+            "advice": prescription.advice
+        }
+        print(json.dumps(output, indent=2, ensure_ascii=False))
+        print(f"\nSaved to database (ID: {prescription_id})")
+
+
+class EventReporter(Reporter):
+    """Structured JSON log lines (logger 'voice_rx.events'); no patient content."""
+
+    def stage_finished(self, result: StageResult) -> None:
+        if not event_logger.isEnabledFor(logging.INFO):
+            return
+        event = {"event": "stage", "stage": result.name, "status": result.status}
+        if result.status != SKIPPED:
+            event["duration_ms"] = round(result.duration_sec * 1000, 1)
+        if result.error:
+            event["error"] = result.error[:200]
+        event_logger.info(json.dumps(event))
+
+    def request_finished(self, prescription_id: Optional[int], metrics: Any) -> None:
+        if not event_logger.isEnabledFor(logging.INFO):
+            return
+        event_logger.info(json.dumps({
+            "event": "request",
+            "prescription_id": prescription_id,
+            "route": metrics.routing_decision,
+            "method": metrics.extraction_method,
+            "language": metrics.detected_language,
+            "medicines": metrics.medicines_extracted,
+            "diagnoses": metrics.diagnosis_extracted,
+            "valid": metrics.validation_passed,
+            "provisional": metrics.provisional,
+            "processing_ms": round(metrics.processing_time_sec * 1000, 1),
+            "cost_usd": round(metrics.cost_usd, 6),
+            "stages_ms": {name: round(sec * 1000, 1) for name, sec in metrics.stage_timings.items()},
+        }))
+
+
+REPORTERS = {
+    "console": ConsoleReporter,
+    "null": Reporter,
+    "events": EventReporter,
+}
+
+
+def make_reporter(name: Optional[str]) -> Reporter:
+    """Reporter by name (console | null | events); unknown names fall back to console."""
+    key = (name or "console").strip().lower()
+    if key not in REPORTERS:
+        logger.warning(f"[REPORT] Unknown reporter '{name}' - using console")
+        key = "console"
+    return REPORTERS[key]()
@@ -0,0 +1,192 @@
+"""
+Session Registry Module: Concurrent live consultations, one recording per session.
+
+RecordingSession: One consultation being recorded (audio buffer, byte count, activity)
+SessionRegistry: Thread-safe map of session id → RecordingSession
+SessionLimitError: No room for another session (max_sessions reached)
+
+Each session buffers the audio uploaded for it (POST chunks as the browser
+records them) in a SpooledTemporaryFile: up to spool_bytes stay in memory, the
+rest goes to a temporary file, so memory is bounded by max_sessions × spool_bytes
+however long the consultations run. A session also caps its total size
+(max_session_bytes). stop() writes the audio to audio_dir and removes the session.
+
+Sessions not touched for idle_timeout_sec (doctor closed the tab, network gone)
+are reaped - by every start(), or by reap_idle() - and their buffers are freed.
+One lock guards the map; each session has its own lock, so uploads to different
+sessions do not wait for each other.
+
+    registry = SessionRegistry("data/audio", max_sessions=64, idle_timeout_sec=900)
+    session = registry.start()
+    registry.append(session.id, chunk)
+    audio_path = registry.stop(session.id)
+"""
+
+import re
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RECORDING = "recording"
+STOPPED = "stopped"
+EXPIRED = "expired"
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")  # Ids become part of the audio file name
+
+
+class SessionLimitError(RuntimeError):
+    """No room for another session."""
+
+
+class RecordingSession:
+    """One consultation being recorded."""
+
+    def __init__(self, session_id: str, audio_file: str, spool_bytes: int, max_bytes: int, now: float):
+        self.id = session_id
+        self.audio_file = audio_file
+        self.started_at = datetime.now().isoformat()
+        self.status = RECORDING
+        self.bytes_received = 0
+        self.chunks = 0
+        self.last_activity = now
+        self.max_bytes = max_bytes
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._lock = threading.Lock()
+
+    def append(self, chunk: bytes, now: float) -> int:
+        """Buffer an audio chunk; returns the session's total bytes"""
+        with self._lock:
+            if self.status != RECORDING:
+                raise ValueError(f"Session {self.id} is {self.status}")
+            if self.bytes_received + len(chunk) > self.max_bytes:
+                raise ValueError(f"Session {self.id} exceeds {self.max_bytes} bytes of audio")
+            self._buffer.write(chunk)
+            self.bytes_received += len(chunk)
+            self.chunks += 1
+            self.last_activity = now
+            return self.bytes_received
+
+    def finish(self, status: str) -> Optional[str]:
+        """
+        Stop recording and free the buffer. With status STOPPED, buffered audio is
+        written to audio_file; returns audio_file if it exists (uploaded chunks, or a
+        file written there by an external recorder), else None.
+        """
+        with self._lock:
+            if self.status != RECORDING:
+                raise ValueError(f"Session {self.id} is {self.status}")
+            self.status = status
+            try:
+                if status == STOPPED and self.bytes_received:
+                    self._buffer.seek(0)
+                    with open(self.audio_file, "wb") as f:
+                        shutil.copyfileobj(self._buffer, f)
+            finally:
+                self._buffer.close()
+        return self.audio_file if status == STOPPED and Path(self.audio_file).exists() else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"session_id": self.id, "status": self.status, "is_recording": self.status == RECORDING,
+                "audio_file": self.audio_file, "start_time": self.started_at,
+                "bytes_received": self.bytes_received, "chunks": self.chunks}
+
+
+class SessionRegistry:
+    """Thread-safe registry of live recording sessions."""
+
+    def __init__(self, audio_dir: str, max_sessions: int = 64, idle_timeout_sec: float = 900.0,
+                 max_session_bytes: int = 200 * 1024 * 1024, spool_bytes: int = 1024 * 1024,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            audio_dir:         Where stopped sessions' audio is written
+            max_sessions:      Concurrent sessions (start() beyond this raises SessionLimitError)
+            idle_timeout_sec:  A session without uploads or status checks for this long is reaped
+            max_session_bytes: Audio cap per session
+            spool_bytes:       Audio kept in memory per session before spilling to a temp file
+        """
+        self.audio_dir = Path(audio_dir)
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        self.max_sessions = max_sessions
+        self.idle_timeout_sec = idle_timeout_sec
+        self.max_session_bytes = max_session_bytes
+        self.spool_bytes = spool_bytes
+        self.clock = clock
+        self._sessions: Dict[str, RecordingSession] = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id: Optional[str] = None, suffix: str = ".wav") -> RecordingSession:
+        """Open a session (new id unless given; suffix = audio format); reaps idle sessions first"""
+        session_id = session_id or uuid.uuid4().hex
+        if not SESSION_ID_PATTERN.match(session_id) or not re.match(r"^\.[A-Za-z0-9]{1,8}$", suffix):
+            raise ValueError("Invalid session id or audio format")
+        self.reap_idle()
+        with self._lock:
+            if session_id in self._sessions:
+                raise ValueError(f"Session {session_id} already exists")
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionLimitError(f"{self.max_sessions} consultations already in progress")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            audio_file = self.audio_dir / f"consultation_{timestamp}_{session_id}{suffix}"
+            session = RecordingSession(session_id, str(audio_file), self.spool_bytes, self.max_session_bytes,
+                                       self.clock())
+            self._sessions[session_id] = session
+        logger.info(f"[SESSIONS] Started {session_id} ({len(self._sessions)} active)")
+        return session
+
+    def get(self, session_id: str, touch: bool = True) -> Optional[RecordingSession]:
+        """The session, or None if unknown/reaped (touch=True counts as activity)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None and touch:
+            session.last_activity = self.clock()
+        return session
+
+    def append(self, session_id: str, chunk: bytes) -> int:
+        """Buffer an audio chunk for a session; returns its total bytes (KeyError if unknown)"""
+        session = self.get(session_id, touch=False)
+        if session is None:
+            raise KeyError(session_id)
+        return session.append(chunk, self.clock())
+
+    def stop(self, session_id: str) -> Optional[str]:
+        """Close a session; returns its audio file path (None if no audio was recorded)"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            raise KeyError(session_id)
+        audio_file = session.finish(STOPPED)
+        logger.info(f"[SESSIONS] Stopped {session_id}: {session.bytes_received} bytes")
+        return audio_file
+
+    def reap_idle(self) -> List[str]:
+        """Drop sessions idle for longer than idle_timeout_sec; returns their ids"""
+        cutoff = self.clock() - self.idle_timeout_sec
+        with self._lock:
+            expired = [s for s in self._sessions.values() if s.last_activity < cutoff]
+            for session in expired:
+                del self._sessions[session.id]
+        for session in expired:
+            try:
+                session.finish(EXPIRED)
+            except ValueError:
+                pass  # Finished concurrently
+            logger.warning(f"[SESSIONS] Expired idle session {session.id}")
+        return [session.id for session in expired]
+
+    def sessions(self) -> List[RecordingSession]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stats(self) -> Dict[str, Any]:
+        sessions = self.sessions()
+        return {"active": len(sessions), "max_sessions": self.max_sessions,
+                "bytes_buffered": sum(s.bytes_received for s in sessions)}
@@ -0,0 +1,258 @@
+"""
+Stages Module: Small pipeline engine with per-stage timings.
+
+Stage: One named step with declared inputs/outputs and an optional skip condition
+StageResult: Outcome and monotonic duration of one stage
+Pipeline: Runs stages in order over a shared context dict
+StopPipeline: Raised by a stage to end the run early with a final result
+Pipeline.run_async: Same run on an event loop (blocking stages offloaded to executors)
+
+A stage function receives the context and returns a dict with (at least) its
+declared outputs, which are merged into the context for later stages. A skipped
+stage contributes its `defaults` instead. Inputs are checked before the run, so a
+mis-ordered pipeline fails at construction time rather than halfway through a request.
+
+run_async awaits coroutine stage functions directly; plain functions run in an
+executor (io=True stages in the I/O executor, others in the CPU executor), so the
+event loop is never blocked and the outputs are the same as run().
+
+Progress: on_stage_start(stage_name) is called just before a stage runs and
+on_stage(StageResult) as soon as any stage (run, skipped, restored) is done.
+
+Checkpointing: checkpoint(stage_name, outputs) is called after each completed
+stage, and restored (stage name → outputs from an earlier run) replays the
+longest prefix of completed stages instead of running them (status RESTORED).
+"""
+
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+SKIPPED = "skipped"
+STOPPED = "stopped"  # Stage ended the run early (StopPipeline)
+FAILED = "failed"
+RESTORED = "restored"  # Outputs replayed from a checkpoint, stage not run
+
+
+class StopPipeline(Exception):
+    """End the pipeline early; result becomes the run's final result."""
+
+    def __init__(self, result: Dict, reason: str = ""):
+        super().__init__(reason or "pipeline stopped")
+        self.result = result
+        self.reason = reason
+
+
+@dataclass
+class Stage:
+    """One pipeline step."""
+    name: str
+    fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+    inputs: Sequence[str] = ()
+    outputs: Sequence[str] = ()
+    skip_if: Optional[Callable[[Dict[str, Any]], bool]] = None
+    defaults: Dict[str, Any] = field(default_factory=dict)  # Outputs of a skipped stage
+    io: bool = False  # Network/disk bound: run_async uses the I/O executor
+
+
+@dataclass
+class StageResult:
+    """Outcome of one stage."""
+    name: str
+    status: str
+    duration_sec: float = 0.0
+    outputs: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+@dataclass
+class PipelineRun:
+    """Final context, per-stage results and (if a stage stopped the run) its result."""
+    context: Dict[str, Any]
+    results: List[StageResult]
+    stopped: Optional[StopPipeline] = None
+    duration_sec: float = 0.0
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        """Stage name → seconds, for stages that ran (skipped and restored stages are omitted)."""
+        return {r.name: round(r.duration_sec, 4) for r in self.results if r.status not in (SKIPPED, RESTORED)}
+
+    @property
+    def restored(self) -> List[str]:
+        """Names of stages replayed from a checkpoint."""
+        return [r.name for r in self.results if r.status == RESTORED]
+
+
+class Pipeline:
+    """Runs stages in order, timing each with a monotonic clock."""
+
+    def __init__(self, stages: Iterable[Stage], initial_inputs: Iterable[str] = (),
+                 clock: Callable[[], float] = time.monotonic):
+        self.stages = list(stages)
+        self.clock = clock
+        self._check_wiring(set(initial_inputs))
+
+    def _check_wiring(self, available: set) -> None:
+        names = set()
+        for stage in self.stages:
+            if stage.name in names:
+                raise ValueError(f"Duplicate stage name '{stage.name}'")
+            names.add(stage.name)
+            missing = [key for key in stage.inputs if key not in available]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' needs {missing}, not produced by any earlier stage")
+            if stage.skip_if is not None:
+                undeclared = [key for key in stage.outputs if key not in stage.defaults and key not in available]
+                if undeclared:
+                    raise ValueError(f"Skippable stage '{stage.name}' has no defaults for {undeclared}")
+            available.update(stage.outputs)
+
+    def run(self, context: Dict[str, Any],
+            on_stage: Optional[Callable[[StageResult], None]] = None,
+            restored: Optional[Dict[str, Dict[str, Any]]] = None,
+            checkpoint: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+            on_stage_start: Optional[Callable[[str], None]] = None) -> PipelineRun:
+        """
+        Run every stage over context (mutated in place).
+
+        on_stage is called with each StageResult as soon as the stage finishes
+        (on_stage_start with its name before it runs). A stage exception is
+        recorded as FAILED and re-raised. restored/checkpoint: see the module docstring.
+        """
+        results: List[StageResult] = []
+        run_start = self.clock()
+        stopped = None
+        for stage in self.stages:
+            result = self._skip(stage, context)
+            if result is None and restored is not None:
+                result = self._restore(stage, context, restored)
+                if result is None:
+                    restored = None  # First stage to recompute: later checkpoints are stale
+            if result is None:
+                self._notify(on_stage_start, stage.name)
+                start = self.clock()
+                try:
+                    outputs = stage.fn(context) or {}
+                except StopPipeline as stop:
+                    stopped = stop
+                    result = StageResult(stage.name, STOPPED, self.clock() - start, error=stop.reason or None)
+                except Exception as e:
+                    self._emit(results, self._failed(stage, e, start), on_stage)
+                    raise
+                else:
+                    result = self._complete(stage, context, outputs, start)
+                    if checkpoint:
+                        checkpoint(stage.name, outputs)
+            self._emit(results, result, on_stage)
+            if stopped:
+                break
+        return self._finish(context, results, stopped, run_start)
+
+    async def run_async(self, context: Dict[str, Any],
+                        on_stage: Optional[Callable[[StageResult], None]] = None,
+                        io_executor: Optional[Executor] = None,
+                        cpu_executor: Optional[Executor] = None,
+                        restored: Optional[Dict[str, Dict[str, Any]]] = None,
+                        checkpoint: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                        on_stage_start: Optional[Callable[[str], None]] = None) -> PipelineRun:
+        """
+        run() as a coroutine.
+
+        Coroutine stage functions are awaited; blocking ones run in io_executor
+        (io=True) or cpu_executor (None = the loop's default executor). on_stage is
+        called on the event loop thread; checkpoint runs in io_executor.
+        """
+        loop = asyncio.get_running_loop()
+        results: List[StageResult] = []
+        run_start = self.clock()
+        stopped = None
+        for stage in self.stages:
+            result = self._skip(stage, context)
+            if result is None and restored is not None:
+                result = self._restore(stage, context, restored)
+                if result is None:
+                    restored = None  # First stage to recompute: later checkpoints are stale
+            if result is None:
+                self._notify(on_stage_start, stage.name)
+                start = self.clock()
+                try:
+                    if asyncio.iscoroutinefunction(stage.fn):
+                        outputs = await stage.fn(context) or {}
+                    else:
+                        executor = io_executor if stage.io else cpu_executor
+                        outputs = await loop.run_in_executor(executor, stage.fn, context) or {}
+                except StopPipeline as stop:
+                    stopped = stop
+                    result = StageResult(stage.name, STOPPED, self.clock() - start, error=stop.reason or None)
+                except Exception as e:
+                    self._emit(results, self._failed(stage, e, start), on_stage)
+                    raise
+                else:
+                    result = self._complete(stage, context, outputs, start)
+                    if checkpoint:
+                        await loop.run_in_executor(io_executor, checkpoint, stage.name, outputs)
+            self._emit(results, result, on_stage)
+            if stopped:
+                break
+        return self._finish(context, results, stopped, run_start)
+
+    @staticmethod
+    def _skip(stage: Stage, context: Dict[str, Any]) -> Optional[StageResult]:
+        """SKIPPED result (defaults applied) if the stage's skip condition holds, else None"""
+        if stage.skip_if is None or not stage.skip_if(context):
+            return None
+        for key, value in stage.defaults.items():
+            context.setdefault(key, value)
+        return StageResult(stage.name, SKIPPED)
+
+    @staticmethod
+    def _restore(stage: Stage, context: Dict[str, Any],
+                 restored: Dict[str, Dict[str, Any]]) -> Optional[StageResult]:
+        """RESTORED result (checkpointed outputs applied) if the stage has a checkpoint, else None"""
+        outputs = restored.get(stage.name)
+        if outputs is None or any(key not in outputs for key in stage.outputs):
+            return None
+        context.update(outputs)
+        return StageResult(stage.name, RESTORED, outputs=sorted(outputs))
+
+    def _complete(self, stage: Stage, context: Dict[str, Any], outputs: Dict[str, Any],
+                  start: float) -> StageResult:
+        missing = [key for key in stage.outputs if key not in outputs]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' did not return {missing}")
+        context.update(outputs)
+        return StageResult(stage.name, OK, self.clock() - start, outputs=sorted(outputs))
+
+    def _failed(self, stage: Stage, error: Exception, start: float) -> StageResult:
+        return StageResult(stage.name, FAILED, self.clock() - start, error=f"{type(error).__name__}: {error}")
+
+    def _finish(self, context: Dict[str, Any], results: List[StageResult],
+                stopped: Optional[StopPipeline], run_start: float) -> PipelineRun:
+        run = PipelineRun(context, results, stopped, self.clock() - run_start)
+        logger.info("[STAGES] " + ", ".join(
+            f"{r.name}={r.duration_sec * 1000:.0f}ms" if r.status not in (SKIPPED, RESTORED) else f"{r.name}={r.status}"
+            for r in results))
+        return run
+
+    @classmethod
+    def _emit(cls, results: List[StageResult], result: StageResult,
+              on_stage: Optional[Callable[[StageResult], None]]) -> None:
+        results.append(result)
+        cls._notify(on_stage, result)
+
+    @staticmethod
+    def _notify(callback: Optional[Callable[[Any], None]], value: Any) -> None:
+        """Progress callbacks must never break the run"""
+        if callback:
+            try:
+                callback(value)
+            except Exception as e:
+                name = getattr(value, "name", value)
+                logger.warning(f"[STAGES] Progress callback failed for '{name}': {e}")
@@ -30,6 +30,11 @@ except ImportError:
     OPENAI_AVAILABLE = False
     logging.warning("OpenAI SDK not installed. Install with: pip install openai")
 
+try:
+    from .record_replay import wrap_client, replay_mode, MODE_REPLAY
+except ImportError:
+    from record_replay import wrap_client, replay_mode, MODE_REPLAY
+
 # Load environment
 env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', '.env')
 if not os.path.exists(env_path):
@@ -50,6 +55,11 @@ class TranscriptionResult:
     transcription_tier: int = 1
     cleaned_length: int = 0
     error: Optional[str] = None
+    audio_sec_probe: float = 0.0    # Audio seconds sent to Whisper for language detection
+    audio_sec_full: float = 0.0     # Audio seconds sent for the full transcription/translation
+    whisper_requests: int = 0       # Whisper API calls made (probe + full + fallbacks)
+    whisper_retries: int = 0        # Calls repeated after a failure (e.g. translation → transcription)
+    probe_skipped: bool = False     # Language was provided, so no probe pass was paid for
 
 
 # ==================== TRANSCRIPT CLEANING ====================
@@ -203,15 +213,18 @@ class WhisperTranscriber:
     }
 
     def __init__(self, model_size: str = "base"):
-        """Initialize OpenAI Whisper transcriber."""
-        if not OPENAI_AVAILABLE:
-            raise ImportError("OpenAI SDK not available. Install with: pip install openai")
-
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not set in environment. Please configure it in config/.env")
-
-        self.client = OpenAI(api_key=api_key)
+        """Initialize OpenAI Whisper transcriber (replay mode needs neither SDK nor key)."""
+        client = None
+        if replay_mode() != MODE_REPLAY:
+            if not OPENAI_AVAILABLE:
+                raise ImportError("OpenAI SDK not available. Install with: pip install openai")
+
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY not set in environment. Please configure it in config/.env")
+            client = OpenAI(api_key=api_key)
+
+        self.client = wrap_client(client, "openai")
         self.cleaner = TranscriptCleaner()
 
         # Import LanguageDetector for text-level Thanglish confirmation
@@ -238,6 +251,8 @@ class WhisperTranscriber:
         Returns:
             TranscriptionResult with detected_language field populated.
         """
+        usage = {"audio_sec_probe": 0.0, "audio_sec_full": 0.0, "whisper_requests": 0,
+                 "whisper_retries": 0, "probe_skipped": bool(language)}
         try:
             if not os.path.exists(audio_path):
                 logger.error(f"Audio file not found: {audio_path}")
@@ -254,14 +269,15 @@ class WhisperTranscriber:
                     whisper_lang = "en"
                 logger.info(f"[LANG] Using provided language: {language}")
             else:
-                detected_lang, whisper_lang = self._detect_language_from_audio(audio_path)
+                detected_lang, whisper_lang = self._detect_language_from_audio(audio_path, usage)
 
             # ── Step 2: Full transcription with correct language ────────────
-            raw_text = self._transcribe_with_language(audio_path, detected_lang, whisper_lang)
+            raw_text = self._transcribe_with_language(audio_path, detected_lang, whisper_lang, usage)
             if raw_text is None:
-                return TranscriptionResult(success=False, error="Transcription returned empty text")
+                return TranscriptionResult(success=False, error="Transcription returned empty text", **usage)
 
-            logger.info(f"[WHISPER] Raw transcript ({len(raw_text)} chars): {raw_text[:120]}...")
+            logger.info(f"[WHISPER] Raw transcript: {len(raw_text)} chars")
+            logger.debug("[WHISPER] Raw transcript sample: %.120s...", raw_text)
 
             # ── Step 3: Clean transcript ────────────────────────────────────
             cleaned_text, was_modified = self.cleaner.clean(raw_text)
@@ -272,20 +288,22 @@ class WhisperTranscriber:
             if not self._quality_ok(cleaned_text):
                 logger.warning("[QUALITY] Transcript is sparse but proceeding anyway")
 
-            return self._build_result(cleaned_text, detected_lang, whisper_lang)
+            return self._build_result(cleaned_text, detected_lang, whisper_lang, usage)
 
         except Exception as e:
             logger.error(f"[ERROR] OpenAI transcription failed: {e}")
-            return TranscriptionResult(success=False, error=str(e))
+            return TranscriptionResult(success=False, error=str(e), **usage)
 
     # ── Language detection ─────────────────────────────────────────────────────
 
-    def _detect_language_from_audio(self, audio_path: str) -> tuple:
+    def _detect_language_from_audio(self, audio_path: str, usage: Optional[Dict] = None) -> tuple:
         """
         Detect spoken language from unlabeled audio using a two-step approach:
           1. Probe Whisper with no language hint — get Whisper's best guess
           2. Run LanguageDetector on probe text — confirm Thanglish vs English
 
+        Probe audio seconds are added to usage['audio_sec_probe'].
+
         Returns:
             (detected_lang, whisper_lang)
             detected_lang: 'en', 'ta', or 'tanglish'
@@ -301,12 +319,13 @@ class WhisperTranscriber:
                     # No language= parameter → Whisper auto-detects
                     response_format="verbose_json",  # Gives us language + segments
                 )
+            self._count_audio(usage, "audio_sec_probe", probe_response)
 
             whisper_detected = getattr(probe_response, "language", "en") or "en"
             probe_text = getattr(probe_response, "text", "").strip()
 
             logger.info(f"[DETECT] Whisper detected language: '{whisper_detected}'")
-            logger.info(f"[DETECT] Probe text sample: {probe_text[:100]}")
+            logger.debug("[DETECT] Probe text sample: %.100s", probe_text)
 
             # ── Map Whisper language to our categories ────────────────────
             if whisper_detected == "tamil" or whisper_detected == "ta":
@@ -380,7 +399,8 @@ class WhisperTranscriber:
     # ── Transcription helpers ──────────────────────────────────────────────────
 
     def _transcribe_with_language(self, audio_path: str, detected_lang: str,
-                                   whisper_lang: Optional[str]) -> Optional[str]:
+                                   whisper_lang: Optional[str],
+                                   usage: Optional[Dict] = None) -> Optional[str]:
         """
         Perform the actual Whisper transcription with the correct language + prompt.
 
@@ -388,6 +408,7 @@ class WhisperTranscriber:
             audio_path:    Path to audio file
             detected_lang: 'en', 'ta', or 'tanglish'
             whisper_lang:  Whisper API language code, or None for auto
+            usage:         Audio seconds/requests are added here (audio_sec_full, whisper_retries)
         """
         prompt = self.PROMPTS.get(detected_lang, self.PROMPTS["en"])
 
@@ -398,6 +419,7 @@ class WhisperTranscriber:
             "file": None,  # set in context manager below
             "model": "whisper-1",
             "prompt": prompt,
+            "response_format": "verbose_json",  # Same text, plus the billed audio duration
         }
         if whisper_lang:  # None means no language hint (auto)
             kwargs["language"] = whisper_lang
@@ -411,7 +433,9 @@ class WhisperTranscriber:
                         model="whisper-1",
                         # Keep prompt short and non-instructional to avoid echo
                         prompt="Medical consultation. Drug names and dosages.",
+                        response_format="verbose_json",
                     )
+                self._count_audio(usage, "audio_sec_full", response)
                 text = response.text.strip()
                 # Strip any prompt-echo artifacts from the beginning
                 text = self._strip_prompt_echo(text)
@@ -419,6 +443,9 @@ class WhisperTranscriber:
                 return text
             except Exception as e:
                 logger.warning(f"[WHISPER] Translation failed: {e} — falling back to transcription")
+                if usage is not None:
+                    usage["whisper_requests"] += 1
+                    usage["whisper_retries"] += 1
                 # Fall through to standard transcription below
                 kwargs["language"] = "ta"
         
@@ -433,6 +460,7 @@ class WhisperTranscriber:
         with open(audio_path, "rb") as audio_file:
             kwargs["file"] = audio_file
             response = self.client.audio.transcriptions.create(**kwargs)
+        self._count_audio(usage, "audio_sec_full", response)
 
         text = response.text.strip() if response.text else None
         # Strip any prompt-echo that Whisper may have prepended
@@ -484,6 +512,16 @@ class WhisperTranscriber:
 
     # ── Internal helpers ───────────────────────────────────────────────────────
 
+    @staticmethod
+    def _count_audio(usage: Optional[Dict], key: str, response) -> None:
+        """Add one Whisper call and its billed audio duration (verbose_json 'duration') to usage."""
+        if usage is None:
+            return
+        usage["whisper_requests"] += 1
+        duration = getattr(response, "duration", None)
+        if isinstance(duration, (int, float)):
+            usage[key] += float(duration)
+
     def _quality_ok(self, text: str) -> bool:
         """Check if transcript has minimum content."""
         words = len(text.split())
@@ -498,7 +536,7 @@ class WhisperTranscriber:
         return True
 
     def _build_result(self, text: str, detected_lang: str = "en",
-                      whisper_lang: str = "en") -> TranscriptionResult:
+                      whisper_lang: str = "en", usage: Optional[Dict] = None) -> TranscriptionResult:
         """Package result into standard format."""
         text = text.strip()
         confidence = 0.92  # OpenAI Whisper is highly reliable
@@ -516,4 +554,5 @@ class WhisperTranscriber:
             confidence=confidence,
             transcription_tier=1,
             cleaned_length=len(text),
+            **(usage or {}),
         )
@@ -0,0 +1,249 @@
+"""
+Upload Stream Module: Receive audio uploads in chunks, checking them as they arrive.
+
+StreamingUpload: Writable/readable file object for one upload (hash, format, duration, limits)
+UploadInfo: What a finished upload is (path, sha256, size, format, duration estimate)
+UploadRejected: Upload refused mid-stream (too large, too long, not audio)
+sniff_audio_format: Container format from the first bytes, or None
+
+Every chunk written updates a SHA-256 of the content and the byte count. The
+first bytes identify the container (WAV, MP3, Ogg, WebM, MP4/M4A, FLAC) - anything
+else is rejected at once - and, for WAV and MP3, the byte rate, which gives a
+running duration estimate. An upload over max_bytes or max_duration_sec is
+rejected as soon as it crosses the limit, not after the whole body has arrived.
+
+Data stays in memory up to spool_bytes, then moves to a temporary file in
+spool_dir; save(path) renames that file into place (no second copy) and returns
+the UploadInfo, whose sha256 is handed downstream so nothing re-reads the file
+to hash it.
+
+The object follows the stream-factory contract of multipart parsers (write during
+parsing, then seek/read), so a web framework can write file parts straight into it:
+
+    upload = StreamingUpload(max_bytes=50 * 1024 * 1024, spool_dir="data/audio")
+    for chunk in chunks:
+        upload.write(chunk)          # may raise UploadRejected
+    info = upload.save("data/audio/consultation.webm")
+"""
+
+import io
+import os
+import struct
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+HEAD_BYTES = 4096  # Enough for the container signature and a WAV fmt chunk / MP3 frame header
+MIN_SNIFF_BYTES = 12
+
+# MPEG-1 Layer III bitrates (kbps) by header index
+MP3_BITRATES_KBPS = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+
+class UploadRejected(Exception):
+    """Upload refused while streaming; status is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 413):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class UploadInfo:
+    """A received upload."""
+    path: str
+    sha256: str
+    size: int
+    format: Optional[str] = None
+    duration_sec: Optional[float] = None  # Estimate (WAV, CBR MP3); None for other formats
+
+
+def sniff_audio_format(head: bytes) -> Optional[str]:
+    """Audio container of a file from its first bytes (None if not a recognized audio format)"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if head[4:8] == b"ftyp":
+        return "mp4"
+    if head[:4] == b"fLaC":
+        return "flac"
+    return None
+
+
+def _wav_byte_rate(head: bytes) -> Optional[tuple]:
+    """(byte rate, offset of the audio data) from a WAV header, None until both are in head"""
+    offset, byte_rate = 12, None
+    while offset + 8 <= len(head):
+        chunk_id, chunk_size = head[offset:offset + 4], struct.unpack("<I", head[offset + 4:offset + 8])[0]
+        if chunk_id == b"fmt " and offset + 20 <= len(head):
+            byte_rate = struct.unpack("<I", head[offset + 16:offset + 20])[0]
+        elif chunk_id == b"data":
+            return (byte_rate, offset + 8) if byte_rate else None
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _mp3_byte_rate(head: bytes) -> Optional[tuple]:
+    """(byte rate, offset of the first frame) of an MPEG-1 Layer III stream, None if not in head"""
+    offset = 0
+    if head[:3] == b"ID3":
+        if len(head) < 10:
+            return None
+        size = head[6:10]
+        offset = 10 + ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3])  # Syncsafe integer
+    if offset + 4 > len(head):
+        return None
+    b1, b2 = head[offset + 1], head[offset + 2]
+    if head[offset] != 0xFF or b1 & 0xFE != 0xFA:  # Frame sync, MPEG-1, Layer III
+        return None
+    index = b2 >> 4
+    if not 0 < index < len(MP3_BITRATES_KBPS):
+        return None
+    return MP3_BITRATES_KBPS[index] * 1000 // 8, offset
+
+
+class StreamingUpload:
+    """One upload, checked and hashed chunk by chunk."""
+
+    def __init__(self, max_bytes: int, max_duration_sec: Optional[float] = None,
+                 spool_bytes: int = 1024 * 1024, spool_dir: Optional[str] = None):
+        """
+        Args:
+            max_bytes:        Reject uploads larger than this
+            max_duration_sec: Reject uploads whose estimated duration exceeds this (WAV, MP3)
+            spool_bytes:      Keep up to this much in memory, then spill to a temp file
+            spool_dir:        Directory of the temp file (same filesystem as save() targets)
+        """
+        self.max_bytes = max_bytes
+        self.max_duration_sec = max_duration_sec
+        self.spool_bytes = spool_bytes
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.format: Optional[str] = None
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._byte_rate: Optional[tuple] = None  # (bytes per second, audio data offset)
+        self._file = io.BytesIO()
+        self._tmp_path: Optional[str] = None
+        self._saved = False
+
+    # ── Receiving ────────────────────────────────────────────────────────────
+
+    def write(self, data: bytes) -> int:
+        self._digest.update(data)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self._reject(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB", 413)
+        if len(self._head) < HEAD_BYTES and self._byte_rate is None:
+            self._head += data[:HEAD_BYTES - len(self._head)]
+            self._inspect_head()
+        duration = self.duration_sec
+        if self.max_duration_sec is not None and duration is not None and duration > self.max_duration_sec:
+            self._reject(f"Audio longer than {self.max_duration_sec:.0f}s", 413)
+        if self._tmp_path is None and self.size > self.spool_bytes:
+            self._spill()
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def duration_sec(self) -> Optional[float]:
+        """Duration of the audio received so far (None if the format gives no byte rate)"""
+        if not self._byte_rate:
+            return None
+        byte_rate, data_offset = self._byte_rate
+        return max(0, self.size - data_offset) / byte_rate
+
+    def _inspect_head(self) -> None:
+        if len(self._head) < MIN_SNIFF_BYTES:
+            return
+        if self.format is None:
+            self.format = sniff_audio_format(self._head)
+            if self.format is None:
+                self._reject("Not an audio file", 415)
+        if self.format == "wav":
+            self._byte_rate = _wav_byte_rate(self._head)
+        elif self.format == "mp3":
+            self._byte_rate = _mp3_byte_rate(self._head)
+
+    def _spill(self) -> None:
+        """Move the in-memory data to a temp file; later chunks are appended there"""
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.spool_dir, suffix=".upload")
+        spilled = os.fdopen(fd, "w+b")
+        spilled.write(self._file.getvalue())
+        self._file = spilled
+
+    def _reject(self, message: str, status: int) -> None:
+        logger.warning(f"[UPLOAD] Rejected after {self.size} bytes: {message}")
+        self.close()
+        raise UploadRejected(message, status)
+
+    # ── Finishing ────────────────────────────────────────────────────────────
+
+    def save(self, path: str) -> UploadInfo:
+        """Put the upload at path (rename if spooled, else write) and describe it"""
+        if self.format is None:  # Shorter than MIN_SNIFF_BYTES
+            self._reject("Not an audio file", 415)
+        if self._tmp_path is not None:
+            self._file.close()
+            os.replace(self._tmp_path, path)
+            self._tmp_path = None
+        else:
+            with open(path, "wb") as f:
+                f.write(self._file.getvalue())
+        self._saved = True
+        info = UploadInfo(str(path), self.sha256, self.size, self.format,
+                          round(self.duration_sec, 2) if self.duration_sec is not None else None)
+        logger.info(f"[UPLOAD] {info.size} bytes {info.format} ({info.sha256[:12]}) → {path}")
+        return info
+
+    def close(self) -> None:
+        """Release the buffer; an unsaved spooled upload's temp file is deleted"""
+        self._file.close()
+        if self._tmp_path is not None and not self._saved:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+            self._tmp_path = None
+
+    # File-object protocol used by parsers after writing (seek(0), then read)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
@@ -8,12 +8,36 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock
 import tempfile
 import os
+import time
+import threading
 
 # Import modules to test
 from transcription import WhisperTranscriber, TranscriptionResult
 from routing import AudioAnalyzer, RouteSelector
 from extraction import GroqLLMExtractor, Medicine, EnsembleExtractor
 from validation import ValidationLayer, Prescription
+from prompt_builder import ExtractionPromptBuilder
+from json_stream import IncrementalJSONParser
+from chunking import split_transcript, merge_extractions
+from rate_limit import RateLimiter, TokenBucket, parse_reset
+from model_router import ModelRouter
+from hedging import HedgeBudget
+from model_tiering import ModelTierSelector, count_medicine_cues
+from record_replay import FixtureStore, FixtureNotFoundError, wrap_client
+from types import SimpleNamespace
+from metrics import MetricsCollector, ExtractionMetrics
+from normalization import RepetitionCollapser
+from compaction import TranscriptCompactor
+from stages import Pipeline, Stage, StageResult, StopPipeline
+from reporting import ConsoleReporter, EventReporter, make_reporter
+from batch import expand_inputs, Checkpoint, BatchProgress, run_batch
+from checkpoints import StageCheckpointStore
+from artifact_store import ArtifactStore
+from job_queue import JobQueue, AsyncJobQueue, SQLiteJobBackend
+from session_registry import SessionRegistry, SessionLimitError
+from upload_stream import StreamingUpload, UploadRejected
+from coalescing import RequestCoalescer
+from medical_system_v2 import AdvancedExtractor
 
 
 class TestAudioAnalyzer(unittest.TestCase):
@@ -276,6 +300,1358 @@ class TestEnsembleExtractor(unittest.TestCase):
         self.assertEqual(len(merged['medicines']), 1)
         self.assertEqual(merged['patient_name'], 'Rohit')
 
+    def test_ensemble_runs_methods_concurrently(self):
+        """Test ensemble latency is max(groq, rules), not the sum."""
+        def slow_extract(transcript, use_groq=True, language=None):
+            time.sleep(0.2)
+            return {"success": True, "data": {"medicines": [], "patient_name": "Rohit" if not use_groq else None},
+                    "method": "groq" if use_groq else "rules"}
+
+        self.extractor.extract = slow_extract
+        result = self.ensemble.extract_ensemble("Rohit has fever")
+
+        self.assertLess(result['latency_sec'], 0.35)
+        self.assertFalse(result['groq_timed_out'])
+        self.assertEqual(result['data']['patient_name'], 'Rohit')
+
+    def test_ensemble_deadline_falls_back_to_rules(self):
+        """Test a slow Groq call is dropped once the deadline expires."""
+        def extract(transcript, use_groq=True, language=None):
+            if use_groq:
+                time.sleep(0.5)
+            return {"success": True, "data": {"medicines": [{"name": "rules-drug"}]}, "method": "rules"}
+
+        self.extractor.extract = extract
+        result = self.ensemble.extract_ensemble("Rohit has fever", deadline_sec=0.1)
+
+        self.assertTrue(result['groq_timed_out'])
+        self.assertEqual(result['data']['medicines'][0]['name'], 'rules-drug')
+
+    def test_rules_not_queued_behind_busy_groq_workers(self):
+        """Test rules still merge when every ensemble worker is stuck on a slow Groq call."""
+        release = threading.Event()
+
+        def extract(transcript, use_groq=True, language=None):
+            if use_groq:
+                release.wait(2.0)
+                return {"success": False, "data": {}}
+            return {"success": True, "data": {"medicines": [{"name": "rules-drug"}]}, "method": "rules"}
+
+        self.extractor.extract = extract
+        try:
+            for _ in range(4):
+                self.ensemble._executor.submit(extract, "", use_groq=True)
+            start = time.monotonic()
+            result = self.ensemble.extract_ensemble("Rohit has fever", deadline_sec=0.1)
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertEqual(result['data']['medicines'][0]['name'], 'rules-drug')
+        finally:
+            release.set()
+
+
+class TestAdvancedExtractor(unittest.TestCase):
+    """Tests for deadline-bounded AdvancedExtractor."""
+
+    TRANSCRIPT = "Hi Rohit, take paracetamol 500 mg three times a day for 5 days"
+
+    def setUp(self):
+        self.advanced = AdvancedExtractor()
+
+    def _slow_groq(self, delay):
+        def extract(transcript, use_groq=True, language=None):
+            time.sleep(delay)
+            return {"success": True, "data": {"patient_name": "Rohit", "medicines": [
+                {"name": "paracetamol", "dose": "650 mg", "frequency": "3 times a day", "duration": "5 days"}]},
+                "method": "groq", "usage": {}}
+        return extract
+
+    def test_deadline_met_returns_final_result(self):
+        """Test a Groq result within the deadline is not provisional."""
+        self.advanced.extractor.extract = self._slow_groq(0.0)
+        result = self.advanced.extract_advanced(self.TRANSCRIPT, deadline_sec=2.0)
+
+        self.assertEqual(result['method'], 'groq')
+        self.assertFalse(result['provisional'])
+        self.assertNotIn('upgrade_future', result)
+
+    def test_deadline_missed_returns_provisional_then_upgrades(self):
+        """Test a slow Groq call yields a provisional rules result, then an upgrade."""
+        self.advanced.extractor.extract = self._slow_groq(0.3)
+        start = time.monotonic()
+        result = self.advanced.extract_advanced(self.TRANSCRIPT, deadline_sec=0.05)
+
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertTrue(result['provisional'])
+        self.assertTrue(result['deadline_missed'])
+        self.assertEqual(result['method'], 'advanced-rules')
+
+        upgraded = result['upgrade_future'].result(timeout=2)
+        self.assertEqual(upgraded['method'], 'groq')
+        self.assertFalse(upgraded['provisional'])
+        self.assertEqual(upgraded['data']['medicines'][0]['dose'], '650 mg')
+
+    def test_rules_read_full_transcript_when_groq_gets_compacted_text(self):
+        """Test the ensemble rules half and the rules fallback see the full transcript, not llm_transcript."""
+        calls = []
+
+        def extract(transcript, use_groq=True, language=None):
+            calls.append((transcript, use_groq))
+            return {"success": True, "data": {"medicines": []}, "method": "rules", "usage": {"cost_usd": 0.01}}
+
+        self.advanced.extractor.extract = extract
+        for use_ensemble in (False, True):
+            calls.clear()
+            result = self.advanced.extract_advanced(self.TRANSCRIPT, use_ensemble=use_ensemble,
+                                                    llm_transcript="paracetamol 500 mg")
+            self.assertIn(("paracetamol 500 mg", True), calls)
+            self.assertIn((self.TRANSCRIPT, False), calls)
+            self.assertNotIn(("paracetamol 500 mg", False), calls)
+        self.assertEqual(self.advanced._extract_primary("x", False, None, None, "full")['usage'], {"cost_usd": 0.01})
+
+    def test_failed_upgrade_reported_instead_of_dropped(self):
+        """Test a late Groq result that fails reaches on_upgrade_failed, so waiting clients can stop."""
+        from concurrent.futures import Future
+        from medical_system_v2 import MedicalSystem
+        upgrade = Future()
+        upgrade.set_exception(RuntimeError("Groq timed out"))
+        upgraded, failures = [], []
+
+        system = MedicalSystem.__new__(MedicalSystem)
+        output = system._apply_upgrade(upgrade, {}, None, "groq_only", None, None)
+        system._notify_upgrade(output, upgraded.append, failures.append)
+
+        self.assertIsNone(output)
+        self.assertEqual(upgraded, [])
+        self.assertEqual(len(failures), 1)
+
+
+class TestExtractionPromptBuilder(unittest.TestCase):
+    """Tests for ExtractionPromptBuilder."""
+
+    def setUp(self):
+        self.builder = ExtractionPromptBuilder()
+
+    def test_english_prompt_skips_tamil_but_keeps_arabic_block(self):
+        """Test 'en' drops the Tamil block but keeps Arabic (the detector labels Arabic consultations 'en')."""
+        prompt = self.builder.build("Take paracetamol 500 mg", language="en")
+        system = prompt.messages[0]["content"]
+
+        self.assertIn("ENGLISH CONSULTATION", system)
+        self.assertNotIn("TAMIL/THANGLISH", system)
+        self.assertIn("ARABIC CONSULTATION", system)
+
+    def test_consultation_is_last_and_prefix_is_stable(self):
+        """Test the system message is identical across requests and excludes the transcript."""
+        first = self.builder.build("Patient Meena has fever", language="tanglish")
+        second = self.builder.build("Patient Sarah has cough", language="tanglish")
+
+        self.assertEqual(first.messages[0], second.messages[0])
+        self.assertEqual(first.messages[-1]["role"], "user")
+        self.assertIn("Meena", first.messages[-1]["content"])
+        self.assertNotIn("Meena", first.messages[0]["content"])
+
+    def test_token_estimate_is_reported(self):
+        """Test token counts are computed before sending."""
+        en = self.builder.build("Take paracetamol 500 mg", language="en")
+        unknown = self.builder.build("Take paracetamol 500 mg")
+
+        self.assertGreater(en.consultation_tokens, 0)
+        self.assertGreater(unknown.system_tokens, en.system_tokens)
+        self.assertEqual(en.total_tokens, en.system_tokens + en.consultation_tokens)
+
+
+def _stream_chunks(text, finish_reason="stop", size=7):
+    """Build fake streamed completion chunks for text."""
+    chunks = []
+    for i in range(0, len(text), size):
+        last = i + size >= len(text)
+        choice = Mock(delta=Mock(content=text[i:i + size]), finish_reason=finish_reason if last else None)
+        chunks.append(Mock(choices=[choice]))
+    return chunks
+
+
+class TestIncrementalJSONParser(unittest.TestCase):
+    """Tests for IncrementalJSONParser."""
+
+    def test_emits_fields_and_medicines_as_they_close(self):
+        """Test fields and medicines are emitted before the object closes."""
+        parser = IncrementalJSONParser()
+        parser.feed('Sure: {"patient_name":"Rohit","medicines":[{"name":"paracetamol","dose":"500 mg"},')
+
+        self.assertEqual(parser.fields["patient_name"], "Rohit")
+        self.assertEqual(len(parser.medicines), 1)
+        self.assertTrue(parser.truncated)
+
+        parser.feed('{"name":"levocetirizine"}],"tests":[]}')
+        self.assertFalse(parser.truncated)
+        self.assertEqual(len(parser.result()["medicines"]), 2)
+
+    def test_streamed_extraction_requests_continuation_on_truncation(self):
+        """Test truncated output is continued rather than regenerated."""
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = [
+            _stream_chunks('{"patient_name":"Rohit","medicines":[{"name":"amoxicillin"', "length"),
+            _stream_chunks(',"dose":"500 mg"}],"diagnosis":[]}'),
+        ]
+
+        result = extractor._extract_groq("Rohit has fever. Take amoxicillin 500 mg.")
+
+        self.assertEqual(result["method"], "groq")
+        self.assertEqual(result["usage"]["continuations"], 1)
+        self.assertEqual(result["data"]["medicines"][0]["dose"], "500 mg")
+        continuation = extractor.client.chat.completions.create.call_args_list[1].kwargs
+        self.assertEqual(continuation["messages"][-1]["role"], "assistant")
+        self.assertNotIn("response_format", continuation)
+
+
+class TestMapReduceExtraction(unittest.TestCase):
+    """Tests for chunked (map-reduce) extraction of long transcripts."""
+
+    def test_split_respects_budget_and_sentence_boundaries(self):
+        """Test chunks stay under budget and never cut a sentence."""
+        sentences = [f"Take medicine number {i} twice a day after food." for i in range(40)]
+        chunks = split_transcript(" ".join(sentences), max_tokens=60)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith("."))
+            self.assertIn(chunk.split(". ")[0].rstrip(".") + ".", sentences)
+
+    def test_merge_deduplicates_deterministically(self):
+        """Test medicines, tests and advice are merged without duplicates."""
+        parts = [
+            {"patient_name": "Rohit", "medicines": [{"name": "Paracetamol", "dose": "500 mg", "frequency": ""}],
+             "tests": ["CBC"], "advice": ["Drink warm water"]},
+            {"patient_name": None, "medicines": [{"name": "paracetamol", "frequency": "3 times a day"},
+                                                 {"name": "amoxicillin", "dose": "500 mg"}],
+             "tests": ["cbc", "CRP"], "advice": ["drink warm water.", "Rest"]},
+        ]
+
+        merged = merge_extractions(parts)
+
+        self.assertEqual(merged, merge_extractions(parts))
+        self.assertEqual(merged["patient_name"], "Rohit")
+        self.assertEqual([m["name"] for m in merged["medicines"]], ["Paracetamol", "amoxicillin"])
+        self.assertEqual(merged["medicines"][0]["frequency"], "3 times a day")
+        self.assertEqual(merged["tests"], ["CBC", "CRP"])
+        self.assertEqual(merged["advice"], ["Drink warm water", "Rest"])
+
+    def test_long_transcript_switches_to_map_reduce(self):
+        """Test transcripts above the token threshold are extracted per chunk."""
+        extractor = GroqLLMExtractor()
+        extractor.use_groq = True
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.CHUNK_THRESHOLD_TOKENS = 50
+        extractor.CHUNK_TARGET_TOKENS = 40
+        calls = []
+
+        def single(chunk, language=None, on_partial=None, complexity=None):
+            calls.append(chunk)
+            return {"success": True, "method": "groq", "usage": {"prompt_tokens_estimate": 10},
+                    "data": {"medicines": [{"name": "paracetamol"}], "tests": [f"test {len(calls)}"]}}
+
+        extractor._extract_groq_single = single
+        transcript = " ".join(f"Sentence {i} about the fever and the cough." for i in range(20))
+        result = extractor.extract(transcript)
+
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(result["usage"]["chunks"], len(calls))
+        self.assertEqual(len(result["data"]["medicines"]), 1)
+        self.assertEqual(len(result["data"]["tests"]), len(calls))
+
+
+class _FakeClock:
+    """Manually advanced monotonic clock; sleep() advances it."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Tests for the token-bucket rate limiter and batch extraction."""
+
+    def test_token_bucket_waits_for_refill(self):
+        """Test a drained bucket reports the refill wait."""
+        clock = _FakeClock()
+        bucket = TokenBucket(capacity=10, refill_per_sec=2, clock=clock)
+        bucket.consume(10)
+
+        self.assertAlmostEqual(bucket.wait_time(4), 2.0)
+        clock.now += 2.0
+        self.assertEqual(bucket.wait_time(4), 0.0)
+
+    def test_separate_request_and_token_budgets(self):
+        """Test whichever budget is tighter throttles the request."""
+        clock = _FakeClock()
+        limiter = RateLimiter(requests_per_window=2, window_sec=60, tokens_per_minute=6000,
+                              clock=clock, sleep=clock.sleep)
+
+        self.assertEqual(limiter.acquire(1000), 0.0)
+        self.assertEqual(limiter.acquire(1000), 0.0)
+        self.assertAlmostEqual(limiter.acquire(1000), 30.0)  # Request budget: 1 per 30s
+
+        limiter.acquire(6000)  # Token budget now drained
+        self.assertGreater(limiter.snapshot()["throttle_events"], 1)
+
+    def test_headers_adapt_budget(self):
+        """Test x-ratelimit headers tighten the token budget and pause on exhausted requests."""
+        clock = _FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+        limiter.update_from_headers({
+            "x-ratelimit-limit-tokens": "6000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "1m30s",
+        })
+
+        self.assertEqual(parse_reset("2m59.5s"), 179.5)
+        self.assertGreaterEqual(limiter.acquire(100), 90.0)
+
+    def test_rate_limited_request_is_retried(self):
+        """Test a 429 is retried with backoff instead of falling back to rules."""
+        class RateLimitError(Exception):
+            status_code = 429
+
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.RATE_LIMIT_BACKOFF_BASE_SEC = 0.001
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = [
+            RateLimitError("rate limited"),
+            _stream_chunks('{"patient_name":"Rohit","medicines":[],"diagnosis":[]}'),
+        ]
+
+        result = extractor._extract_groq("Rohit has fever.")
+
+        self.assertEqual(result["method"], "groq")
+        self.assertEqual(extractor.rate_limiter.snapshot()["rate_limited"], 1)
+
+    def test_json_mode_kept_after_transient_error(self):
+        """Test only a 400 refusing response_format turns JSON mode off for a model."""
+        class APIConnectionError(Exception):
+            pass
+
+        class BadRequestError(Exception):
+            status_code = 400
+
+        model = "openai/gpt-oss-120b"
+        extractor = GroqLLMExtractor()
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = APIConnectionError("connection reset")
+        with self.assertRaises(APIConnectionError):
+            extractor._stream_completion(model, [{"role": "user", "content": "hi"}], IncrementalJSONParser())
+        self.assertNotIn(model, extractor._json_mode_rejected)
+
+        extractor.client.chat.completions.create.side_effect = [
+            BadRequestError("response_format json_object is not supported with streaming"),
+            _stream_chunks('{"patient_name":"Rohit"}'),
+        ]
+        text, _ = extractor._stream_completion(model, [{"role": "user", "content": "hi"}], IncrementalJSONParser())
+
+        self.assertEqual(text, '{"patient_name":"Rohit"}')
+        self.assertIn(model, extractor._json_mode_rejected)
+        self.assertNotIn("response_format", extractor.client.chat.completions.create.call_args.kwargs)
+
+    def test_extract_many_preserves_input_order(self):
+        """Test batch results come back in input order with stats."""
+        extractor = GroqLLMExtractor()
+
+        def extract(transcript, use_groq=True, language=None):
+            time.sleep(0.05 if transcript == "first" else 0.0)
+            return {"success": True, "data": {"patient_name": transcript}, "method": "rules"}
+
+        extractor.extract = extract
+        batch = extractor.extract_many(["first", "second", "third"], max_workers=3)
+
+        self.assertEqual([r["data"]["patient_name"] for r in batch["results"]], ["first", "second", "third"])
+        self.assertEqual(batch["stats"]["succeeded"], 3)
+        self.assertIn("throughput_per_min", batch["stats"])
+
+
+class TestModelRouter(unittest.TestCase):
+    """Tests for per-model circuit breakers and latency-aware routing."""
+
+    MODELS = ["model-a", "model-b"]
+
+    def test_breaker_opens_then_half_open_probe_closes(self):
+        """Test repeated failures open the breaker and a successful probe closes it."""
+        clock = _FakeClock()
+        collector = MetricsCollector()
+        router = ModelRouter(self.MODELS, failure_threshold=3, cooldown_sec=10, clock=clock,
+                             on_transition=collector.record_breaker_transition)
+
+        for _ in range(3):
+            router.record_failure("model-a", "timeout")
+        self.assertEqual(router.snapshot()["model-a"]["state"], "open")
+        self.assertEqual(router.select(), "model-b")
+
+        clock.now += 10
+        self.assertEqual(router.select(), "model-a")  # Half-open probe
+        self.assertEqual(router.select(), "model-b")  # Only one probe in flight
+        router.record_success("model-a", 0.5)
+
+        self.assertEqual(router.snapshot()["model-a"]["state"], "closed")
+        self.assertEqual([t["to"] for t in collector.breaker_transitions], ["open", "half_open", "closed"])
+
+    def test_routes_to_lowest_latency_healthy_model(self):
+        """Test the faster model wins once both have latency data."""
+        router = ModelRouter(self.MODELS)
+        self.assertEqual(router.select(), "model-a")  # No data: list order
+
+        router.record_success("model-a", 4.0)
+        router.record_success("model-b", 1.0)
+        self.assertEqual(router.select(), "model-b")
+        self.assertEqual(router.snapshot()["model-b"]["p95_sec"], 1.0)
+
+    def test_preferred_model_skipped_only_when_more_error_prone(self):
+        """Test prefer wins however slow it is (tiers differ in latency), but not with a worse error rate."""
+        router = ModelRouter(self.MODELS, failure_threshold=10)
+        router.record_success("model-a", 1.0)
+        for _ in range(3):
+            router.record_success("model-b", 5.0)  # Large model on long transcripts
+        self.assertEqual(router.select(prefer="model-b"), "model-b")
+
+        router = ModelRouter(self.MODELS, failure_threshold=10)
+        router.record_success("model-a", 1.0)
+        router.record_success("model-b", 1.0)
+        router.record_failure("model-b", "timeout")
+        self.assertEqual(router.select(prefer="model-b"), "model-a")  # 50% errors vs 0%
+
+    def test_extractor_skips_model_with_open_breaker(self):
+        """Test extraction goes to the next model while the first one's breaker is open."""
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.return_value = _stream_chunks('{"medicines":[]}')
+        extractor.model_router.trip("openai/gpt-oss-120b")
+
+        result = extractor._extract_groq("Rohit has fever.")
+
+        self.assertEqual(result["usage"]["model"], "meta-llama/llama-4-scout-17b-16e-instruct")
+        self.assertEqual(extractor.model_router.snapshot()[result["usage"]["model"]]["samples"], 1)
+        self.assertNotIn("meta-llama/llama-prompt-guard-2-8k", extractor.model_router.snapshot())  # Classifier
+
+    def test_probe_without_outcome_frees_half_open_slot(self):
+        """Test a half-open probe that ends in a 429 (no success/failure) lets the next request probe again."""
+        class RateLimitError(Exception):
+            status_code = 429
+
+        scout = "meta-llama/llama-4-scout-17b-16e-instruct"
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.MAX_RATE_LIMIT_RETRIES = 0
+        extractor.model_router = ModelRouter(extractor.GROQ_MODELS, cooldown_sec=0)
+        extractor.model_router.trip(scout)
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = RateLimitError("rate limited")
+
+        result = extractor._extract_groq("Continue same medicines, review in a week.", language="en")
+
+        self.assertEqual(result["method"], "rules")
+        self.assertEqual(extractor.model_router.snapshot()[scout]["state"], "half_open")
+        self.assertFalse(extractor.model_router.is_probing(scout))
+        self.assertEqual(extractor.model_router.select(exclude=["openai/gpt-oss-120b"]), scout)
+
+
+class TestHedgedExtraction(unittest.TestCase):
+    """Tests for hedged Groq requests."""
+
+    def test_hedge_budget_caps_hedge_rate(self):
+        """Test a 10% budget allows one hedge per ten requests."""
+        budget = HedgeBudget(10, burst=1)
+        for _ in range(10):
+            budget.record_request()
+
+        self.assertTrue(budget.try_acquire())
+        self.assertFalse(budget.try_acquire())
+
+    def test_slow_call_is_hedged_to_next_model(self):
+        """Test a call slower than recent p95 is hedged and the faster answer wins."""
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.hedge_budget = HedgeBudget(100)
+        for _ in range(extractor.HEDGE_MIN_SAMPLES):
+            extractor.model_router.record_success("openai/gpt-oss-120b", 0.02)
+
+        def slow_stream():
+            time.sleep(0.5)
+            yield from _stream_chunks('{"medicines":[{"name":"slow"}]}')
+
+        def create(**kwargs):
+            if kwargs["model"] == "openai/gpt-oss-120b":
+                return slow_stream()
+            return iter(_stream_chunks('{"medicines":[{"name":"fast"}]}'))
+
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = create
+        start = time.monotonic()
+        result = extractor._extract_groq("Rohit has fever.")
+
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertTrue(result["usage"]["hedged"])
+        self.assertEqual(result["usage"]["model"], "meta-llama/llama-4-scout-17b-16e-instruct")
+        self.assertEqual(result["data"]["medicines"][0]["name"], "fast")
+
+    def test_losing_primary_stops_streaming_partials(self):
+        """Test the primary's on_partial callbacks are muted once a hedge wins."""
+        extractor = GroqLLMExtractor()
+        extractor.hedge_budget = HedgeBudget(100)
+        for _ in range(extractor.HEDGE_MIN_SAMPLES):
+            extractor.model_router.record_success("openai/gpt-oss-120b", 0.02)
+        partials = []
+
+        def slow_stream():
+            time.sleep(0.3)
+            yield from _stream_chunks('{"medicines":[{"name":"slow"}]}')
+
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.side_effect = lambda **kwargs: (
+            slow_stream() if kwargs["model"] == "openai/gpt-oss-120b"
+            else iter(_stream_chunks('{"medicines":[{"name":"fast"}]}')))
+        parser = IncrementalJSONParser(on_medicine=partials.append)
+        model, _, _, _ = extractor._stream_hedged("openai/gpt-oss-120b", [{"role": "user", "content": "hi"}],
+                                                  parser, {"continuations": 0})
+        time.sleep(0.4)  # Let the cancelled primary run out
+
+        self.assertNotEqual(model, "openai/gpt-oss-120b")
+        self.assertIsNone(parser.on_medicine)
+        self.assertEqual(partials, [])
+
+
+class TestModelTiering(unittest.TestCase):
+    """Tests for transcript-size-aware model selection."""
+
+    def setUp(self):
+        self.selector = ModelTierSelector(small_model="small-model", large_model="large-model")
+
+    def test_short_follow_up_uses_small_model(self):
+        """Test a short English follow-up is routed to the small model."""
+        estimate = self.selector.select("Continue same medicines, review in a week.", language="en")
+
+        self.assertEqual(estimate.tier, "small")
+        self.assertEqual(estimate.model, "small-model")
+
+    def test_many_medicines_or_code_mixed_language_use_large_model(self):
+        """Test medicine-heavy and non-English consultations stay on the large model."""
+        busy = ("Take paracetamol 500 mg twice daily, amoxicillin 500 mg three times a day, "
+                "cetirizine 10 mg at night and omeprazole 20 mg before food.")
+
+        self.assertGreater(count_medicine_cues(busy), self.selector.small_max_medicine_cues)
+        self.assertEqual(self.selector.select(busy, language="en").tier, "large")
+        self.assertEqual(self.selector.select("Same marunthu continue pannunga.", language="tanglish").tier, "large")
+
+    def test_latency_saved_recorded_for_small_tier(self):
+        """Test the small-tier route reports latency saved against the large model's p50."""
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        extractor.model_router.record_success("openai/gpt-oss-120b", 5.0)
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.return_value = _stream_chunks('{"medicines":[]}')
+
+        result = extractor._extract_groq("Continue same medicines, review in a week.", language="en")
+
+        self.assertEqual(result["usage"]["tier"], "small")
+        self.assertEqual(result["usage"]["model"], extractor.tier_selector.small_model)
+        self.assertGreater(result["usage"]["latency_saved_sec"], 4.0)
+
+
+class TestRecordReplay(unittest.TestCase):
+    """Tests for the record/replay client wrapper."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = FixtureStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _fake_groq(self, create):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def test_streamed_completion_round_trip(self):
+        """Test a recorded stream is replayed chunk for chunk without the real client."""
+        text = '{"patient_name":"Rohit","medicines":[]}'
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 9]),
+                                                           finish_reason=None)])
+                  for i in range(0, len(text), 9)]
+        recorder = wrap_client(self._fake_groq(lambda **kw: iter(chunks)), "groq", mode="record", store=self.store)
+        kwargs = {"model": "openai/gpt-oss-120b", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+        recorded = "".join(c.choices[0].delta.content for c in recorder.chat.completions.create(**kwargs))
+
+        replayer = wrap_client(None, "groq", mode="replay", store=self.store)
+        replayed = "".join(c.choices[0].delta.content for c in replayer.chat.completions.create(**kwargs))
+
+        self.assertEqual(recorded, text)
+        self.assertEqual(replayed, text)
+        with self.assertRaises(FixtureNotFoundError):
+            replayer.chat.completions.create(**dict(kwargs, model="other-model"))
+
+    def test_recorded_stream_keeps_response_and_close(self):
+        """Test record mode still exposes the live stream's response headers and close()."""
+        class LiveStream:
+            response = SimpleNamespace(headers={"x-ratelimit-remaining-tokens": "100"})
+            closed = False
+
+            def __iter__(self):
+                return iter([])
+
+            def close(self):
+                self.closed = True
+
+        live = LiveStream()
+        recorder = wrap_client(self._fake_groq(lambda **kw: live), "groq", mode="record", store=self.store)
+        stream = recorder.chat.completions.create(model="openai/gpt-oss-120b", messages=[], stream=True)
+
+        self.assertEqual(stream.response.headers["x-ratelimit-remaining-tokens"], "100")
+        stream.close()
+        self.assertTrue(live.closed)
+
+    def test_audio_fixtures_keyed_by_file_content(self):
+        """Test uploaded audio matches its recording by content, not by path."""
+        paths = []
+        for name in ("a.wav", "b.wav"):
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, "wb") as f:
+                f.write(b"same audio bytes")
+            paths.append(path)
+
+        response = SimpleNamespace(text="take paracetamol", language="en")
+        client = SimpleNamespace(audio=SimpleNamespace(transcriptions=SimpleNamespace(create=lambda **kw: response)))
+        recorder = wrap_client(client, "openai", mode="record", store=self.store)
+        with open(paths[0], "rb") as f:
+            recorder.audio.transcriptions.create(file=f, model="whisper-1")
+
+        replayer = wrap_client(None, "openai", mode="replay", store=self.store)
+        with open(paths[1], "rb") as f:
+            replayed = replayer.audio.transcriptions.create(file=f, model="whisper-1")
+
+        self.assertEqual(replayed.text, "take paracetamol")
+        self.assertEqual(replayed.language, "en")
+
+
+
+class TestCostAccounting(unittest.TestCase):
+    """Tests for per-request Whisper/Groq cost accounting."""
+
+    def test_reported_tokens_and_cache_hits_are_priced(self):
+        """Test Groq's final-chunk usage is counted and cached prompt tokens show up as savings."""
+        extractor = GroqLLMExtractor()
+        extractor.available_model = "openai/gpt-oss-120b"
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='{"medicines":[]}'),
+                                                           finish_reason="stop")]),
+                  SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=SimpleNamespace(
+                      prompt_tokens=1000, completion_tokens=50,
+                      prompt_tokens_details=SimpleNamespace(cached_tokens=800))))]
+        extractor.client = MagicMock()
+        extractor.client.chat.completions.create.return_value = iter(chunks)
+
+        usage = extractor._extract_groq("Rohit has fever, take paracetamol.", language="tanglish")["usage"]
+
+        self.assertEqual((usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"]), (1000, 50, 800))
+        self.assertEqual(usage["groq_requests"], 1)
+        self.assertFalse(usage["tokens_estimated"])
+        self.assertGreater(usage["cost_usd"], 0.0)
+        self.assertGreater(usage["cache_savings_usd"], 0.0)
+
+    def test_forced_language_skips_probe_audio(self):
+        """Test a provided language sends the audio once and marks the probe as skipped."""
+        transcriber = WhisperTranscriber.__new__(WhisperTranscriber)
+        transcriber.cleaner = Mock(clean=lambda text: (text, False))
+        transcriber.lang_detector = None
+        transcriber.client = MagicMock()
+        transcriber.client.audio.transcriptions.create.return_value = SimpleNamespace(
+            text="Take paracetamol 500 mg twice daily for fever", duration=42.0)
+
+        with tempfile.NamedTemporaryFile(suffix=".wav") as audio:
+            forced = transcriber.transcribe(audio.name, language="en")
+            detected = transcriber.transcribe(audio.name)
+
+        self.assertEqual((forced.whisper_requests, forced.audio_sec_probe, forced.audio_sec_full), (1, 0.0, 42.0))
+        self.assertTrue(forced.probe_skipped)
+        self.assertEqual((detected.whisper_requests, detected.audio_sec_probe), (2, 42.0))
+        self.assertFalse(detected.probe_skipped)
+
+    def test_summary_aggregates_cost(self):
+        """Test the metrics summary totals tokens, retries, cost and savings."""
+        collector = MetricsCollector()
+        for cost, savings in ((0.01, 0.004), (0.02, 0.0)):
+            collector.record(ExtractionMetrics(
+                audio_file="a.wav", timestamp="", transcription_tier=1, transcript_length=10,
+                prompt_tokens=1000, completion_tokens=100, groq_retries=1, whisper_retries=1,
+                probe_skipped=savings > 0, cost_usd=cost, savings_usd=savings))
+
+        summary = collector.get_summary()
+
+        self.assertEqual(summary["total_prompt_tokens"], 2000)
+        self.assertEqual(summary["total_retries"], 4)
+        self.assertEqual(summary["probes_skipped"], 1)
+        self.assertEqual(summary["total_cost_usd"], "0.0300")
+        self.assertEqual(summary["avg_cost_per_request_usd"], "0.0150")
+        self.assertEqual(summary["total_savings_usd"], "0.0040")
+
+
+class TestRepetitionCollapser(unittest.TestCase):
+    """Tests for hallucination-loop collapse."""
+
+    def setUp(self):
+        self.collapser = RepetitionCollapser(min_repeats=3)
+
+    def test_drifting_loop_collapses_to_one_copy(self):
+        """Test repeated phrases (including a loop that drifts into a longer phrase) keep one copy."""
+        text = ("Take paracetamol 500 mg. Thank you. Thank you. Thank you. "
+                "thank you for watching thank you for watching thank you for watching")
+
+        collapsed, meta = self.collapser.collapse(text)
+
+        self.assertEqual(collapsed, "Take paracetamol 500 mg. thank you for watching")
+        self.assertEqual(meta["chars_removed"], len(text) - len(collapsed))
+        self.assertGreater(meta["tokens_removed"], 0)
+
+    def test_distinct_or_rare_repeats_are_kept(self):
+        """Test similar medicine lines and a phrase said only twice are left alone."""
+        text = "paracetamol 500 mg twice a day, ibuprofen 500 mg twice a day. review review next week"
+
+        collapsed, meta = self.collapser.collapse(text)
+
+        self.assertEqual(collapsed, text)
+        self.assertEqual(meta["runs"], 0)
+
+    def test_line_breaks_and_spacing_survive_collapse(self):
+        """Test only the dropped copies are cut: newlines and spacing elsewhere are untouched."""
+        text = "Doctor:  take paracetamol.\nPatient: ok ok ok ok\n\nDoctor: review  next week."
+
+        collapsed, meta = self.collapser.collapse(text)
+
+        self.assertEqual(collapsed, "Doctor:  take paracetamol.\nPatient: ok\n\nDoctor: review  next week.")
+        self.assertEqual(meta["runs"], 1)
+
+
+class TestTranscriptCompactor(unittest.TestCase):
+    """Tests for LLM-input transcript compaction."""
+
+    CONSULTATION = (
+        "Hello doctor, good morning. How was the traffic today? It was terrible, it took an hour. "
+        "My cousin is getting married next month so we are all busy. The weather has been hot. "
+        "I have a sore throat and fever since three days. "
+        "Take amoxicillin 500 mg three times a day for five days. "
+        "We went to the beach last weekend and the kids loved it. The sea was calm."
+    )
+
+    def test_small_talk_dropped_clinical_sentences_kept(self):
+        """Test greetings/small talk are dropped while complaints and medicines survive."""
+        result = TranscriptCompactor(context_sentences=0, min_tokens=0).compact(self.CONSULTATION)
+
+        self.assertTrue(result.applied)
+        self.assertIn("amoxicillin 500 mg", result.text)
+        self.assertIn("sore throat", result.text)
+        self.assertNotIn("beach", result.text)
+        self.assertLess(result.kept_ratio, 0.8)
+        self.assertEqual(result.tokens_saved, result.original_tokens - result.compacted_tokens)
+
+    def test_short_transcript_passes_through(self):
+        """Test transcripts under the threshold are sent unchanged."""
+        result = TranscriptCompactor(min_tokens=1000).compact(self.CONSULTATION)
+
+        self.assertFalse(result.applied)
+        self.assertEqual(result.text, self.CONSULTATION)
+        self.assertEqual(result.kept_ratio, 1.0)
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests for the staged pipeline engine."""
+
+    def test_stages_timed_skipped_and_emitted(self):
+        """Test each stage is timed, skipped stages contribute defaults and results are emitted."""
+        clock = _FakeClock()
+
+        def transcribe(ctx):
+            clock.sleep(2.0)
+            return {"transcript": ctx["audio"].upper()}
+
+        pipeline = Pipeline([
+            Stage("transcribe", transcribe, inputs=("audio",), outputs=("transcript",)),
+            Stage("compact", lambda ctx: {"compacted": "x"}, inputs=("transcript",), outputs=("compacted",),
+                  skip_if=lambda ctx: True, defaults={"compacted": None}),
+            Stage("extract", lambda ctx: clock.sleep(0.5) or {"n": len(ctx["transcript"])},
+                  inputs=("transcript", "compacted"), outputs=("n",)),
+        ], initial_inputs=("audio",), clock=clock)
+        emitted = []
+
+        run = pipeline.run({"audio": "abc"}, on_stage=emitted.append)
+
+        self.assertEqual(run.context["n"], 3)
+        self.assertIsNone(run.context["compacted"])
+        self.assertEqual(run.timings, {"transcribe": 2.0, "extract": 0.5})
+        self.assertEqual([(r.name, r.status) for r in emitted],
+                         [("transcribe", "ok"), ("compact", "skipped"), ("extract", "ok")])
+
+    def test_stage_start_precedes_finish_for_stages_that_run(self):
+        """Test on_stage_start fires before each run stage (not skipped ones); a failing callback is ignored."""
+        events = []
+
+        def on_stage_start(name):
+            events.append(("start", name))
+            raise RuntimeError("client went away")
+
+        pipeline = Pipeline([
+            Stage("transcribe", lambda ctx: {"transcript": "abc"}, outputs=("transcript",)),
+            Stage("compact", lambda ctx: {}, skip_if=lambda ctx: True),
+            Stage("extract", lambda ctx: {"n": 3}, inputs=("transcript",), outputs=("n",)),
+        ])
+        run = pipeline.run({}, on_stage=lambda r: events.append(("finish", r.name)), on_stage_start=on_stage_start)
+
+        self.assertEqual(run.context["n"], 3)
+        self.assertEqual(events, [("start", "transcribe"), ("finish", "transcribe"), ("finish", "compact"),
+                                  ("start", "extract"), ("finish", "extract")])
+
+    def test_stop_pipeline_ends_run_early(self):
+        """Test a stage can end the run with a final result."""
+        def route(ctx):
+            raise StopPipeline({"success": False, "error": "Audio appears corrupted or missing"}, "corrupted")
+
+        pipeline = Pipeline([Stage("route", route), Stage("extract", lambda ctx: {})])
+        run = pipeline.run({})
+
+        self.assertEqual(run.stopped.result["success"], False)
+        self.assertEqual([r.status for r in run.results], ["stopped"])
+
+    def test_run_async_matches_run_and_offloads_io_stages(self):
+        """Test run_async gives run()'s context, runs io stages in the I/O executor and awaits coroutines."""
+        import asyncio
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        async def extract(ctx):
+            return {"n": len(ctx["transcript"])}
+
+        threads = {}
+        pipeline = Pipeline([
+            Stage("transcribe", lambda ctx: threads.update(io=threading.current_thread().name)
+                  or {"transcript": ctx["audio"].upper()}, inputs=("audio",), outputs=("transcript",), io=True),
+            Stage("extract", extract, inputs=("transcript",), outputs=("n",)),
+        ], initial_inputs=("audio",))
+
+        with ThreadPoolExecutor(1, thread_name_prefix="io-test") as io_executor:
+            run = asyncio.run(pipeline.run_async({"audio": "abc"}, io_executor=io_executor))
+
+        self.assertEqual(run.context, {"audio": "abc", "transcript": "ABC", "n": 3})
+        self.assertTrue(threads["io"].startswith("io-test"))
+        self.assertEqual([r.status for r in run.results], ["ok", "ok"])
+
+    def test_missing_input_rejected_at_construction(self):
+        """Test a stage reading an output no earlier stage produces is a wiring error."""
+        with self.assertRaises(ValueError):
+            Pipeline([Stage("extract", lambda ctx: {}, inputs=("transcript",))])
+
+
+class TestReporting(unittest.TestCase):
+    """Tests for the progress reporters."""
+
+    def setUp(self):
+        self.prescription = Prescription(
+            patient_name="Ravi Kumar", complaints=["fever"], diagnosis=["viral fever"],
+            medicines=[{"name": "Paracetamol", "dose": "500mg"}], tests=[], advice=["rest"]
+        )
+
+    def _stdout(self, reporter):
+        import io
+        from contextlib import redirect_stdout
+        out = io.StringIO()
+        with redirect_stdout(out):
+            reporter.report("start")
+            reporter.report("cleaned", transcript="Patient Ravi Kumar has fever", was_modified=False)
+            reporter.report("saved", prescription=self.prescription, prescription_id=7)
+        return out.getvalue()
+
+    def test_only_console_reporter_prints(self):
+        """Test the null and event sinks write nothing to stdout; console prints the report."""
+        self.assertEqual(self._stdout(make_reporter("null")), "")
+        self.assertEqual(self._stdout(make_reporter("events")), "")
+        console = self._stdout(make_reporter("console"))
+        self.assertIn("Saved to database (ID: 7)", console)
+        self.assertIsInstance(make_reporter("bogus"), ConsoleReporter)
+
+    def test_event_reporter_logs_no_patient_content(self):
+        """Test structured events carry stage timings and counts but no transcript or prescription text."""
+        import json
+        reporter = EventReporter()
+        metrics = ExtractionMetrics(
+            audio_file="ravi_kumar.mp3", timestamp="t", transcription_tier=1, transcript_length=100,
+            cleaned_length=90, transcript_was_modified=False, detected_language="en",
+            routing_quality_score=0.9, routing_decision="groq_only", extraction_method="groq",
+            medicines_extracted=1, diagnosis_extracted=1, validation_passed=True,
+            validation_errors=[], validation_warnings=["Ravi Kumar: dose unclear"], confidence=0.9,
+            processing_time_sec=1.5, stage_timings={"extract": 1.2}
+        )
+
+        with self.assertLogs("voice_rx.events", level="INFO") as logs:
+            reporter.stage_finished(StageResult("extract", "ok", 1.2))
+            reporter.request_finished(7, metrics)
+
+        stage, request = (json.loads(record.getMessage()) for record in logs.records)
+        self.assertEqual(stage, {"event": "stage", "stage": "extract", "status": "ok", "duration_ms": 1200.0})
+        self.assertEqual(request["prescription_id"], 7)
+        self.assertEqual(request["stages_ms"], {"extract": 1200.0})
+        self.assertNotIn("Ravi", "\n".join(logs.output))
+
+
+class TestBatch(unittest.TestCase):
+    """Tests for the batch runner."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name in ("a.mp3", "b.wav", "notes.txt"):
+            with open(os.path.join(self.dir, name), "w") as f:
+                f.write(name)
+        self.output = os.path.join(self.dir, "out.ndjson")
+
+    def _system(self):
+        system = Mock()
+        system.process.side_effect = lambda path, **kwargs: {"success": not path.endswith(".wav"), "path": path}
+        return system
+
+    def test_results_streamed_and_rerun_skips_checkpointed(self):
+        """Test each result becomes an NDJSON line and a second run processes nothing."""
+        import json
+        inputs = expand_inputs([self.dir])
+        self.assertEqual([os.path.basename(p) for p in inputs], ["a.mp3", "b.wav"])
+
+        progress = run_batch(self._system(), inputs, self.output, Checkpoint(self.output + ".ckpt"), workers=2)
+        with open(self.output) as f:
+            records = {os.path.basename(r["input"]): r["status"] for r in map(json.loads, f)}
+        self.assertEqual(records, {"a.mp3": "ok", "b.wav": "failed"})
+        self.assertEqual((progress.completed, progress.failed), (2, 1))
+
+        system = self._system()
+        rerun = run_batch(system, inputs, self.output, Checkpoint(self.output + ".ckpt"))
+        self.assertEqual((rerun.skipped, rerun.completed), (2, 0))
+        system.process.assert_not_called()
+
+        retry = run_batch(system, inputs, self.output, Checkpoint(self.output + ".ckpt"), retry_failed=True)
+        self.assertEqual((retry.skipped, retry.completed), (1, 1))
+
+    def test_input_deleted_mid_batch_is_still_checkpointed(self):
+        """Test a file removed while it is processed does not abort the batch."""
+        inputs = expand_inputs([self.dir])
+        system = Mock()
+        system.process.side_effect = lambda path, **kwargs: os.remove(path) or {"success": True}
+
+        progress = run_batch(system, inputs, self.output, Checkpoint(self.output + ".ckpt"))
+
+        self.assertEqual((progress.completed, progress.failed), (2, 0))
+        self.assertEqual(Checkpoint(self.output + ".ckpt").entries[inputs[0]]["status"], "ok")
+
+    def test_eta_from_throughput(self):
+        """Test throughput and ETA follow the completed count."""
+        clock = _FakeClock()
+        progress = BatchProgress(total=10, clock=clock)
+        self.assertIsNone(progress.eta_sec)
+
+        clock.sleep(30.0)
+        progress.update("ok")
+        progress.update("ok")
+
+        self.assertAlmostEqual(progress.files_per_min, 4.0)
+        self.assertAlmostEqual(progress.eta_sec, 120.0)
+
+
+class TestStageCheckpoints(unittest.TestCase):
+    """Tests for per-consultation stage checkpoints."""
+
+    def setUp(self):
+        self.store = StageCheckpointStore(os.path.join(tempfile.mkdtemp(), "ckpt.db"),
+                                          types=(TranscriptionResult, Prescription))
+
+    def test_outputs_round_trip_with_types(self):
+        """Test dataclass outputs come back as the same types and transient keys are dropped."""
+        tx = TranscriptionResult(success=True, text="take paracetamol", audio_sec_full=12.5)
+        self.store.save("c1", "transcribe", {"tx_result": tx, "transcript": tx.text}, seq=0)
+        self.store.save("c1", "extract", {"extract_result": {"data": {"medicines": []}, "upgrade_future": object()},
+                                          "prescription": Prescription(patient_name="Ravi")}, seq=1)
+
+        restored = self.store.load("c1")
+
+        self.assertEqual(restored["transcribe"]["tx_result"], tx)
+        self.assertEqual(restored["extract"]["prescription"].patient_name, "Ravi")
+        self.assertNotIn("upgrade_future", restored["extract"]["extract_result"])
+        self.assertEqual(self.store.discard("c1", from_stage="extract", stage_order=["transcribe", "extract"]), 1)
+        self.assertEqual(list(self.store.load("c1")), ["transcribe"])
+
+    def test_pipeline_resumes_after_last_completed_stage(self):
+        """Test a retry replays checkpointed stages and only re-runs the failed one onwards."""
+        calls = []
+
+        def stage(name, out):
+            return Stage(name, lambda ctx: calls.append(name) or {out: name}, outputs=(out,))
+
+        pipeline = Pipeline([stage("transcribe", "transcript"), stage("extract", "data"), stage("persist", "id")])
+        pipeline.run({}, checkpoint=lambda name, outputs: self.store.save("c2", name, outputs))
+        saved = self.store.load("c2")
+        del saved["extract"]  # e.g. extraction failed last time; the stale persist checkpoint is ignored
+        calls.clear()
+
+        run = pipeline.run({}, restored=saved)
+
+        self.assertEqual(calls, ["extract", "persist"])
+        self.assertEqual(run.restored, ["transcribe"])
+        self.assertEqual(run.context["transcript"], "transcribe")
+
+    def test_late_upgrade_replaces_provisional_checkpoint(self):
+        """Test a late Groq upgrade is checkpointed, and a provisional checkpoint alone is re-extracted."""
+        from concurrent.futures import Future
+        from datetime import datetime
+        from medical_system_v2 import MedicalSystem
+        system = MedicalSystem.__new__(MedicalSystem)
+        system.pipeline, system.checkpoints, system.artifacts = system._build_pipeline(), self.store, None
+        system.compactor, system.database, system.validator = None, MagicMock(), ValidationLayer()
+        provisional = {"extract_result": {"method": "rules", "data": {}, "provisional": True},
+                       "prescription": Prescription(patient_name="Ravi")}
+        inputs = {"audio_path": "a.wav", "language": None}
+        self.store.save("c3", "__inputs__", inputs, seq=-1)
+        self.store.save("c3", "transcribe", {"tx_result": TranscriptionResult(success=True, text="x"),
+                                             "transcript": "x"}, seq=0)
+        self.store.save("c3", "extract", provisional, seq=7)
+        self.store.save("c3", "persist", {"prescription_id": 42}, seq=9)
+
+        context, restored, _ = system._prepare_run("a.wav", None, 20, None, "c3")  # Resumed before the upgrade
+        self.assertEqual(list(restored), ["transcribe"])
+        self.assertEqual(context["existing_prescription_id"], 42)
+
+        self.store.save("c3", "extract", provisional, seq=7)
+        upgrade = Future()
+        upgrade.set_result({"method": "groq", "data": {"patient_name": "Ravi", "medicines": []}, "usage": {}})
+        system._apply_upgrade(upgrade, {"prescription_id": 42}, provisional["prescription"], "groq_only",
+                              ExtractionMetrics(audio_file="a.wav", timestamp="", transcription_tier=1,
+                                                transcript_length=1), datetime.now(), "c3")
+
+        saved = self.store.load("c3")
+        self.assertEqual(saved["extract"]["extract_result"]["method"], "groq")
+        self.assertIn("validate", saved)
+        system.database.update.assert_called_once()
+
+
+class TestArtifactStore(unittest.TestCase):
+    """Tests for the content-addressed artifact store."""
+
+    def setUp(self):
+        self.store = ArtifactStore(tempfile.mkdtemp(), codec="zlib")
+
+    def test_identical_content_stored_once_and_streamed_back(self):
+        """Test duplicate puts share one compressed blob and reads stream the original bytes."""
+        audio = os.urandom(4096) + b"\0" * 3 * 1024 * 1024
+        first = self.store.put_bytes(audio, "audio_raw", "c1")
+        second = self.store.put_bytes(audio, "audio_raw", "c2")
+
+        self.assertEqual(first.sha256, second.sha256)
+        self.assertLess(first.stored_size, first.size // 10)
+        chunks = list(self.store.iter_chunks(first.sha256, chunk_size=1 << 20))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), audio)
+        stats = self.store.stats()
+        self.assertEqual((stats["blobs"], stats["references"]), (1, 2))
+
+    def test_known_hash_skips_reading_stored_file(self):
+        """Test put_file with an upload's sha256 references the stored blob without opening the file."""
+        path = os.path.join(tempfile.mkdtemp(), "visit.wav")
+        with open(path, "wb") as f:
+            f.write(b"RIFF audio bytes")
+        first = self.store.put_file(path, "audio_raw", "c1")
+
+        with patch("builtins.open", side_effect=AssertionError("file re-read")):
+            second = self.store.put_file(path, "audio_raw", "c2", sha256=first.sha256)
+
+        self.assertEqual((second.sha256, second.size), (first.sha256, first.size))
+
+    def test_transcript_versions_listed_per_consultation(self):
+        """Test each put is a new version of its kind, listed in order with its metadata."""
+        self.store.put_text("fever since 3 days", "transcript", "c1", {"stage": "transcribe"})
+        self.store.put_text("fever since three days", "transcript", "c1", {"stage": "normalize"})
+        extraction = self.store.put_json({"medicines": [{"name": "paracetamol"}]}, "extraction", "c1")
+
+        transcripts = self.store.list(consultation_id="c1", kind="transcript")
+        self.assertEqual([(a.version, a.metadata["stage"]) for a in transcripts],
+                         [(1, "transcribe"), (2, "normalize")])
+        self.assertEqual(self.store.read_text(transcripts[1].sha256), "fever since three days")
+        self.assertEqual(self.store.read_json(extraction.sha256)["medicines"][0]["name"], "paracetamol")
+
+    def test_late_upgrade_archived_after_provisional_extraction(self):
+        """Test a late Groq upgrade is archived as the next extraction version of its consultation."""
+        from concurrent.futures import Future
+        from datetime import datetime
+        from medical_system_v2 import MedicalSystem
+        system = MedicalSystem.__new__(MedicalSystem)
+        system.artifacts, system.database, system.validator = self.store, MagicMock(), ValidationLayer()
+        archive = system._artifact_writer("a.wav", "c1")
+        provisional = Prescription(patient_name="Ravi")
+        archive("extract", {"extract_result": {"method": "advanced-rules", "data": {}, "provisional": True}})
+
+        upgrade = Future()
+        upgrade.set_result({"method": "groq", "data": {"patient_name": "Ravi", "medicines": []}, "usage": {}})
+        system._apply_upgrade(upgrade, {"prescription_id": 42}, provisional, "groq_only",
+                              ExtractionMetrics(audio_file="a.wav", timestamp="", transcription_tier=1,
+                                                transcript_length=1), datetime.now(), archive=archive)
+
+        extractions = self.store.list(consultation_id="c1", kind="extraction")
+        self.assertEqual([a.metadata["method"] for a in extractions], ["advanced-rules", "groq"])
+        self.assertTrue(self.store.read_json(extractions[0].sha256)["provisional"])
+
+
+class TestJobQueue(unittest.TestCase):
+    """Tests for the persistent job queue."""
+
+    def setUp(self):
+        self.db_file = os.path.join(tempfile.mkdtemp(), "jobs.db")
+
+    def test_jobs_run_with_progress_and_failures_recorded(self):
+        """Test a job moves to done with its result and progress; a raising handler fails it."""
+        def handler(job, progress):
+            if job.payload["audio_path"] == "bad.wav":
+                raise RuntimeError("Transcription failed")
+            progress({"stage": "extract", "stages_completed": 8})
+            return {"success": True, "medicines": ["paracetamol"]}
+
+        queue = JobQueue(handler, SQLiteJobBackend(self.db_file))
+        good, bad = queue.submit({"audio_path": "good.wav"}), queue.submit({"audio_path": "bad.wav"})
+
+        self.assertEqual(queue.get(good).status, "queued")
+        self.assertEqual(queue.run_pending(), 2)
+        self.assertEqual(queue.get(good).status, "done")
+        self.assertEqual(queue.get(good).result["medicines"], ["paracetamol"])
+        self.assertEqual(queue.get(good).progress["stage"], "extract")
+        self.assertEqual(queue.get(bad).status, "failed")
+        self.assertIn("Transcription failed", queue.get(bad).error)
+
+    def test_interrupted_job_reclaimed_after_restart(self):
+        """Test a job whose worker died is claimed again by a new process until attempts run out."""
+        job_id = JobQueue(None, SQLiteJobBackend(self.db_file)).submit({"audio_path": "a.wav"})
+        SQLiteJobBackend(self.db_file).claim(lease_sec=0.0, max_attempts=2)  # Worker dies mid-job
+
+        restarted = SQLiteJobBackend(self.db_file)  # e.g. after a server restart
+        time.sleep(0.01)
+        job = restarted.claim(lease_sec=0.0, max_attempts=2)
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+        time.sleep(0.01)
+        self.assertIsNone(restarted.claim(lease_sec=0.0, max_attempts=2))
+        self.assertEqual(restarted.get(job_id).status, "failed")
+        self.assertEqual([e.event for e in restarted.events(job_id)], ["failed"])  # Ends waiting event streams
+
+    def test_event_log_ordered_and_resumable(self):
+        """Test handler events land between started and done, and events(after_seq) resumes a stream."""
+        def handler(job, progress):
+            queue.emit(job.id, "stage_start", {"stage": "transcribe"})
+            queue.emit(job.id, "transcript", {"stage": "transcribe", "text": "take paracetamol"})
+            return {"success": True}
+
+        queue = JobQueue(handler, SQLiteJobBackend(self.db_file))
+        job_id = queue.submit({"audio_path": "a.wav"})
+        queue.run_pending()
+
+        events = queue.events(job_id)
+        self.assertEqual([e.event for e in events], ["started", "stage_start", "transcript", "done"])
+        self.assertEqual(events[-1].data["result"], {"success": True})
+        resumed = SQLiteJobBackend(self.db_file).events(job_id, after_seq=events[1].seq)
+        self.assertEqual([e.event for e in resumed], ["transcript", "done"])
+
+    def test_async_queue_bounds_concurrency_and_keeps_event_order(self):
+        """Test async jobs run at most `concurrency` at once, with events recorded in emit order."""
+        import asyncio
+        running, peak = [0], [0]
+
+        async def handler(job, progress):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            queue.emit(job.id, "stage_start", {"stage": "transcribe"})
+            progress({"stage": "transcribe"})
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+            return {"success": True}
+
+        async def run():
+            await queue.start()
+            job_ids = [await queue.submit({"audio_path": f"{i}.wav"}) for i in range(6)]
+            while [(await queue.get(job_id)).status for job_id in job_ids] != ["done"] * len(job_ids):
+                await queue.wait_for_events(timeout=0.5)
+            await queue.stop()
+            return job_ids
+
+        queue = AsyncJobQueue(handler, SQLiteJobBackend(self.db_file), concurrency=2, poll_interval=0.05)
+        job_ids = asyncio.run(run())
+
+        self.assertEqual(peak[0], 2)
+        self.assertEqual([e.event for e in queue.backend.events(job_ids[0])], ["started", "stage_start", "done"])
+        self.assertEqual(queue.backend.get(job_ids[0]).progress["stage"], "transcribe")
+
+    def test_upgrade_finished_before_handler_returns_lands_after_done(self):
+        """Test a late result that arrives inside the handler is written after done, not overwritten by it."""
+        from concurrent.futures import Future
+        upgraded = {"success": True, "provisional": False, "upgraded": True}
+
+        def on_upgrade(job_id, result):
+            def record():
+                queue.backend.update(job_id, result=result)
+                queue.emit(job_id, "upgraded", {"result": result})
+            queue.after_done(job_id, record)
+
+        def handler(job, progress):
+            upgrade_future = Future()
+            upgrade_future.add_done_callback(lambda done: on_upgrade(job.id, done.result()))
+            upgrade_future.set_result(upgraded)  # Groq finished during validate/persist
+            return {"success": True, "provisional": True}
+
+        queue = JobQueue(handler, SQLiteJobBackend(self.db_file))
+        job_id = queue.submit({"audio_path": "a.wav"})
+        queue.run_pending()
+
+        self.assertEqual(queue.get(job_id).result, upgraded)
+        self.assertEqual([e.event for e in queue.events(job_id)], ["started", "done", "upgraded"])
+        on_upgrade(job_id, dict(upgraded, medicines=[]))  # Job no longer running: written at once
+        self.assertEqual(queue.get(job_id).result["medicines"], [])
+
+
+class TestSessionRegistry(unittest.TestCase):
+    """Tests for the concurrent recording session registry."""
+
+    def test_concurrent_sessions_keep_their_own_audio(self):
+        """Test many sessions uploading at once each get exactly their own bytes (spilled past spool_bytes)."""
+        from concurrent.futures import ThreadPoolExecutor
+        registry = SessionRegistry(tempfile.mkdtemp(), max_sessions=40, spool_bytes=256)
+
+        def consultation(i):
+            session = registry.start()
+            for _ in range(10):
+                registry.append(session.id, bytes([i]) * 100)
+            return i, registry.stop(session.id)
+
+        with ThreadPoolExecutor(40) as pool:
+            outcomes = list(pool.map(consultation, range(40)))
+
+        for i, audio_file in outcomes:
+            with open(audio_file, "rb") as f:
+                self.assertEqual(f.read(), bytes([i]) * 1000)
+        self.assertEqual(registry.stats()["active"], 0)
+
+    def test_idle_sessions_reaped_and_limits_enforced(self):
+        """Test a full registry refuses new sessions until an idle one expires; size cap rejects chunks."""
+        clock = _FakeClock()
+        registry = SessionRegistry(tempfile.mkdtemp(), max_sessions=1, idle_timeout_sec=60,
+                                   max_session_bytes=10, clock=clock)
+        idle = registry.start("doctor-a")
+        with self.assertRaises(ValueError):
+            registry.append(idle.id, b"x" * 11)
+        with self.assertRaises(SessionLimitError):
+            registry.start("doctor-b")
+
+        clock.sleep(61)
+        self.assertEqual(registry.start("doctor-b").id, "doctor-b")
+        self.assertIsNone(registry.get("doctor-a"))
+        with self.assertRaises(KeyError):
+            registry.append("doctor-a", b"late chunk")
+
+def _wav_bytes(seconds, rate=16000):
+    """16-bit mono WAV of silence"""
+    import io
+    import wave
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\0\0" * int(rate * seconds))
+    return buffer.getvalue()
+
+
+class TestUploadStream(unittest.TestCase):
+    """Tests for streamed, incrementally hashed uploads."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def _temp_files(self):
+        return [name for name in os.listdir(self.dir) if name.endswith(".upload")]
+
+    def test_chunked_upload_hashed_spooled_and_renamed(self):
+        """Test chunks are hashed as they arrive, spill to disk past spool_bytes and save() moves them."""
+        import hashlib
+        audio = _wav_bytes(3)
+        upload = StreamingUpload(max_bytes=1 << 20, spool_bytes=16 * 1024, spool_dir=self.dir)
+        for i in range(0, len(audio), 8192):
+            upload.write(audio[i:i + 8192])
+        self.assertEqual(len(self._temp_files()), 1)
+
+        info = upload.save(os.path.join(self.dir, "consultation.wav"))
+
+        self.assertEqual(info.sha256, hashlib.sha256(audio).hexdigest())
+        self.assertEqual((info.size, info.format, info.duration_sec), (len(audio), "wav", 3.0))
+        with open(info.path, "rb") as f:
+            self.assertEqual(f.read(), audio)
+        self.assertEqual(self._temp_files(), [])
+
+    def test_rejected_before_body_finishes(self):
+        """Test non-audio is refused on the first chunk and over-long audio as soon as it crosses the limit."""
+        with self.assertRaises(UploadRejected) as rejected:
+            StreamingUpload(max_bytes=1 << 20).write(b"<html><body>not audio</body></html>")
+        self.assertEqual(rejected.exception.status, 415)
+
+        audio = _wav_bytes(10)
+        upload = StreamingUpload(max_bytes=1 << 20, max_duration_sec=2, spool_bytes=4096, spool_dir=self.dir)
+        with self.assertRaises(UploadRejected):
+            for i in range(0, len(audio), 8192):
+                upload.write(audio[i:i + 8192])
+        self.assertLess(upload.size, len(audio) // 2)
+        self.assertEqual(self._temp_files(), [])
+
+
+class TestRequestCoalescer(unittest.TestCase):
+    """Tests for single-flight coalescing of duplicate uploads."""
+
+    def test_duplicates_join_in_flight_and_recent_jobs(self):
+        """Test duplicates get the in-flight job id, then the finished one until the window passes."""
+        clock = _FakeClock()
+        metrics = MetricsCollector()
+        coalescer = RequestCoalescer(window_sec=60, clock=clock, on_coalesced=metrics.record_coalesced)
+
+        flight, leader = coalescer.join("abc:20")
+        self.assertTrue(leader)
+        coalescer.submitted(flight)
+        duplicate, leader = coalescer.join("abc:20")
+        self.assertEqual((duplicate.job_id, leader), (flight.job_id, False))
+        self.assertTrue(duplicate.wait_submitted(0))
+        self.assertTrue(coalescer.join("abc:None")[1])  # Other deadline, other result
+
+        coalescer.finish("abc:20", flight.job_id, succeeded=True)
+        retry, leader = coalescer.join("abc:20")
+        self.assertEqual((retry.job_id, leader, retry.finished), (flight.job_id, False, True))
+
+        clock.sleep(61)
+        self.assertNotEqual(coalescer.join("abc:20")[0].job_id, flight.job_id)
+        summary = metrics.get_summary()
+        self.assertEqual(summary["coalesced_requests"], 2)
+        self.assertEqual(summary["coalesced_distribution"], {"in_flight": 1, "completed": 1})
+
+    def test_failed_or_unsubmitted_jobs_not_joined(self):
+        """Test a failed job is forgotten, and followers of an abandoned submit are released."""
+        coalescer = RequestCoalescer(window_sec=60)
+        flight, _ = coalescer.join("abc:20")
+        result = {"success": False, "error": "Transcription failed"}  # How the pipeline reports a failure
+        coalescer.finish("abc:20", flight.job_id, succeeded=bool(result.get("success")))
+        retry, leader = coalescer.join("abc:20")
+        self.assertTrue(leader)
+        self.assertNotEqual(retry.job_id, flight.job_id)
+
+        follower, _ = coalescer.join("abc:20")
+        coalescer.abandon(retry)
+        self.assertFalse(follower.wait_submitted(1))
+        self.assertTrue(coalescer.join("abc:20")[1])
+        self.assertTrue(coalescer.join(None)[1])  # Hash unknown: never coalesced
 
 # Test runner
 if __name__ == '__main__':